@@ -20,14 +20,58 @@
 ########################################################################
 
 from mylogger import mylogger,nulLogger
-from  agileTools import timestring_from_date
+from  agileTools import timestring_from_date, split_date_range, time_now, stub_url, default_stub_host, default_stub_port
+from agileCache import OctopusAgileCache
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone, timedelta
 import requests
+import random
+import threading
+import time
 import json
 import os
 import configparser
 
 empty_rate=-999.99
 
+# HTTP tunables - overridden from the [settings] section of the config file
+# seconds to wait for the connection and then for each read
+default_api_timeout = 30
+# attempts made at a request before giving up
+default_api_retries = 5
+# first backoff delay in seconds, doubled on each retry up to the cap
+default_api_backoff = 1.0
+default_api_backoff_cap = 60.0
+# connections kept alive in the session pool
+default_api_pool = 4
+# windows fetched at once by a backfill and the days in each window - 
+# 31 days of half hours (1488) fits in one page of rates 
+default_api_workers = 4
+default_api_window_days = 31
+
+# largest page the API will return for each kind of data
+rates_page_size = 1500
+usage_page_size = 25000
+
+# where cached API data is kept when [filepaths] cache_folder is not set
+default_cache_folder = "~/.cache/agileTriggers"
+# file in the cache folder holding the region of each meter
+region_cache_file = "region_cache.json"
+# days before a cached region is looked up again
+default_region_cache_days = 30
+
+# megabytes of API responses kept in the cache folder (0 turns it off)
+default_api_cache_mb = 50
+# hours after the end of a window before its data is treated as final and
+# served from the cache without asking again - consumption arrives late
+default_rates_settle_hours = 1
+default_usage_settle_hours = 48
+
+# responses worth retrying - throttled or a server side failure
+retry_status = (429, 500, 502, 503, 504)
+
 class OctopusAgileAPI:
     # Octopus account data
     elecMPAN = None
@@ -35,8 +79,10 @@ class OctopusAgileAPI:
     apiKey = None
     productCode = "AGILE-18-02-21"
     octopusUrl  = None
+    stubbed     = False
 #filepaths
     binFolder     = None
+    cacheFolder   = None
 # settings
     app_site_name = None
     agile_debug   = False
@@ -47,7 +93,23 @@ class OctopusAgileAPI:
     consumptionUrl    = None
     costUrl     = None
     tarrifCode  = None
+    region_cache_days = default_region_cache_days
+# response cache and the hours before a window is final
+    cache       = None
+    rates_settle_hours = default_rates_settle_hours
+    usage_settle_hours = default_usage_settle_hours
     valid = 0 
+# http session and tunables
+    session     = None
+    api_timeout = default_api_timeout
+    api_retries = default_api_retries
+    api_backoff = default_api_backoff
+    api_pool    = default_api_pool
+    api_workers = default_api_workers
+    api_window_days = default_api_window_days
+# request counters - see get_stats - shared by the backfill workers
+    stats       = None
+    stats_lock  = None
 # logging
     log=None
 
@@ -67,6 +129,8 @@ class OctopusAgileAPI:
 
         self.__set_config(theConfig)
 
+        self.__build_session()
+
         if self.api_ready():
             self.log.debug("__init__ - set_api_ready - building urls")
             self.build_api_url()
@@ -87,8 +151,22 @@ class OctopusAgileAPI:
         self.apiKey     = theConfig.read_value('octopus_account','OctopusAPIKey')
         self.octopusUrl = theConfig.read_value('octopus_account','OctopusUrl')
 
+        # point every call at a local octopusStub.py instead of Octopus
+        if theConfig.read_value('octopus_stub','enabled') == "True":
+            host = theConfig.read_value('octopus_stub','host')
+            port = theConfig.read_value('octopus_stub','port')
+            if host == None: host = default_stub_host
+            if port == None: port = default_stub_port
+            self.octopusUrl = stub_url(host, port)
+            self.stubbed = True
+            self.log.info(f"octopus_stub enabled - using {self.octopusUrl}")
+
         self.log.debug("STARTED process_config_file: filepaths")
         self.binFolder  = theConfig.read_value('filepaths','bin_folder')
+        self.cacheFolder = self.__set_cache_folder(theConfig.read_value('filepaths','cache_folder'))
+        if self.stubbed == True and self.cacheFolder != None:
+            # keep the stub's data apart from the real cached responses
+            self.cacheFolder = self.__set_cache_folder(os.path.join(self.cacheFolder, "stub"))
 
         
     
@@ -97,6 +175,31 @@ class OctopusAgileAPI:
         
         
         self.app_site_name  = theConfig.read_value('settings','app_site_name')
+
+        self.log.debug("STARTED process_config_file: http settings")
+        value = theConfig.read_value('settings','api_timeout')
+        if value != None: self.api_timeout = float(value)
+        value = theConfig.read_value('settings','api_retries')
+        if value != None: self.api_retries = max(int(value), 1)
+        value = theConfig.read_value('settings','api_backoff')
+        if value != None: self.api_backoff = float(value)
+        value = theConfig.read_value('settings','api_pool')
+        if value != None: self.api_pool = max(int(value), 1)
+        value = theConfig.read_value('settings','api_workers')
+        if value != None: self.api_workers = max(int(value), 1)
+        value = theConfig.read_value('settings','api_window_days')
+        if value != None: self.api_window_days = max(int(value), 1)
+        value = theConfig.read_value('settings','region_cache_days')
+        if value != None: self.region_cache_days = float(value)
+        value = theConfig.read_value('settings','rates_settle_hours')
+        if value != None: self.rates_settle_hours = float(value)
+        value = theConfig.read_value('settings','usage_settle_hours')
+        if value != None: self.usage_settle_hours = float(value)
+
+        cache_mb = default_api_cache_mb
+        value = theConfig.read_value('settings','api_cache_mb')
+        if value != None: cache_mb = float(value)
+        self.cache = OctopusAgileCache(self.cacheFolder, int(cache_mb * 1024 * 1024), self.log)
         
 
         # Check to see if key values needed for API calls are set (MPAN)
@@ -122,23 +225,394 @@ class OctopusAgileAPI:
         self.log.debug("FINISHED process_config_file")
 
 ##############################################################################
-#  build_api_url -  build the api urls we use
-# ##############################################################################
+#  __set_cache_folder - create the folder for cached API data, returns the
+#  folder or None (no caching) if it can not be created
+##############################################################################
+    def __set_cache_folder(self, folder):
+        result = None
+        if folder == None:
+            folder = default_cache_folder
+        folder = os.path.expanduser(folder)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            result = folder
+        except OSError as error:
+            self.log.error(f"Failed to create cache folder {folder} [{error}] - caching disabled")
+        return result
+
+##############################################################################
+#  __build_session - one pooled keep-alive session used for every call
+##############################################################################
+    def __build_session(self):
+        self.session = requests.Session()
+        # keep a connection for every backfill worker
+        pool_size = max(self.api_pool, self.api_workers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({'content-type': 'application/json'})
+        if self.apiKey != None:
+            self.session.auth = (self.apiKey, '')
+        self.stats = { "requests" : 0, "attempts" : 0, "retries" : 0, "failures" : 0, "latency" : 0.0 }
+        self.stats_lock = threading.Lock()
+
+##############################################################################
+#  __count - add value to one of the stats counters
+##############################################################################
+    def __count(self, name, value=1):
+        with self.stats_lock:
+            self.stats[name] += value
+
+##############################################################################
+#  get_stats - counters for the calls made so far
+#    requests - calls asked for, attempts - http requests sent, 
+#    retries  - attempts repeated, failures - calls given up on,
+#    latency  - total seconds spent waiting on responses
+##############################################################################
+    def get_stats(self):
+        with self.stats_lock:
+            result = dict(self.stats)
+        if result["attempts"] > 0:
+            result["mean_latency"] = result["latency"] / result["attempts"]
+        return result
+
+##############################################################################
+#  __retry_delay - seconds to wait before attempt number attempt (1 based).
+#  A Retry-After header is honoured, otherwise the delay doubles on each 
+#  attempt (capped) with full jitter so parallel callers spread out
+##############################################################################
+    def __retry_delay(self, attempt, response):
+        delay = None
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after != None:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    try:
+                        when = parsedate_to_datetime(retry_after)
+                        delay = (when - datetime.now(timezone.utc)).total_seconds()
+                    except (TypeError, ValueError):
+                        delay = None
+        if delay == None:
+            delay = random.uniform(0, min(default_api_backoff_cap, self.api_backoff * (2 ** (attempt - 1))))
+        result = min(max(delay, 0), default_api_backoff_cap)
+        return result
+
+##############################################################################
+#  get_cache_stats - hit and miss counts of the response cache
+##############################################################################
+    def get_cache_stats(self):
+        result = self.cache.get_stats()
+        return result
+
+##############################################################################
+#  __complete - does a response hold all the expected results. The count of
+#  a response is the total over all its pages
+##############################################################################
+    def __complete(self, response, expected):
+        result = True
+        if expected != None:
+            try:
+                result = response.json()['count'] >= expected
+            except (ValueError, KeyError, TypeError):
+                result = False
+        return result
+
+##############################################################################
+#  __get - GET a url using the response cache. A historic response (one 
+#  for a window that has settled) is served from the cache with no network 
+#  call, anything else cached is asked for again conditionally and a 304
+#  reply re-uses the cached copy. A response with fewer than expected 
+#  results is never kept as historic - the missing periods may still 
+#  arrive. Returns the response (check status_code) or None if no 
+#  response was ever received
+##############################################################################
+    def __get(self, url, params=None, historic=False, expected=None):
+        result = None
+        cached = self.cache.lookup(url, params)
+
+        if cached != None and historic == True and cached.historic == True:
+            self.cache.count("hits")
+            self.log.debug(f"GET {cached.url} served from cache")
+            result = cached
+        else:
+            response = self.__fetch(url, params, self.cache.conditional_headers(cached))
+            if response is not None and response.status_code == 304 and cached != None:
+                self.cache.count("revalidated")
+                self.log.debug(f"GET {cached.url} not modified - using cache")
+                # keep the cached copy - promote it once its window has settled
+                if historic == True and cached.historic == False and self.__complete(cached, expected) == True:
+                    self.cache.store(url, params, cached, historic)
+                result = cached
+            else:
+                self.cache.count("misses")
+                if response is not None and response.status_code == 200:
+                    historic = historic == True and self.__complete(response, expected) == True
+                    self.cache.store(url, params, response, historic)
+                result = response
+        return result
+
+##############################################################################
+#  __fetch - GET a url through the session retrying throttled, failed or 
+#  timed out requests. Returns the last response (check status_code) or 
+#  None if no response was ever received
+##############################################################################
+    def __fetch(self, url, params=None, headers=None):
+        result = None
+        self.__count("requests")
+
+        for attempt in range(1, self.api_retries + 1):
+            response = None
+            self.__count("attempts")
+            t_start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.api_timeout)
+                self.log.debug(f"GET {response.url} [{response.status_code}] attempt {attempt}")
+            except requests.RequestException as error:
+                self.log.error(f"GET {url} attempt {attempt} failed [{error}]")
+            self.__count("latency", time.perf_counter() - t_start)
+
+            if response is not None:
+                result = response
+                if response.status_code not in retry_status:
+                    break
+
+            if attempt < self.api_retries:
+                delay = self.__retry_delay(attempt, response)
+                self.log.info(f"retrying {url} in {delay:.1f}s")
+                self.__count("retries")
+                time.sleep(delay)
+
+        if result is None or result.status_code not in (200, 304):
+            self.__count("failures")
+        return result
+
+##############################################################################
+#  __iter_pages - GET url and every continuation page after it yielding the 
+#  results of each page as it arrives. A failed page yields None and ends 
+#  the pages. historic pages may be served from the cache once they hold
+#  the expected number of results
+##############################################################################
+    def __iter_pages(self, url, payload, historic=False, expected=None):
+        weburl = url
+        if url == None:
+            self.log.error("no url to call - is the region known?")
+            yield None
+
+        while weburl != None:
+            self.log.debug(f"new weburl = [{weburl}]")
+            response = self.__get(weburl, payload, historic, expected)
+            # check we got a 200 return code
+            if response is None or response.status_code != 200:
+                self.log.error(f"Call Failed - aborting [{response}]")
+                yield None
+                break
+            data = response.json()
+            yield data['results']
+            # the next url already carries the query parameters
+            weburl = data['next']
+            payload = None
+
+##############################################################################
+#  __get_pages - GET url and every continuation page after it. Returns 
+#  the results of all the pages or None if any page failed
+##############################################################################
+    def __get_pages(self, url, payload, historic=False, expected=None):
+        result = []
+
+        for page in self.__iter_pages(url, payload, historic, expected):
+            if page == None:
+                result = None
+                break
+            result += page
+
+        return result
+
+##############################################################################
+#  __settled_before - windows of url ending before this time are final
+##############################################################################
+    def __settled_before(self, url):
+        hours = self.rates_settle_hours
+        if url == self.consumptionUrl:
+            hours = self.usage_settle_hours
+        result = time_now() - timedelta(hours=hours)
+        return result
+
+##############################################################################
+#  iter_windows - fetch url for dateobj_from up to dateobj_to split into 
+#  windows of api_window_days. Up to api_workers windows are fetched at 
+#  once, at most twice that are held waiting, and the results of each 
+#  window are yielded in date order as (window_from, window_to, results). 
+#  results is None for a window that failed
+##############################################################################
+    def iter_windows(self, url, dateobj_from, dateobj_to, page_size):
+        windows = []
+        if url != None:
+            windows = split_date_range(dateobj_from, dateobj_to, self.api_window_days)
+        self.log.debug(f"STARTED iter_windows {len(windows)} windows {self.api_workers} workers")
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.api_workers, thread_name_prefix="octopus") as executor:
+            settled = self.__settled_before(url)
+            for (window_from, window_to) in windows:
+                payload = { 'period_from' : timestring_from_date(window_from),
+                            'period_to'   : timestring_from_date(window_to),
+                            'page_size'   : page_size }
+                historic = window_to <= settled
+                # a settled window holds a result for every half hour of it
+                expected = int((window_to - window_from) / timedelta(minutes=30))
+                pending.append( (window_from, window_to, executor.submit(self.__get_pages, url, payload, historic, expected)) )
+                # bound the work in flight - yield the oldest window first
+                if len(pending) >= 2 * self.api_workers:
+                    (first, last, future) = pending.popleft()
+                    yield (first, last, future.result())
+
+            while pending:
+                (first, last, future) = pending.popleft()
+                yield (first, last, future.result())
+
+        self.log.debug("FINISHED iter_windows")
+
+##############################################################################
+#  iter_rates - rates for dateobj_from up to dateobj_to a window at a time
+##############################################################################
+    def iter_rates(self, dateobj_from, dateobj_to):
+        result = None
+        if self.api_ready() == True:
+            result = self.iter_windows(self.get_cost_url(), dateobj_from, dateobj_to, rates_page_size)
+        else:
+            result = iter(())
+        return result
+
+##############################################################################
+#  iter_usage - usage for dateobj_from up to dateobj_to a window at a time
+##############################################################################
+    def iter_usage(self, dateobj_from, dateobj_to):
+        result = None
+        if self.api_ready() == True:
+            result = self.iter_windows(self.consumptionUrl, dateobj_from, dateobj_to, usage_page_size)
+        else:
+            result = iter(())
+        return result
+
+##############################################################################
+#  __iter_data_pages - yield the results of url a page (or window) at a time 
+#  - fetched concurrently in windows when there is an end date otherwise 
+#  by following the pages from dateobj_from. Failed pages are logged and 
+#  skipped
+##############################################################################
+    def __iter_data_pages(self, url, dateobj_from, dateobj_to, page_size):
+        if dateobj_to is not None:
+            for (window_from, window_to, page) in self.iter_windows(url, dateobj_from, dateobj_to, page_size):
+                if page == None:
+                    self.log.error(f"no data for {window_from} to {window_to}")
+                else:
+                    yield page
+        else:
+            payload = { 'period_from' : timestring_from_date(dateobj_from), 'page_size' : page_size }
+            for page in self.__iter_pages(url, payload):
+                if page != None:
+                    yield page
+
+##############################################################################
+#  iter_rate_pages - rates from dateobj_from (up to dateobj_to) as a 
+#  generator of pages so they can be loaded while the rest download
+##############################################################################
+    def iter_rate_pages(self, dateobj_from, dateobj_to=None):
+        result = None
+        if self.api_ready() == True:
+            result = self.__iter_data_pages(self.get_cost_url(), dateobj_from, dateobj_to, rates_page_size)
+        else:
+            result = iter(())
+        return result
+
+##############################################################################
+#  iter_usage_pages - usage from dateobj_from (up to dateobj_to) as a 
+#  generator of pages so they can be loaded while the rest download
+##############################################################################
+    def iter_usage_pages(self, dateobj_from, dateobj_to=None):
+        result = None
+        if self.api_ready() == True:
+            result = self.__iter_data_pages(self.consumptionUrl, dateobj_from, dateobj_to, usage_page_size)
+        else:
+            result = iter(())
+        return result
+
+##############################################################################
+#  build_api_url -  build the api urls that need no network lookup. The 
+#  rates url depends on the region so is built on first use (get_cost_url)
+##############################################################################
     def build_api_url(self):
         self.log.debug("STARTED build_api_url")
         self.meterPointUrl = self.octopusUrl + "electricity-meter-points/" + self.elecMPAN
         self.consumptionUrl = self.octopusUrl + "electricity-meter-points/" + self.elecMPAN + "/meters/" + self.elecSERIAL + "/consumption"
-        
-        # Get the region 
-        self.region = self.set_region()
-        
-        # set the tarriff code
-        self.tarrifCode = "E-1R-" + self.productCode + "-" + self.region
-        self.log.debug("TarrifCode is [" + self.tarrifCode + "].")
-        # URL to query charges 
-        self.costUrl =  self.octopusUrl + "products/" + self.productCode + "/electricity-tariffs/" + self.tarrifCode + "/standard-unit-rates/"
         self.log.debug("FINISHED build_api_url")
 
+##############################################################################
+#  get_cost_url - the url for the rates of our tarriff. The region is read 
+#  from the region cache or looked up from Octopus the first time it is 
+#  needed. Returns None if the region can not be found
+##############################################################################
+    def get_cost_url(self):
+        if self.costUrl == None and self.api_ready() == True:
+            self.log.debug("STARTED get_cost_url")
+            region = self.__read_region_cache()
+            if region == None:
+                region = self.set_region()
+                if region != None:
+                    self.__write_region_cache(region)
+
+            if region != None:
+                self.region = region
+                # set the tarriff code
+                self.tarrifCode = "E-1R-" + self.productCode + "-" + self.region
+                self.log.debug("TarrifCode is [" + self.tarrifCode + "].")
+                # URL to query charges 
+                self.costUrl =  self.octopusUrl + "products/" + self.productCode + "/electricity-tariffs/" + self.tarrifCode + "/standard-unit-rates/"
+            self.log.debug("FINISHED get_cost_url")
+        return self.costUrl
+
+##############################################################################
+#  __read_region_cache - the cached region of our meter or None if there 
+#  is none or it is older than region_cache_days
+##############################################################################
+    def __read_region_cache(self):
+        result = None
+        if self.cacheFolder != None:
+            path = os.path.join(self.cacheFolder, region_cache_file)
+            try:
+                with open(path) as file:
+                    entry = json.load(file).get(self.elecMPAN)
+                if entry != None and time.time() - entry['fetched'] < self.region_cache_days * 86400:
+                    result = entry['region']
+                    self.log.debug(f"region [{result}] read from cache")
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                self.log.error(f"Failed to read region cache {path} [{error}]")
+        return result
+
+##############################################################################
+#  __write_region_cache - save the region of our meter to the cache
+##############################################################################
+    def __write_region_cache(self, region):
+        if self.cacheFolder != None:
+            path = os.path.join(self.cacheFolder, region_cache_file)
+            entries = {}
+            try:
+                with open(path) as file:
+                    entries = json.load(file)
+            except (OSError, ValueError):
+                entries = {}
+            entries[self.elecMPAN] = { "region" : region, "fetched" : time.time() }
+            try:
+                # write a new file and swap it in so readers never see half of it
+                with open(path + ".tmp", "w") as file:
+                    json.dump(entries, file)
+                os.replace(path + ".tmp", path)
+            except OSError as error:
+                self.log.error(f"Failed to write region cache {path} [{error}]")
 
 ############################################################################### 
 #  api_ready - do we have the necessary data to call out to octopus
@@ -155,14 +629,16 @@ class OctopusAgileAPI:
         self.log.debug("STARTED set_region")
         result = None
         if self.api_ready() == True:
-            headers = {'content-type': 'application/json'}
-            meter_details = requests.get(self.meterPointUrl, headers=headers, auth=(self.apiKey,''))
-            self.log.debug("meter_details=["+meter_details.text+"]")
+            meter_details = self.__get(self.meterPointUrl)
+            if meter_details is not None and meter_details.status_code == 200:
+                self.log.debug("meter_details=["+meter_details.text+"]")
             
-            json_meter_details = json.loads(meter_details.text)
-            result = str(json_meter_details['gsp'][-1]).upper()
+                json_meter_details = json.loads(meter_details.text)
+                result = str(json_meter_details['gsp'][-1]).upper()
+            else:
+                self.log.error("Failed to read the meter point details")
             
-        self.log.debug("FINISHED set_region - region is ["+ result + "].")
+        self.log.debug(f"FINISHED set_region - region is [{result}].")
         return result
 
 ##############################################################################
@@ -194,91 +670,47 @@ class OctopusAgileAPI:
 
 ##############################################################################
 #  get_rates - call Octopus to get rates for period_from to period_to  
+#  a range with an end is fetched concurrently in windows (see iter_windows)
 ##############################################################################
     def get_rates(self, dateobj_from, dateobj_to=None, count=100):
         self.log.debug("STARTED get_rates ")
         result = []
-        data = None
-        not_finished = True
         if self.api_ready() == True:
-            period_from = timestring_from_date(dateobj_from)
-
             if dateobj_to is not None:
-                period_to = timestring_from_date(dateobj_to)
-                payload = { 'period_from' : period_from, 'period_to' : period_to, 'page_size' : count }
+                for (window_from, window_to, rates) in self.iter_rates(dateobj_from, dateobj_to):
+                    if rates == None:
+                        self.log.error(f"no rates for {window_from} to {window_to}")
+                    else:
+                        result += rates
             else:
-                payload = { 'period_from' : period_from, 'page_size' : count }
- 
-            headers = {'content-type': 'application/json'}
-            weburl = self.costUrl
-
-            while not_finished:
-                self.log.debug(f"new weburl = [{weburl}]")  
-                response = requests.get(weburl,headers=headers,auth=(self.apiKey,''),params=payload)
-                self.log.debug("result of call = ["+str(response)+"].")
-                # check we got a 200 return code
-                if response.status_code  != 200:
-                    self.log.debug(f"Call Failed - aborting [{response.status_code}]")
-                    break
-                # pull the JSON data from the web response.
-                data = response.json()
-
-                # If we have not got another page - set theloop to terminate
-                if data['next'] == None:
-                    # last page - end the loop
-                    self.log.debug("did not get any page continuation data")
-                    not_finished = False
-                else:
-                    # We havea snother page of data to retrieve
-                    self.log.debug("Got page continuation data")
-                    weburl = data['next']  
-
-                # SAve the results    
-                result+=data['results']
+                payload = { 'period_from' : timestring_from_date(dateobj_from), 'page_size' : count }
+                # keep the pages that arrived before any failure
+                for rates in self.__iter_pages(self.get_cost_url(), payload):
+                    if rates != None:
+                        result += rates
 
         self.log.debug("FINISHED get_rates ")
         return result
 
 ##############################################################################
 #  get_usage - call Octopus to get usage for dateobj_from to dateobj_to  
+#  a range with an end is fetched concurrently in windows (see iter_windows)
 ##############################################################################
     def get_usage(self, dateobj_from, dateobj_to=None):
         self.log.debug("STARTED get_usage ")
         result = None
-        data = None
         if self.api_ready() == True:
-
-            period_from = timestring_from_date(dateobj_from)
- 
             if dateobj_to is not None:
-                period_to = timestring_from_date(dateobj_to)
-                payload = { 'period_from' : period_from, 'period_to' : period_to, 'page_size' : 25000 }
+                result = []
+                for (window_from, window_to, usage) in self.iter_usage(dateobj_from, dateobj_to):
+                    if usage == None:
+                        self.log.error(f"no usage for {window_from} to {window_to}")
+                    else:
+                        result += usage
             else:
-                payload = { 'period_from' : period_from, 'page_size' : 25000 }
- 
- 
-            headers = {'content-type': 'application/json'}
-            response = requests.get(self.consumptionUrl,headers=headers,auth=(self.apiKey,''),params=payload)
-            self.log.debug("result of call = ["+str(response)+"].")
-            data = response.json()
-            self.log.debug("json data in response = ["+str(data)+"].")
-            result = data['results']
+                payload = { 'period_from' : timestring_from_date(dateobj_from), 'page_size' : usage_page_size }
+                result = self.__get_pages(self.consumptionUrl, payload)
+            if result != None:
+                self.log.debug(f"got {len(result)} usage records")
         self.log.debug("FINISHED get_usage ")
         return result
-
-
-
-
-
-
-        
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,305 @@
+########################################################################
+# agileCache.py - Core library file for an on disk cache of the
+# responses to Octopus API calls. Each response is kept with its ETag
+# and Last-Modified headers so a repeat of the call can be made
+# conditional (a 304 reply re-uses the cached copy) and the responses
+# for windows that are entirely in the past are served with no network
+# call at all. The cache is trimmed to a maximum size dropping the
+# least recently used responses first.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from mylogger import nulLogger
+from urllib.parse import urlencode
+import threading
+import hashlib
+import json
+import time
+import os
+
+# the responses are kept in this folder under the cache folder
+response_folder = "responses"
+# default size the cache is trimmed to
+default_cache_bytes = 50 * 1024 * 1024
+# an eviction trims the cache to this share of its size so the next one is
+# not due until the cache has grown again
+evict_low_water = 0.9
+
+
+##############################################################################
+#  CachedResponse - a cached response with the parts of requests.Response
+#  that OctopusAgileAPI uses
+##############################################################################
+class CachedResponse:
+    url         = None
+    status_code = 200
+    text        = None
+    headers     = None
+    historic    = False
+
+    def __init__(self, url, text, headers, historic):
+        self.url = url
+        self.text = text
+        self.headers = headers
+        self.historic = historic
+
+    def json(self):
+        return json.loads(self.text)
+
+    def __repr__(self):
+        return f"<CachedResponse [{self.status_code}]>"
+
+
+class OctopusAgileCache:
+# folder holding the cached responses
+    folder    = None
+# size the cache is trimmed to
+    max_bytes = default_cache_bytes
+# running size and number of the cached responses - None until the first
+# store scans the folder, then kept up to date so evict only scans the
+# folder when the cache has grown past max_bytes
+    total_bytes = None
+    entries   = 0
+# hits (no network), revalidated (304), misses, stored and evicted counts
+    stats     = None
+    lock      = None
+# logging
+    log       = None
+
+##############################################################################
+#  __init__ - cache responses in folder (None disables the cache)
+##############################################################################
+    def __init__(self, folder, max_bytes=None, theLogger=None):
+        # initialise the logfile
+        if theLogger == None:
+            theLogger = nulLogger()
+
+        self.log = theLogger
+
+        self.log.debug("STARTED OctopusAgileCache __init__")
+        self.lock = threading.Lock()
+        self.stats = { "hits" : 0, "revalidated" : 0, "misses" : 0, "stored" : 0, "evicted" : 0 }
+
+        if max_bytes != None:
+            self.max_bytes = max_bytes
+
+        if folder != None:
+            folder = os.path.join(folder, response_folder)
+            try:
+                os.makedirs(folder, exist_ok=True)
+                self.folder = folder
+            except OSError as error:
+                self.log.error(f"Failed to create response cache {folder} [{error}]")
+
+        self.log.debug("FINISHED OctopusAgileCache __init__")
+
+##############################################################################
+#  cache_ready - is the cache usable
+##############################################################################
+    def cache_ready(self):
+        result = self.folder != None and self.max_bytes > 0
+        return result
+
+##############################################################################
+#  count - add one to a stats counter
+##############################################################################
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+##############################################################################
+#  get_stats - hit, miss, revalidation, store and eviction counts
+##############################################################################
+    def get_stats(self):
+        with self.lock:
+            result = dict(self.stats)
+            if self.total_bytes != None:
+                result["bytes"] = self.total_bytes
+                result["entries"] = self.entries
+        lookups = result["hits"] + result["revalidated"] + result["misses"]
+        if lookups > 0:
+            result["hit_rate"] = (result["hits"] + result["revalidated"]) / lookups
+        return result
+
+##############################################################################
+#  __path - the file for the response to url with params
+##############################################################################
+    def __path(self, url, params):
+        key = url
+        if params:
+            key += "?" + urlencode(sorted(params.items()))
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        result = os.path.join(self.folder, f"{digest}.json")
+        return result
+
+##############################################################################
+#  lookup - the cached response to url with params or None. Looking up a
+#  response marks it as recently used
+##############################################################################
+    def lookup(self, url, params=None):
+        result = None
+        if self.cache_ready() == True:
+            path = self.__path(url, params)
+            try:
+                with open(path) as file:
+                    entry = json.load(file)
+                result = CachedResponse(entry['url'], entry['text'], entry['headers'], entry['historic'])
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as error:
+                self.log.error(f"Dropping unreadable cache entry {path} [{error}]")
+                self.__remove(path)
+        return result
+
+##############################################################################
+#  conditional_headers - the headers that make a request for cached
+#  conditional on it having changed
+##############################################################################
+    def conditional_headers(self, cached):
+        result = {}
+        if cached != None:
+            etag = cached.headers.get('ETag')
+            modified = cached.headers.get('Last-Modified')
+            if etag != None:
+                result['If-None-Match'] = etag
+            if modified != None:
+                result['If-Modified-Since'] = modified
+        return result
+
+##############################################################################
+#  store - cache the 200 response to url with params. historic marks a
+#  response that can not change and can be served without asking again
+##############################################################################
+    def store(self, url, params, response, historic=False):
+        result = False
+        if self.cache_ready() == True and response.status_code == 200:
+            path = self.__path(url, params)
+            headers = {}
+            for name in ('ETag', 'Last-Modified'):
+                if response.headers.get(name) != None:
+                    headers[name] = response.headers.get(name)
+            entry = { "url" : response.url, "text" : response.text, "headers" : headers,
+                      "historic" : historic, "stored" : time.time() }
+            # each writer has its own temporary file - readers never see half a file
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(temporary, "w") as file:
+                    json.dump(entry, file)
+                size = os.path.getsize(temporary)
+                replaced = self.__size(path)
+                os.replace(temporary, path)
+                self.count("stored")
+                result = True
+            except OSError as error:
+                self.log.error(f"Failed to cache response {path} [{error}]")
+                self.__remove(temporary)
+
+            if result == True:
+                if self.total_bytes == None:
+                    self.__scan()
+                else:
+                    with self.lock:
+                        self.total_bytes += size - (replaced or 0)
+                        if replaced == None:
+                            self.entries += 1
+                if self.total_bytes > self.max_bytes:
+                    self.evict()
+        return result
+
+##############################################################################
+#  __size - the size of a cache file or None if it is not there
+##############################################################################
+    def __size(self, path):
+        result = None
+        try:
+            result = os.path.getsize(path)
+        except OSError:
+            result = None
+        return result
+
+##############################################################################
+#  __scan - list the cached responses as (mtime, size, path) and reset the
+#  running size and count from them
+##############################################################################
+    def __scan(self):
+        result = []
+        total = 0
+        with os.scandir(self.folder) as scan:
+            for entry in scan:
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    result.append( (stat.st_mtime, stat.st_size, entry.path) )
+                    total += stat.st_size
+        with self.lock:
+            self.total_bytes = total
+            self.entries = len(result)
+        return result
+
+##############################################################################
+#  __remove - remove a cache file if it is still there
+##############################################################################
+    def __remove(self, path):
+        size = self.__size(path)
+        try:
+            os.remove(path)
+            if size != None and path.endswith(".json"):
+                with self.lock:
+                    if self.total_bytes != None:
+                        self.total_bytes -= size
+                        self.entries -= 1
+        except OSError:
+            pass
+
+##############################################################################
+#  evict - when the cache is larger than max_bytes remove the least recently
+#  used responses until it is back to evict_low_water of it. store calls 
+#  this only once the running size is over the limit - the folder is 
+#  scanned again as other processes may share it. returns the number removed
+##############################################################################
+    def evict(self):
+        result = 0
+        if self.cache_ready() == True:
+            entries = self.__scan()
+            total = self.total_bytes
+
+            if total > self.max_bytes:
+                low_water = self.max_bytes * evict_low_water
+                entries.sort()
+                for (mtime, size, path) in entries:
+                    if total <= low_water:
+                        break
+                    self.__remove(path)
+                    total -= size
+                    result += 1
+                    self.count("evicted")
+                self.log.debug(f"evicted {result} cached responses")
+        return result
+
+##############################################################################
+#  clear - remove every cached response
+##############################################################################
+    def clear(self):
+        if self.cache_ready() == True:
+            with os.scandir(self.folder) as scan:
+                for entry in scan:
+                    self.__remove(entry.path)
+            with self.lock:
+                self.total_bytes = 0
+                self.entries = 0
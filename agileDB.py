@@ -21,13 +21,90 @@
 
 from datetime import datetime, timedelta, date
 from mylogger import mylogger,nulLogger
-from agileTools import gen_periodno, gen_periodno_date,yroffset
-from sqliteDB import sqliteDB
+from agileTools import gen_periodno, gen_periodno_date, date_from_periodno, dayno_from_periodno, parts_from_periodno, gen_monthno, epoch_seconds
+from sqliteDB import sqliteDB, read_db_settings, db_arraysize
+from agileStore import OctopusAgileStore
+from collections import namedtuple
+from itertools import islice
+from bisect import bisect_left
+from enum import Enum
+import sqlite3
 import sys
 import calendar
+import time
 import os
 
 empty_rate=-999.99
+# rows handed to each executemany call during a bulk ingest
+default_batch_size=500
+# PRAGMA user_version of an up to date database 
+#   0 - original sparse periodno (48 per day, 1488 per month, 17856 per year)
+#   1 - dense periodno, one per UTC half hour since yroffset
+db_schema_version=1
+
+agile_data_columns = "(periodno INTEGER PRIMARY KEY, year INTEGER, month INTEGER, day INTEGER, hour INTEGER, minute INTEGER, cost REAL, usage REAL, CHECK (year >= 2020 AND month <= 12 AND day <= 31 AND hour < 24 AND minute < 60))"
+
+
+##############################################################################
+#  ChargeBand - the price band of a period, the value is the name used for 
+#  the band in the config file and the css id in the web app
+##############################################################################
+class ChargeBand(Enum):
+    default = "default"
+    good    = "good"
+    average = "average"
+    high    = "high"
+    extreme = "extreme"
+
+
+##############################################################################
+#  PeriodRecord - one half hour period read from agile_data
+#  cost is pence per Kw/h and usage Kw/h - either is empty_rate if not known
+##############################################################################
+class PeriodRecord(namedtuple("PeriodRecord", "periodno year month day hour minute cost usage band")):
+    __slots__ = ()
+
+    # period_cost - what the period cost in pence (0 until cost and usage are known)
+    @property
+    def period_cost(self):
+        if self.usage != empty_rate and self.cost != empty_rate:
+            return self.cost * self.usage
+        return 0.0
+
+
+##############################################################################
+#  ChargeBandClassifier - puts costs into charge bands. A cost belongs to the
+#  band with the highest rate it is above (default if it is above none). The
+#  rates are parsed and sorted once so each lookup is a bisect of a short 
+#  list rather than a walk of the chargebands dict.
+##############################################################################
+class ChargeBandClassifier:
+    rates = None
+    bands = None
+
+##############################################################################
+#  __init__ - build from a chargebands dict  { band : { "rate" : rate } }
+##############################################################################
+    def __init__(self, chargebands):
+        thresholds = sorted( (float(chargebands[band]["rate"]), ChargeBand[band]) for band in chargebands 
+                                if band != "default" )
+        self.rates = [ rate for (rate, band) in thresholds ]
+        self.bands = [ ChargeBand.default ] + [ band for (rate, band) in thresholds ]
+
+##############################################################################
+#  classify - the ChargeBand for one cost
+##############################################################################
+    def classify(self, cost):
+        # bisect_left counts the rates strictly below cost
+        return self.bands[bisect_left(self.rates, cost)]
+
+##############################################################################
+#  classify_many - the ChargeBands for a column of costs
+##############################################################################
+    def classify_many(self, costs):
+        rates = self.rates
+        bands = self.bands
+        return [ bands[bisect_left(rates, cost)] for cost in costs ]
 
 
 class OctopusAgileDB:
@@ -35,8 +112,14 @@ class OctopusAgileDB:
     database    = None
 #sqlite database object
     dbobject    = None
+# rows per executemany call for bulk ingest
+    batch_size  = default_batch_size
 # logging
     log         = None
+#compiled charge band lookup
+    classifier  = None
+#columnar copy of cost and usage (optional)
+    store       = None
 #chargebands
     chargebands = { 
         "default" : {
@@ -78,9 +161,15 @@ class OctopusAgileDB:
         if self.database == None :
             self.log.error("no database file path registered")
         else:
-            self.dbobject = sqliteDB(self.database, theLogger)
+            self.dbobject = sqliteDB(self.database, theLogger, read_db_settings(theConfig, theLogger))
+
+        # the columnar store is only used if store_folder is configured
+        self.store = OctopusAgileStore(theConfig, theLogger)
         
         self.log.debug("STARTED process_config_file: chargebands")
+
+        # take a copy so the class defaults are not changed by this instance's config
+        self.chargebands = { band : dict(self.chargebands[band]) for band in self.chargebands }
         
         # Look at extreme - if not present use defaults
         rate = theConfig.read_value('chargebands','extreme_rate')
@@ -98,6 +187,15 @@ class OctopusAgileDB:
         rate = theConfig.read_value('chargebands','good_rate')
         if rate != None: self.chargebands["good"]["rate"] = rate
 
+        # parse and sort the rates once for every lookup that follows
+        self.classifier = ChargeBandClassifier(self.chargebands)
+
+        self.log.debug("STARTED process_config_file: settings")
+
+        # bulk ingest batch size - if not present use default
+        batch_size = theConfig.read_value('settings','ingest_batch_size')
+        if batch_size != None: self.batch_size = int(batch_size)
+
         self.log.debug("FINISHED OctopusAgileDB __init__")
 
 #############################################################################
@@ -116,32 +214,139 @@ class OctopusAgileDB:
 
                 # create the agile_data table containing forward costs and back usage
                 self.log.debug("creating agile_data table")
-                sqlite_query = 'CREATE TABLE agile_data (periodno INTEGER PRIMARY KEY, year INTEGER, month INTEGER, day INTEGER, hour INTEGER, minute INTEGER, cost REAL, usage REAL, CHECK (year >= 2020 AND month <= 12 AND day <= 31 AND hour < 24 AND minute < 60))'
+                sqlite_query = 'CREATE TABLE agile_data ' + agile_data_columns
                 if self.dbobject.db_query(sqlite_query) == True:
                     data = True
                     self.log.debug("Created agile_data table")
+                    # a new table is numbered with the current scheme from the start
+                    self.dbobject.db_query(f"PRAGMA user_version = {db_schema_version}")
 
                 # create a rollup table with the results by day averaged
                 self.log.debug("creating day_rollup table")
                 sqlite_query = 'CREATE TABLE agile_rollup_day (dayno INTEGER PRIMARY KEY, year INTEGER, month INTEGER, day INTEGER, cost REAL, usage REAL, unit REAL, CHECK (year >= 2020 AND month <= 12 AND day <= 31))'
                 if self.dbobject.db_query(sqlite_query) == True:
-                    rollup = True
+                    day_rollup = True
                     self.log.debug("Created day_rollup table")
                 
                 # create a rollup table with the results by month averaged
                 self.log.debug("creating month rollup table")
                 sqlite_query = 'CREATE TABLE agile_rollup_month (monthno INTEGER PRIMARY KEY, year INTEGER, month INTEGER,  cost REAL, usage REAL, unit REAL, CHECK (year >= 2020 AND month <= 12 ))'
                 if self.dbobject.db_query(sqlite_query) == True:
-                    rollup = True
-                    self.log.debug("Created day_rollup table")
+                    month_rollup = True
+                    self.log.debug("Created month_rollup table")
                 
                 if data and day_rollup and month_rollup:
                     result = True
             
                 self.dbobject.db_disconnect()
+
+        # indexes are created separately so existing databases pick them up
+        self.create_db_indexes()
+
         self.log.debug("FINISHED initialise_agile_db ")
         return result
 
+#############################################################################
+#  create_db_indexes - create any missing indexes - safe to run repeatedly
+##############################################################################
+    def create_db_indexes(self):
+
+        self.log.debug("STARTED create_db_indexes ")
+        result = False
+
+        indexes = {
+            # covering index for the year / month / day lookups in the web app
+            "agile_data_calendar" : "CREATE INDEX IF NOT EXISTS agile_data_calendar ON agile_data (year, month, day)",
+            # partial index holding only the periods still waiting for usage data
+            "agile_data_missing_usage" : f"CREATE INDEX IF NOT EXISTS agile_data_missing_usage ON agile_data (periodno) WHERE usage = {empty_rate}",
+        }
+
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                result = True
+                for name in indexes:
+                    self.log.debug(f"creating index {name}")
+                    if self.dbobject.db_query(indexes[name]) == False:
+                        self.log.error(f"Failed to create index {name}")
+                        result = False
+
+                self.dbobject.db_disconnect()
+        self.log.debug("FINISHED create_db_indexes ")
+        return result
+
+#############################################################################
+#  upgrade_agile_db - bring an existing database up to db_schema_version
+#  cheap to call when there is nothing to do - run by each loader at start
+##############################################################################
+    def upgrade_agile_db(self):
+
+        self.log.debug("STARTED upgrade_agile_db ")
+        result = False
+
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                version = None
+                tables = 0
+                if self.dbobject.db_query("PRAGMA user_version") == True:
+                    version = self.dbobject.db_queryresults()[0][0]
+                if self.dbobject.db_query("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'agile_data'") == True:
+                    tables = self.dbobject.db_queryresults()[0][0]
+
+                if version == None:
+                    self.log.error("Failed to read the database schema version")
+                elif tables == 0 or version >= db_schema_version:
+                    self.log.debug(f"database schema version {version} is current")
+                    result = True
+                else:
+                    result = self.__migrate_dense_periodno()
+
+                self.dbobject.db_disconnect()
+        self.log.debug("FINISHED upgrade_agile_db ")
+        return result
+
+#############################################################################
+#  __migrate_dense_periodno - renumber agile_data from the sparse periodno 
+#  to the dense half hour index and rebuild the rollups keyed from it.
+#  The rows are copied into a new table and swapped in within one 
+#  transaction - in WAL mode readers carry on against the old table until
+#  it commits and writers wait on busy_timeout, so nothing has to stop. 
+##############################################################################
+    def __migrate_dense_periodno(self):
+
+        self.log.info("STARTED __migrate_dense_periodno ")
+        result = False
+
+        # the period number worked out from the calendar columns (all UTC)
+        dense_periodno = f"""(CAST(strftime('%s', printf('%04d-%02d-%02d %02d:%02d', year, month, day, hour, minute)) AS INTEGER) 
+                              - {epoch_seconds}) / 1800"""
+        try:
+            with self.dbobject.db_transaction(immediate=True):
+                self.dbobject.db_query("DROP TABLE IF EXISTS agile_data_dense")
+                self.dbobject.db_query("CREATE TABLE agile_data_dense " + agile_data_columns)
+                self.dbobject.db_query(f"""INSERT INTO agile_data_dense (periodno, year, month, day, hour, minute, cost, usage)
+                    SELECT {dense_periodno}, year, month, day, hour, minute, cost, usage FROM agile_data""")
+                rows = self.dbobject.db_rowcount()
+                self.dbobject.db_query("DROP TABLE agile_data")
+                self.dbobject.db_query("ALTER TABLE agile_data_dense RENAME TO agile_data")
+                self.create_db_indexes()
+
+                # the rollup keys come from the period numbers so start them again
+                self.dbobject.db_query("DELETE FROM agile_rollup_day")
+                self.dbobject.db_query("DELETE FROM agile_rollup_month")
+                self.dbobject.db_query("SELECT DISTINCT periodno / 48 FROM agile_data")
+                daynos = [ row[0] for row in self.dbobject.db_queryresults() ]
+                if daynos:
+                    self.refresh_db_rollups(daynos, True)
+
+                self.dbobject.db_query(f"PRAGMA user_version = {db_schema_version}")
+            result = True
+            self.log.info(f"migrated {rows} agile_data rows to dense period numbers")
+        except sqlite3.Error as error:
+            self.log.error(f"Failed to migrate agile_data - unchanged [{error}]")
+
+        self.log.info("FINISHED __migrate_dense_periodno ")
+        return result
+
 ##############################################################################
 #  connect to the database
 ###############################################################################
@@ -195,6 +400,41 @@ class OctopusAgileDB:
         self.log.debug("FINISHED get_db_first_missing_usage ")
         return result
 
+##############################################################################
+#  get_db_missing_usage_ranges - find every run of periods missing usage data
+#  returns a list of (first periodno, last periodno) ranges in order, or None
+#  if the query failed. Consecutive periodnos are merged into one range in
+#  the query itself (periodno less its row number is constant along a run)
+#  and only the agile_data_missing_usage partial index is read.
+###############################################################################
+    def get_db_missing_usage_ranges(self,upto_periodno=None):
+        result = None
+        self.log.debug("STARTED get_db_missing_usage_ranges ")
+
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                upto = ""
+                data_tuple = None
+                if upto_periodno != None:
+                    upto = " AND periodno <= ?"
+                    data_tuple = (upto_periodno,)
+
+                # the usage test must match the partial index predicate exactly
+                sqlite_select_query = f"""SELECT MIN(periodno), MAX(periodno) FROM 
+                    (SELECT periodno, periodno - ROW_NUMBER() OVER (ORDER BY periodno) AS run 
+                     FROM agile_data WHERE usage = {empty_rate}{upto}) 
+                    GROUP BY run ORDER BY 1"""
+                if self.dbobject.db_query(sqlite_select_query,data_tuple) == True:
+                    result = [ (row[0],row[1]) for row in self.dbobject.db_queryresults() ]
+                    self.log.debug(f"Database usage data missing in {len(result)} ranges")
+                else:
+                    self.log.error(f"Failed to query agile_data ")
+
+                self.dbobject.db_disconnect()
+
+        self.log.debug("FINISHED get_db_missing_usage_ranges ")
+        return result
+
 ##############################################################################
 #   get_db_first_missing_period - find the first period missing 
 ##############################################################################
@@ -258,122 +498,339 @@ class OctopusAgileDB:
         self.log.debug("FINISHED get_db_period_cost ")
         return result
 
+##############################################################################
+#  get_db_forward_costs - (periodno, cost) of every period from 
+#  first_periodno that has a price, in period order
+##############################################################################
+    def get_db_forward_costs(self,first_periodno,inlist=False):
+        self.log.debug("STARTED get_db_forward_costs ")
+        result = None
+        connected = True
+        if self.dbobject.db_ready() == True:
+            if inlist == False: connected = self.dbobject.db_connect()
+            if connected == True:
+                sqlite_select_query = """SELECT periodno, cost FROM agile_data 
+                    WHERE periodno >= ? AND cost != ? ORDER BY periodno"""
+                if self.dbobject.db_query(sqlite_select_query,(first_periodno,empty_rate)) == True:
+                    result = [ (row[0], row[1]) for row in self.dbobject.db_queryresults() ]
+                else:
+                    self.log.error("Failed to retrieve forward costs")
+            if inlist == False: self.dbobject.db_disconnect()
+        self.log.debug("FINISHED get_db_forward_costs ")
+        return result
+
 ##############################################################################
 #  create_db_period_cost - create a database entry with cost for this period 
+#  goes through create_db_period_costs so the rollups and store follow it
 ##############################################################################
     def create_db_period_cost(self,year,month,day,hour,minute,cost,inlist=False):
-        self.log.debug("STARTED create_period_cost ")
-        result=False
+        result = self.create_db_period_costs([(gen_periodno(year,month,day,hour,minute),cost)],inlist=inlist) != None
+        return result
+
+##############################################################################
+#  create_db_period_costs - bulk create database entries with cost 
+#  rate_list is an iterable of (periodno,cost) pairs - the calendar 
+#  columns are worked out from the periodno
+#  the whole list is written in one transaction using executemany in 
+#  batches of batch_size rows - a single commit rather than one per row
+#
+#  upsert=True makes the load idempotent: periods already in the table 
+#  keep their usage, only rows whose cost has changed are rewritten and 
+#  unchanged rows are not written at all
+#
+#  returns a dict of inserted/updated/unchanged counts or None if the 
+#  load failed (and was rolled back)
+##############################################################################
+    def create_db_period_costs(self,rate_list,batch_size=None,upsert=False,inlist=False):
+        self.log.debug("STARTED create_db_period_costs ")
+        result = None
         connected = True
+        counts = { "inserted" : 0, "updated" : 0, "unchanged" : 0 }
+        touched = set()
+        written = None
+
+        if batch_size == None: batch_size = self.batch_size
 
         if self.dbobject.db_ready() == True:
 
             if inlist == False: connected = self.dbobject.db_connect()
             if connected == True:
-                # index is based on half hour periods (per day,month and year)
-                periodno = gen_periodno(year,month,day,hour,minute)
-
                 sqlite_insert_query = """INSERT INTO agile_data
                      ('periodno','year','month','day','hour','minute','cost','usage') 
-                        VALUES (?,?,?,?,?,?,?,?); """
-                data_tuple = (periodno,year,month,day,hour,minute,cost,empty_rate)
-
-                if self.dbobject.db_query(sqlite_insert_query,data_tuple) == True:      
-                    result = True
-                    self.log.debug(f"SQLQuery {year:4d}/{month:02d}/{day:02d}/{hour:02d}:{minute:02d} completed ")
-                else:
-                    self.log.error(f"Failed to insert data into sqlite table:")
-                    result = False
+                        VALUES (?,?,?,?,?,?,?,?) """
+                if upsert == True:
+                    # only touch the cost of an existing row and only when it differs
+                    sqlite_insert_query += """ ON CONFLICT(periodno) DO UPDATE 
+                        SET cost = excluded.cost WHERE cost IS NOT excluded.cost """
+
+                t_start = time.perf_counter()
+                rates = iter(rate_list)
+                try:
+                    with self.dbobject.db_transaction(immediate=True):
+                        while True:
+                            batch = [ (periodno,) + parts_from_periodno(periodno) + (cost,empty_rate)
+                                        for (periodno,cost) in islice(rates,batch_size) ]
+                            if batch == []:
+                                break
+                            if upsert == True:
+                                batch = self.__classify_period_costs(batch,counts)
+                            else:
+                                counts["inserted"] += len(batch)
+                            if batch != []:
+                                self.dbobject.db_querymany(sqlite_insert_query,batch)
+                                touched.update( dayno_from_periodno(row[0]) for row in batch )
+                                # only the range written is kept for the store, not the rows
+                                first = min( row[0] for row in batch )
+                                last = max( row[0] for row in batch )
+                                if written != None:
+                                    first = min(first, written[0])
+                                    last = max(last, written[1])
+                                written = (first, last)
+
+                        # bring the rollups for the days written up to date in the same transaction
+                        if touched:
+                            self.refresh_db_rollups(touched, True)
+
+                    # the store follows the database once the load has committed
+                    if written != None:
+                        self.__sync_store("cost", written[0], written[1])
+
+                    elapsed = time.perf_counter() - t_start
+                    count = counts["inserted"] + counts["updated"] + counts["unchanged"]
+                    rate = count / elapsed if elapsed > 0 else 0
+                    self.log.info(f"create_db_period_costs: {count} rows in {elapsed:.3f}s ({rate:.0f} rows/s) "
+                                  f"inserted={counts['inserted']} updated={counts['updated']} unchanged={counts['unchanged']}")
+                    result = counts
+                except sqlite3.Error as error:
+                    self.log.error(f"Failed to insert data into sqlite table - load rolled back [{error}]")
 
             if inlist == False: self.dbobject.db_disconnect()
 
-        self.log.debug("FINISHED create_period_cost ")
+        self.log.debug("FINISHED create_db_period_costs ")
+
+        return result
+
+##############################################################################
+#  __sync_store - copy a column of agile_data from first_periodno to 
+#  last_periodno into the store - read back from the database in chunks so
+#  memory stays flat however large the load was
+##############################################################################
+    def __sync_store(self,column,first_periodno,last_periodno):
+        if self.store.store_ready() == True:
+            rows = self.dbobject.iter_query(f"SELECT periodno, {column} FROM agile_data WHERE periodno BETWEEN ? AND ?",
+                                            (first_periodno, last_periodno))
+            while True:
+                batch = list(islice(rows, self.batch_size * 20))
+                if batch == []:
+                    break
+                self.store.write_values(column, batch)
 
+##############################################################################
+#  __classify_period_costs - split a batch of agile_data rows into new,
+#  changed and unchanged periods against what is already stored.
+#  counts is updated in place, the rows that need writing are returned 
+##############################################################################
+    def __classify_period_costs(self,batch,counts):
+        result = None
+        stored = {}
+        periodnos = [ row[0] for row in batch ]
+
+        sqlite_select_query = "SELECT periodno, cost FROM agile_data WHERE periodno BETWEEN ? AND ?"
+        self.dbobject.db_query(sqlite_select_query,(min(periodnos),max(periodnos)))
+        for row in self.dbobject.db_queryresults():
+            stored[row[0]] = row[1]
+
+        result = []
+        for row in batch:
+            if row[0] not in stored:
+                counts["inserted"] += 1
+                result.append(row)
+            elif stored[row[0]] != row[6]:
+                counts["updated"] += 1
+                result.append(row)
+            else:
+                counts["unchanged"] += 1
         return result
 
 ##############################################################################
-#  get_db_period_data - call Octopus to get usage/cost for a timestamp (day,month,year)  
+#  get_db_period_data - get usage/cost for a  (day,month,year) - zero means 
+#  the whole month/year - the calendar request is turned into a range query
 ##############################################################################
     def get_db_period_data(self,year=0,month=0,day=0,inlist=False):
         self.log.debug("STARTED get_db_period_data ")
-        result = None
-        connected = True
-        if self.dbobject.db_ready()== True:
-            yearstring=""
-            monthstring=""
-            daystring=""
-            result=[]
-    
-            if year != 0:
-                yearstring =f" WHERE YEAR='{year}'"
-                if month != 0:
-                    monthstring =f" and MONTH='{month}'"
-                    if day != 0:
-                        daystring =f" and DAY='{day}'"
-    
-            sqlite_select_query=" SELECT * from agile_data " + yearstring + monthstring + daystring + ";"
 
-            if inlist == False: connected = self.dbobject.db_connect()
+        (dateobj_from, dateobj_to) = self.__calendar_range(year,month,day)
+        result = self.get_db_period_range(dateobj_from,dateobj_to,inlist)
 
-            if connected == True:
-                if self.dbobject.db_query(sqlite_select_query) == True:
-                    for row in self.dbobject.db_queryresults():
-                        # row0 = periodno, row1=year, row2=month, row3=day, row4=hour,row5=minute, row6=cost, row7 = usage
-                        target_band="default"
-                        for band in self.chargebands:
-                            if  row[6] > float(self.chargebands[band]["rate"]):
-                                target_band = band
-                        if row[7] != empty_rate:
-                            cost = row[6]*row[7]
-                        else:
-                            cost = 0
-                        output = (f"{row[3]:02d}/{row[2]:02d}/{row[1]:04d} {row[4]:02d}:{row[5]:02d}", row[6], row[7], f"{cost:5.3f}" ,target_band)
-                        self.log.debug(output)
-                        result+= [output]
+        self.log.debug("FINISHED get_period_data ")
+        return result
 
-                else:
-                    self.log.error(f"Failed to retrieve database data from table: ")
-                    result = None
+##############################################################################
+#  iter_db_period_data - streaming get_db_period_data, rows are yielded one
+#  at a time as they are read rather than built into a list
+##############################################################################
+    def iter_db_period_data(self,year=0,month=0,day=0):
+        (dateobj_from, dateobj_to) = self.__calendar_range(year,month,day)
+        return self.iter_db_period_range(dateobj_from,dateobj_to)
 
-                if inlist == False: 
-                    self.dbobject.db_disconnect()
-                    self.log.debug("The SQLite connection is closed")
+##############################################################################
+#  __calendar_range - the (from, to) dates covering a day, month or year 
+#  (None, None) when year is zero - meaning all the data
+##############################################################################
+    def __calendar_range(self,year,month,day):
+        dateobj_from = None
+        dateobj_to = None
+
+        if year != 0:
+            if month == 0:
+                dateobj_from = datetime(year,1,1)
+                dateobj_to = datetime(year+1,1,1)
+            elif day == 0:
+                dateobj_from = datetime(year,month,1)
+                dateobj_to = dateobj_from + timedelta(days=calendar.monthrange(year,month)[1])
+            else:
+                dateobj_from = datetime(year,month,day)
+                dateobj_to = dateobj_from + timedelta(days=1)
 
-        self.log.debug("FINISHED get_period_data ")
+        return (dateobj_from, dateobj_to)
+
+##############################################################################
+#  get_db_period_range - get usage/cost for periods from dateobj_from up to
+#  (but not including) dateobj_to. The range is a periodno range on the 
+#  primary key so only the rows asked for are read. A bound of None leaves
+#  that end of the range open - no bounds means all data
+##############################################################################
+    def get_db_period_range(self,dateobj_from=None,dateobj_to=None):
+        self.log.debug("STARTED get_db_period_range ")
+        result = None
+        try:
+            result = list(self.iter_db_period_range(dateobj_from,dateobj_to))
+        except sqlite3.Error as error:
+            self.log.error(f"Failed to retrieve database data from table: {error}")
+
+        self.log.debug("FINISHED get_db_period_range ")
         return result
 
 ##############################################################################
-#   update_db_period_usage - update the database cost table with usage info
+#  iter_db_period_range - generator version of get_db_period_range, the rows
+#  are read from the database in small batches and yielded as they arrive so
+#  a multi-year range never sits in memory. Each batch is banded in one 
+#  classify_many call. yields nothing if the database is not configured or 
+#  cannot be opened, raises sqlite3.Error if the query fails
 ##############################################################################
-    def update_db_period_usage(self,year,month,day,hour,minute,usage,inlist):
-        result = False
-        connected = True
-        periodno = 0
-        self.log.debug("STARTED save_period_usage ")
+    def iter_db_period_range(self,dateobj_from=None,dateobj_to=None):
+        conditions = []
+        data_tuple = None
+        if dateobj_from != None:
+            conditions.append( ("periodno >= ?", gen_periodno_date(dateobj_from)) )
+        if dateobj_to != None:
+            conditions.append( ("periodno < ?", gen_periodno_date(dateobj_to)) )
+
+        sqlite_select_query = "SELECT * from agile_data"
+        if len(conditions) > 0:
+            sqlite_select_query += " WHERE " + " AND ".join(condition for (condition, value) in conditions)
+            data_tuple = tuple(value for (condition, value) in conditions)
+        sqlite_select_query += " ORDER BY periodno"
 
         if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                rows = self.dbobject.iter_query(sqlite_select_query,data_tuple)
+                while True:
+                    batch = list(islice(rows, db_arraysize))
+                    if not batch:
+                        break
+                    bands = self.classifier.classify_many([ row[6] for row in batch ])
+                    for (row, band) in zip(batch, bands):
+                        yield self.__period_row(row, band)
 
-            if inlist == False: 
-                connected = self.dbobject.db_connect()
-            
-            if connected == True:
-                # index is based on half hour slots (per day,month and year)
-                periodno = gen_periodno(year,month,day,hour,minute)
+##############################################################################
+#  __period_row - build the PeriodRecord for an agile_data row and its band
+##############################################################################
+    def __period_row(self,row,band):
+        # row0 = periodno, row1=year, row2=month, row3=day, row4=hour,row5=minute, row6=cost, row7 = usage
+        output = PeriodRecord(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], band)
+        return output
 
-                sqlite_update_query = """UPDATE agile_data SET usage = ? WHERE periodno = ? """
-                data_tuple = (usage,periodno)
+##############################################################################
+#   update_db_period_usage - update the database cost table with usage info
+#   goes through update_db_period_usages so the rollups and store follow it
+##############################################################################
+    def update_db_period_usage(self,year,month,day,hour,minute,usage,inlist=False):
+        result = self.update_db_period_usages([(gen_periodno(year,month,day,hour,minute),usage)],inlist) != None
+        return result
 
-                if self.dbobject.db_query(sqlite_update_query,data_tuple) == True:
-                    result = True
-                    self.log.debug(f"Record {year}/{month}/{day}/{hour}:{minute} updated with usage {usage} in database")
+##############################################################################
+#   update_db_period_usages - bulk update the database with usage info
+#   usage_list is an iterable of (periodno,usage) pairs
+#   the list is staged into a temporary table with one executemany and then
+#   applied to agile_data with a single upsert in the same transaction.
+#   periods with usage but no price yet get a placeholder row (cost is
+#   empty_rate) so the reading is kept until getrates fills in the cost.
+#
+#   returns a dict of inserted/updated/unchanged counts or None on failure
+##############################################################################
+    def update_db_period_usages(self,usage_list,inlist=False):
+        self.log.debug("STARTED update_db_period_usages ")
+        result = None
+        connected = True
+        staged = 0
+        placeholders = 0
+        changed = 0
 
-                else:
-                    self.log.error("Failed to update data in sqlite table")
-                    result = False
+        if self.dbobject.db_ready() == True:
+
+            if inlist == False: connected = self.dbobject.db_connect()
+            if connected == True:
+                t_start = time.perf_counter()
+                stage_rows = ( (periodno,) + parts_from_periodno(periodno) + (usage,)
+                                for (periodno,usage) in usage_list )
+
+                try:
+                    with self.dbobject.db_transaction(immediate=True):
+                        self.dbobject.db_query("""CREATE TEMP TABLE IF NOT EXISTS usage_stage 
+                            (periodno INTEGER PRIMARY KEY, year INTEGER, month INTEGER, day INTEGER, 
+                             hour INTEGER, minute INTEGER, usage REAL)""")
+                        self.dbobject.db_query("DELETE FROM usage_stage")
+                        self.dbobject.db_querymany("""INSERT OR REPLACE INTO usage_stage 
+                            (periodno,year,month,day,hour,minute,usage) VALUES (?,?,?,?,?,?,?)""", stage_rows)
+
+                        self.dbobject.db_query("""SELECT COUNT(*), 
+                            SUM(periodno NOT IN (SELECT periodno FROM agile_data)) FROM usage_stage""")
+                        for row in self.dbobject.db_queryresults():
+                            staged = row[0]
+                            placeholders = row[1] or 0
+
+                        # new periods get a placeholder cost, known periods only change usage
+                        self.dbobject.db_query("""INSERT INTO agile_data 
+                            (periodno,year,month,day,hour,minute,cost,usage) 
+                            SELECT periodno,year,month,day,hour,minute,?,usage FROM usage_stage WHERE true 
+                            ON CONFLICT(periodno) DO UPDATE SET usage = excluded.usage 
+                            WHERE usage IS NOT excluded.usage""", (empty_rate,))
+                        changed = self.dbobject.db_rowcount()
+
+                        # bring the rollups for the days loaded up to date in the same transaction
+                        if changed > 0:
+                            self.dbobject.db_query("SELECT DISTINCT periodno / 48 FROM usage_stage")
+                            touched = [ row[0] for row in self.dbobject.db_queryresults() ]
+                            self.refresh_db_rollups(touched, True)
+
+                    # the store follows the database once the load has committed
+                    if changed > 0:
+                        self.dbobject.db_query("SELECT MIN(periodno), MAX(periodno) FROM usage_stage")
+                        for row in self.dbobject.db_queryresults():
+                            self.__sync_store("usage", row[0], row[1])
+
+                    elapsed = time.perf_counter() - t_start
+                    rate = staged / elapsed if elapsed > 0 else 0
+                    result = { "inserted" : placeholders, "updated" : changed - placeholders, "unchanged" : staged - changed }
+                    self.log.info(f"update_db_period_usages: {staged} rows in {elapsed:.3f}s ({rate:.0f} rows/s) "
+                                  f"inserted={result['inserted']} updated={result['updated']} unchanged={result['unchanged']}")
+                except sqlite3.Error as error:
+                    self.log.error(f"Failed to update usage data in sqlite table - load rolled back [{error}]")
 
             if inlist == False: self.dbobject.db_disconnect()
-                
-        self.log.debug("FINISHED save_period_usage ")
+
+        self.log.debug("FINISHED update_db_period_usages ")
         return result
 
 ##############################################################################
@@ -388,8 +845,8 @@ class OctopusAgileDB:
             if self.dbobject.db_connect() == True:
 
                 self.log.debug("querying agile_data table")
-                # create the agile_data table containing forward costs and back usage
-                sql_select_query="SELECT year FROM agile_data GROUP BY year"
+                # answered from the agile_data_calendar index without touching the table
+                sql_select_query="SELECT DISTINCT year FROM agile_data ORDER BY year"
                 if self.dbobject.db_query(sql_select_query) == True:
         
                     for row in  self.dbobject.db_queryresults():
@@ -416,10 +873,10 @@ class OctopusAgileDB:
         if self.dbobject.db_ready() == True:
             if self.dbobject.db_connect() == True:
 
-                self.log.debug("creating agile_data table")
-                # create the agile_data table containing forward costs and back usage
-                sql_select_query=f"SELECT year FROM agile_data WHERE year = {year} GROUP BY month"
-                if self.dbobject.db_query(sql_select_query) == True:
+                self.log.debug("querying agile_data table")
+                # answered from the agile_data_calendar index without touching the table
+                sql_select_query="SELECT DISTINCT month FROM agile_data WHERE year = ? ORDER BY month"
+                if self.dbobject.db_query(sql_select_query,(int(year),)) == True:
         
                     for row in  self.dbobject.db_queryresults():
                         self.log.debug(f"row={row}")
@@ -445,10 +902,10 @@ class OctopusAgileDB:
         if self.dbobject.db_ready() == True:   
             if self.dbobject.db_connect() == True:
 
-                self.log.debug("creating agile_data table")
-                # create the agile_data table containing forward costs and back usage
-                sql_select_query=f"SELECT day  FROM agile_data WHERE year = {year} AND month = {month} GROUP BY day"
-                if self.dbobject.db_query(sql_select_query) == True:
+                self.log.debug("querying agile_data table")
+                # answered from the agile_data_calendar index without touching the table
+                sql_select_query="SELECT DISTINCT day FROM agile_data WHERE year = ? AND month = ? ORDER BY day"
+                if self.dbobject.db_query(sql_select_query,(int(year),int(month))) == True:
         
                     for row in  self.dbobject.db_queryresults():
                         self.log.debug(f"row={row}")
@@ -465,54 +922,155 @@ class OctopusAgileDB:
 
 
 ##############################################################################
-#  create_db_rollup_period - create a rollup for a period
+#  refresh_db_rollups - recompute the day rollups for the days in daynos and
+#  the month rollups for the months they fall in. The loaders call this in 
+#  their own transaction so the rollups always match agile_data; only priced
+#  periods with usage count towards cost, usage and the unit price.
+#  returns True if the rollups were updated
+##############################################################################
+    def refresh_db_rollups(self,daynos,inlist=False):
+        self.log.debug("STARTED refresh_db_rollups ")
+        result = False
+        connected = True
+
+        daynos = sorted(set(daynos))
+        months = sorted(set( (date_from_periodno(dayno*48).year, date_from_periodno(dayno*48).month) for dayno in daynos ))
+
+        sql_day_query = f"""INSERT OR REPLACE INTO agile_rollup_day (dayno, year, month, day, cost, usage, unit)
+            SELECT dayno, year, month, day, cost, usage, CASE WHEN usage > 0 THEN cost / usage ELSE 0 END FROM 
+                (SELECT ? AS dayno, year, month, day, 
+                        TOTAL(CASE WHEN usage != {empty_rate} AND cost != {empty_rate} THEN cost * usage END) AS cost,
+                        TOTAL(CASE WHEN usage != {empty_rate} AND cost != {empty_rate} THEN usage END) AS usage
+                 FROM agile_data WHERE periodno BETWEEN ? AND ? GROUP BY year, month, day)"""
+
+        sql_month_query = """INSERT OR REPLACE INTO agile_rollup_month (monthno, year, month, cost, usage, unit)
+            SELECT ?, ?, ?, cost, usage, CASE WHEN usage > 0 THEN cost / usage ELSE 0 END FROM 
+                (SELECT TOTAL(cost) AS cost, TOTAL(usage) AS usage 
+                 FROM agile_rollup_day WHERE dayno BETWEEN ? AND ?)"""
+
+        if self.dbobject.db_ready() == True:
+
+            if inlist == False: connected = self.dbobject.db_connect()
+            if connected == True:
+                day_rows = [ (dayno, dayno*48, dayno*48 + 47) for dayno in daynos ]
+                month_rows = []
+                for (year, month) in months:
+                    first = datetime(year, month, 1)
+                    last = first + timedelta(days=calendar.monthrange(year, month)[1])
+                    month_rows.append( (gen_monthno(year, month), year, month, 
+                                        dayno_from_periodno(gen_periodno_date(first)), 
+                                        dayno_from_periodno(gen_periodno_date(last)) - 1) )
+                try:
+                    with self.dbobject.db_transaction():
+                        self.dbobject.db_querymany(sql_day_query, day_rows)
+                        self.dbobject.db_querymany(sql_month_query, month_rows)
+                    result = True
+                    self.log.debug(f"refreshed {len(day_rows)} day and {len(month_rows)} month rollups")
+                except sqlite3.Error as error:
+                    self.log.error(f"Failed to refresh rollups [{error}]")
+                    # a loader's transaction must not commit with stale rollups
+                    if self.dbobject.db_in_transaction() == True:
+                        raise
+
+            if inlist == False: self.dbobject.db_disconnect()
+
+        self.log.debug("FINISHED refresh_db_rollups ")
+        return result
+
+##############################################################################
+#  rebuild_db_rollups - recompute every rollup from agile_data
+##############################################################################
+    def rebuild_db_rollups(self):
+        self.log.debug("STARTED rebuild_db_rollups ")
+        result = False
+
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                if self.dbobject.db_query("SELECT DISTINCT periodno / 48 FROM agile_data") == True:
+                    daynos = [ row[0] for row in self.dbobject.db_queryresults() ]
+                    result = self.refresh_db_rollups(daynos, True)
+                self.dbobject.db_disconnect()
+
+        self.log.debug("FINISHED rebuild_db_rollups ")
+        return result
+
+##############################################################################
+#  rebuild_store - rewrite the columnar store from agile_data
+##############################################################################
+    def rebuild_store(self):
+        self.log.debug("STARTED rebuild_store ")
+        result = False
+
+        if self.store.store_ready() == True and self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                try:
+                    self.store.clear()
+                    rows = self.dbobject.iter_query("SELECT periodno, cost, usage FROM agile_data ORDER BY periodno")
+                    while True:
+                        batch = list(islice(rows, self.batch_size * 20))
+                        if batch == []:
+                            break
+                        self.store.write_values("cost", ( (row[0], row[1]) for row in batch ))
+                        self.store.write_values("usage", ( (row[0], row[2]) for row in batch ))
+                    result = True
+                except sqlite3.Error as error:
+                    self.log.error(f"Failed to rebuild the store [{error}]")
+                self.dbobject.db_disconnect()
+
+        self.log.debug("FINISHED rebuild_store ")
+        return result
+
+##############################################################################
+#  create_db_rollup_month - recompute the rollups for one month
 ##############################################################################
     def create_db_rollup_month(self,year,month):
-        period_data=[]
-        month_use = 0
-        month_cost = 0
-        month_unit = 0
-        result = None
         self.log.debug("STARTED create_db_rollup_month ")
+        first = dayno_from_periodno(gen_periodno(year,month,1,0,0))
         daysinmonth = calendar.monthrange(year,month)[1]
-        cost= [] * daysinmonth
-        use= [] * daysinmonth
-        unit= [] * daysinmonth
-        if self.db_ready() == True:   
-            if self.dbobject.db_connect() == True:
-                # we'vew got more database work to do - set inlist to true to keep connection open
-                period_data = self.get_db_period_data(year,month,0,True)
-
-                if period_data != None:
-                    for entry in period_data:
-                        # got a months worth of entries total up the days
-                        day = int(entry[0].split('/')[0])
-                        self.log.debug(f"entry data = [{entry}] day=[{day}]")
-                        if float(entry[2]) != -999.99:
-                            use[day]  += float(entry[2])
-                            cost[day] += float(entry[3])
-                            unit [day] = cost[day]/use[day]
-                            # average out the result for the current month
-                            month_use  += float(entry[2])
-                            month_cost += float(entry[3])
-                            month_unit  = month_cost/ month_use
-                    
-                    # we have a per day total and a per month total (running in the case the periods are not complete)
-                    # put those values into the database 
-
-                    #first off insert the month into the month table
-                    monthno = 12 * (year - yroffset) + month
-                    sql_month_insert_query = "INSERT INTO agile_rollup_month (monthno, year, month, cost , usage , unit) VALUES = (?,?,?,?,?,?)"
-                    month_tuple=(monthno, year, month, month_cost , month_use , month_unit)
-
-                    for day in 1..daysinmonth:
-                        dayno = day + (month * 31) + ((year - yroffset ) * 366)
-                        day_tuple=(dayno, year, month, day, cost[day], use[day], unit[day])
-                        sql_day_insert_query = "INSERT INTO agile_rollup_day (dayno, year, month, day, cost, usage, unit) VALUES = (?,?,?,?,?,?.?)"
-
-
-
-            # Finished disconnect from the database
-            self.dbobject.db_disconnect()
+        result = self.refresh_db_rollups(range(first, first + daysinmonth))
         self.log.debug("FINISHED create_db_rollup_month ")
-        return result
\ No newline at end of file
+        return result
+
+##############################################################################
+#  get_db_rollup_days - get the day rollups for a month
+#  returns a list of (day, cost, usage, unit) one per day with data
+##############################################################################
+    def get_db_rollup_days(self,year,month):
+        self.log.debug("STARTED get_db_rollup_days ")
+        result = None
+        first = datetime(year, month, 1)
+        last = first + timedelta(days=calendar.monthrange(year, month)[1])
+
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                sql_select_query = "SELECT day, cost, usage, unit FROM agile_rollup_day WHERE dayno BETWEEN ? AND ? ORDER BY dayno"
+                data_tuple = (dayno_from_periodno(gen_periodno_date(first)), dayno_from_periodno(gen_periodno_date(last)) - 1)
+                if self.dbobject.db_query(sql_select_query, data_tuple) == True:
+                    result = [ (row[0], row[1], row[2], row[3]) for row in self.dbobject.db_queryresults() ]
+                else:
+                    self.log.error("Failed SQL data call in get_db_rollup_days")
+                self.dbobject.db_disconnect()
+
+        self.log.debug("FINISHED get_db_rollup_days ")
+        return result
+
+##############################################################################
+#  get_db_rollup_months - get the month rollups for a year
+#  returns a list of (month, cost, usage, unit) one per month with data
+##############################################################################
+    def get_db_rollup_months(self,year):
+        self.log.debug("STARTED get_db_rollup_months ")
+        result = None
+
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                sql_select_query = "SELECT month, cost, usage, unit FROM agile_rollup_month WHERE monthno BETWEEN ? AND ? ORDER BY monthno"
+                data_tuple = (gen_monthno(year, 1), gen_monthno(year, 12))
+                if self.dbobject.db_query(sql_select_query, data_tuple) == True:
+                    result = [ (row[0], row[1], row[2], row[3]) for row in self.dbobject.db_queryresults() ]
+                else:
+                    self.log.error("Failed SQL data call in get_db_rollup_months")
+                self.dbobject.db_disconnect()
+
+        self.log.debug("FINISHED get_db_rollup_months ")
+        return result
@@ -0,0 +1,265 @@
+########################################################################
+# agileFrame.py - Core library file for vectorised analysis of agile
+# data. A PeriodFrame holds the cost, usage and charge band of a run of
+# consecutive half hour periods as numpy arrays and reduces them by day,
+# week, month or hour of the day without any per row python.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from agileTools import gen_periodno_date, period_epoch
+from agileDB import ChargeBand, empty_rate
+import numpy
+
+# the periodno epoch as a numpy day
+epoch_day = numpy.datetime64(period_epoch.date(), "D")
+# the epoch (day 0) is a Wednesday - weeks are counted from Mondays
+epoch_weekday = period_epoch.weekday()
+
+# the ways a frame can be grouped
+group_keys = ("day", "week", "month", "hour_of_day")
+
+# band codes used in PeriodFrame.band index this tuple
+band_order = tuple(ChargeBand)
+
+
+##############################################################################
+#  PeriodFrame - cost, usage and charge band for every half hour from
+#  first_periodno. Missing values are NaN.
+##############################################################################
+class PeriodFrame:
+    first_periodno = None
+    cost    = None
+    usage   = None
+    band    = None
+
+##############################################################################
+#  __init__ - build from aligned cost and usage arrays starting at
+#  first_periodno, classifier is the OctopusAgileDB ChargeBandClassifier
+##############################################################################
+    def __init__(self, first_periodno, cost, usage, classifier):
+        self.first_periodno = first_periodno
+        self.cost = numpy.asarray(cost, dtype=numpy.float64)
+        self.usage = numpy.asarray(usage, dtype=numpy.float64)
+
+        # vectorised version of ChargeBandClassifier.classify - searchsorted
+        # on the left counts the rates strictly below each cost
+        rates = numpy.asarray(classifier.rates, dtype=numpy.float64)
+        codes = numpy.searchsorted(rates, self.cost, side="left")
+        codes[numpy.isnan(self.cost)] = 0
+        order = [ band_order.index(band) for band in classifier.bands ]
+        self.band = numpy.asarray(order, dtype=numpy.int8)[codes]
+
+##############################################################################
+#  from_db - build a frame for dateobj_from up to dateobj_to using the
+#  columnar store if the database has one, otherwise a range query
+##############################################################################
+    @classmethod
+    def from_db(cls, agileDB, dateobj_from, dateobj_to):
+        first = gen_periodno_date(dateobj_from)
+        last = gen_periodno_date(dateobj_to)
+        length = max(last - first, 0)
+
+        columns = None
+        if agileDB.store.store_ready() == True:
+            columns = agileDB.store.get_period_range(first, last)
+
+        if columns == None:
+            cost = numpy.full(length, numpy.nan)
+            usage = numpy.full(length, numpy.nan)
+            for record in agileDB.iter_db_period_range(dateobj_from, dateobj_to):
+                cost[record.periodno - first] = record.cost
+                usage[record.periodno - first] = record.usage
+            cost[cost == empty_rate] = numpy.nan
+            usage[usage == empty_rate] = numpy.nan
+            columns = (cost, usage)
+
+        return cls(first, columns[0], columns[1], agileDB.classifier)
+
+##############################################################################
+#  periodno - the period number of every entry
+##############################################################################
+    @property
+    def periodno(self):
+        return numpy.arange(self.first_periodno, self.first_periodno + len(self.cost))
+
+##############################################################################
+#  period_cost - cost in pence of every period (NaN until cost and usage known)
+##############################################################################
+    @property
+    def period_cost(self):
+        return self.cost * self.usage
+
+##############################################################################
+#  __len__ - number of half hour periods in the frame
+##############################################################################
+    def __len__(self):
+        return len(self.cost)
+
+##############################################################################
+#  column - a named column - cost, usage, period_cost or band
+##############################################################################
+    def column(self, name):
+        if name == "period_cost":
+            result = self.period_cost
+        elif name in ("cost", "usage", "band"):
+            result = getattr(self, name)
+        else:
+            raise KeyError(f"unknown PeriodFrame column {name}")
+        return result
+
+##############################################################################
+#  groupby - group the periods by day, week, month or hour_of_day
+##############################################################################
+    def groupby(self, key):
+        periodno = self.periodno
+        days = periodno // 48
+
+        if key == "day":
+            group = days
+            labels = lambda keys: epoch_day + keys.astype("timedelta64[D]")
+        elif key == "week":
+            group = (days + epoch_weekday) // 7
+            labels = lambda keys: epoch_day + (keys * 7 - epoch_weekday).astype("timedelta64[D]")
+        elif key == "month":
+            group = (epoch_day + days.astype("timedelta64[D]")).astype("datetime64[M]").astype(numpy.int64)
+            labels = lambda keys: keys.astype("datetime64[M]")
+        elif key == "hour_of_day":
+            group = (periodno % 48) // 2
+            labels = lambda keys: keys
+        else:
+            raise KeyError(f"unknown PeriodFrame group {key} - use one of {group_keys}")
+
+        keys, inverse = numpy.unique(group, return_inverse=True)
+        return PeriodGroups(self, labels(keys), inverse.reshape(-1))
+
+##############################################################################
+#  heatmap - a column laid out as one row per day and one column per half
+#  hour - the frame is padded with NaN out to whole days
+##############################################################################
+    def heatmap(self, name="cost"):
+        values = self.column(name).astype(numpy.float64)
+        lead = self.first_periodno % 48
+        trail = (-(self.first_periodno + len(values))) % 48
+        padded = numpy.concatenate( (numpy.full(lead, numpy.nan), values, numpy.full(trail, numpy.nan)) )
+        result = padded.reshape(-1, 48)
+        return result
+
+##############################################################################
+#  heatmap_days - the day of each heatmap row
+##############################################################################
+    def heatmap_days(self):
+        first_day = self.first_periodno // 48
+        count = (self.first_periodno % 48 + len(self.cost) + 47) // 48
+        return epoch_day + numpy.arange(first_day, first_day + count).astype("timedelta64[D]")
+
+
+##############################################################################
+#  PeriodGroups - the result of PeriodFrame.groupby, every reduction returns
+#  an array with one value per label. Missing (NaN) values are skipped.
+##############################################################################
+class PeriodGroups:
+    frame   = None
+    labels  = None
+    inverse = None
+
+##############################################################################
+#  __init__ - labels are the group names, inverse maps each period to a group
+##############################################################################
+    def __init__(self, frame, labels, inverse):
+        self.frame = frame
+        self.labels = labels
+        self.inverse = inverse
+
+##############################################################################
+#  __values - a column and the mask of its known values
+##############################################################################
+    def __values(self, name):
+        values = self.frame.column(name).astype(numpy.float64)
+        known = ~numpy.isnan(values)
+        return values, known
+
+##############################################################################
+#  count - number of known values in each group
+##############################################################################
+    def count(self, name="cost"):
+        values, known = self.__values(name)
+        return numpy.bincount(self.inverse, weights=known, minlength=len(self.labels))
+
+##############################################################################
+#  sum - total of each group
+##############################################################################
+    def sum(self, name="cost"):
+        values, known = self.__values(name)
+        return numpy.bincount(self.inverse, weights=numpy.where(known, values, 0.0), minlength=len(self.labels))
+
+##############################################################################
+#  mean - average of each group (NaN for a group with no values)
+##############################################################################
+    def mean(self, name="cost"):
+        count = self.count(name)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return self.sum(name) / count
+
+##############################################################################
+#  min - smallest value in each group (NaN for a group with no values)
+##############################################################################
+    def min(self, name="cost"):
+        values, known = self.__values(name)
+        result = numpy.full(len(self.labels), numpy.inf)
+        numpy.minimum.at(result, self.inverse[known], values[known])
+        result[numpy.isinf(result)] = numpy.nan
+        return result
+
+##############################################################################
+#  max - largest value in each group (NaN for a group with no values)
+##############################################################################
+    def max(self, name="cost"):
+        values, known = self.__values(name)
+        result = numpy.full(len(self.labels), -numpy.inf)
+        numpy.maximum.at(result, self.inverse[known], values[known])
+        result[numpy.isinf(result)] = numpy.nan
+        return result
+
+##############################################################################
+#  percentile - the q'th percentile (0..100) of each group
+##############################################################################
+    def percentile(self, name="cost", q=50):
+        values, known = self.__values(name)
+        groups = self.inverse[known]
+        values = values[known]
+        result = numpy.full(len(self.labels), numpy.nan)
+        if len(values) > 0:
+            # sort by group then value so each group is one contiguous run
+            order = numpy.lexsort( (values, groups) )
+            groups = groups[order]
+            values = values[order]
+            starts = numpy.flatnonzero(numpy.r_[True, groups[1:] != groups[:-1]])
+            for (group, run) in zip(groups[starts], numpy.split(values, starts[1:])):
+                result[group] = numpy.percentile(run, q)
+        return result
+
+##############################################################################
+#  unit_price - usage weighted cost per Kw/h of each group - only periods
+#  where both the cost and the usage are known count
+##############################################################################
+    def unit_price(self):
+        cost = self.frame.cost
+        usage = self.frame.usage
+        known = ~(numpy.isnan(cost) | numpy.isnan(usage))
+        spend = numpy.bincount(self.inverse, weights=numpy.where(known, cost * usage, 0.0), minlength=len(self.labels))
+        used = numpy.bincount(self.inverse, weights=numpy.where(known, usage, 0.0), minlength=len(self.labels))
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return spend / used
@@ -0,0 +1,213 @@
+########################################################################
+# agileStore.py - Core library file for a columnar copy of the agile_data
+# cost and usage held in memory mapped files next to the database.
+# Each column is a flat array of numbers indexed by periodno (one per
+# half hour) so the values between two dates are a slice of the file
+# rather than a query. The database stays the master copy - the store
+# is written after each load commits and can be rebuilt from it.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from mylogger import nulLogger
+from agileTools import gen_periodno_date
+import os
+
+# numpy is only needed by hosts that use the store
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+empty_rate=-999.99
+
+# the columns held in the store
+store_columns = ("cost", "usage")
+# supported value types
+store_dtypes = ("float32", "float64")
+# files grow a year of half hours at a time
+store_chunk = 48 * 366
+
+
+class OctopusAgileStore:
+# folder holding the column files
+    folder  = None
+# value type of the columns
+    dtype   = "float64"
+# open memory maps by column name
+    columns = None
+# logging
+    log     = None
+
+##############################################################################
+#  __init__ initialise the store from the config file
+##############################################################################
+    def __init__(self, theConfig, theLogger=None):
+        # initialise the logfile
+        if theLogger == None:
+            theLogger = nulLogger()
+
+        self.log = theLogger
+
+        self.log.debug("STARTED OctopusAgileStore __init__")
+        self.columns = {}
+
+        folder = theConfig.read_value('filepaths','store_folder')
+        dtype = theConfig.read_value('settings','store_dtype')
+
+        if dtype != None:
+            if dtype in store_dtypes:
+                self.dtype = dtype
+            else:
+                self.log.error(f"store_dtype [{dtype}] invalid - using {self.dtype}")
+
+        if folder != None:
+            if numpy == None:
+                self.log.error("store_folder is set but numpy is not installed - store disabled")
+            else:
+                folder = os.path.expanduser(folder)
+                try:
+                    os.makedirs(folder, exist_ok=True)
+                    self.folder = folder
+                except OSError as error:
+                    self.log.error(f"Failed to create store folder {folder} [{error}]")
+
+        self.log.debug("FINISHED OctopusAgileStore __init__")
+
+##############################################################################
+#  store_ready - is the store configured and usable
+##############################################################################
+    def store_ready(self):
+        result = self.folder != None
+        return result
+
+##############################################################################
+#  __column_path - the file holding a column - the type is part of the name
+#  so changing store_dtype starts new files rather than misreading old ones
+##############################################################################
+    def __column_path(self, column):
+        result = os.path.join(self.folder, f"{column}.{self.dtype}")
+        return result
+
+##############################################################################
+#  __column_length - the number of values in a column file
+##############################################################################
+    def __column_length(self, column):
+        result = 0
+        path = self.__column_path(column)
+        if os.path.exists(path):
+            result = os.path.getsize(path) // numpy.dtype(self.dtype).itemsize
+        return result
+
+##############################################################################
+#  __map_column - the read only memory map of a column, remapped if another
+#  process has grown the file since we mapped it. None if the file is empty
+##############################################################################
+    def __map_column(self, column):
+        length = self.__column_length(column)
+        mapped = self.columns.get(column)
+        if mapped is None or len(mapped) != length:
+            mapped = None
+            if length > 0:
+                mapped = numpy.memmap(self.__column_path(column), dtype=self.dtype, mode="r", shape=(length,))
+            self.columns[column] = mapped
+        return mapped
+
+##############################################################################
+#  __grow_column - extend a column file to hold at least length values, the
+#  new space is filled with NaN (no data). returns a writable map of it -
+#  only write_values holds one and only while it writes
+##############################################################################
+    def __grow_column(self, column, length):
+        current = self.__column_length(column)
+        if current < length:
+            # round up to a whole chunk so the file is not grown on every load
+            target = ((length + store_chunk - 1) // store_chunk) * store_chunk
+            with open(self.__column_path(column), "ab") as file:
+                numpy.full(target - current, numpy.nan, dtype=self.dtype).tofile(file)
+            current = target
+        result = numpy.memmap(self.__column_path(column), dtype=self.dtype, mode="r+", shape=(current,))
+        return result
+
+##############################################################################
+#  write_values - store (periodno, value) pairs into a column, empty_rate
+#  values are stored as NaN. returns the number of values written
+##############################################################################
+    def write_values(self, column, period_values):
+        result = 0
+        if self.store_ready() == True and column in store_columns:
+            pairs = list(period_values)
+            if pairs:
+                periodnos = numpy.fromiter( (pair[0] for pair in pairs), dtype=numpy.int64, count=len(pairs))
+                values = numpy.fromiter( (pair[1] for pair in pairs), dtype=numpy.float64, count=len(pairs))
+                values[values == empty_rate] = numpy.nan
+
+                writable = self.__grow_column(column, int(periodnos.max()) + 1)
+                writable[periodnos] = values
+                writable.flush()
+                del writable
+                result = len(pairs)
+                self.log.debug(f"store wrote {result} {column} values")
+        return result
+
+##############################################################################
+#  get_period_range - views of the cost and usage columns for periodnos
+#  from first up to (not including) last. The arrays are read only slices
+#  of the memory map - nothing is copied - unless the range runs past the 
+#  data stored when a NaN padded copy is returned. Missing values are NaN
+##############################################################################
+    def get_period_range(self, first, last):
+        result = None
+        if self.store_ready() == True:
+            result = []
+            for column in store_columns:
+                mapped = self.__map_column(column)
+                length = 0 if mapped is None else len(mapped)
+                if first >= 0 and last <= length:
+                    view = mapped[first:last]
+                else:
+                    view = numpy.full(max(last - first, 0), numpy.nan, dtype=self.dtype)
+                    start = max(first, 0)
+                    end = min(last, length)
+                    if end > start:
+                        view[start-first:end-first] = mapped[start:end]
+                result.append(view)
+            result = tuple(result)
+        return result
+
+##############################################################################
+#  get_range - (cost, usage) arrays from dateobj_from up to dateobj_to
+##############################################################################
+    def get_range(self, dateobj_from, dateobj_to):
+        result = self.get_period_range(gen_periodno_date(dateobj_from), gen_periodno_date(dateobj_to))
+        return result
+
+##############################################################################
+#  clear - remove the column files so the store can be rebuilt
+##############################################################################
+    def clear(self):
+        result = False
+        if self.store_ready() == True:
+            result = True
+            self.columns = {}
+            for column in store_columns:
+                path = self.__column_path(column)
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except OSError as error:
+                    self.log.error(f"Failed to remove store file {path} [{error}]")
+                    result = False
+        return result
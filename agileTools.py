@@ -20,12 +20,31 @@
 ########################################################################
 
 from datetime import datetime, timedelta, date
+import threading
+import signal
+import queue
 import sys
 import os
 
 
 yroffset=2020
 
+# periodno 0 is the half hour starting at midnight UTC on 1st January yroffset
+period_epoch = datetime(yroffset,1,1)
+epoch_ordinal = period_epoch.toordinal()
+# the epoch as unix seconds - used to number periods inside SQL
+epoch_seconds = int((period_epoch - datetime(1970,1,1)).total_seconds())
+
+# the pidfile of the checkTriggers daemon when [filepaths] trigger_pidfile is not set
+default_trigger_pidfile = "/tmp/agileTriggers.pid"
+# the socket checkTriggers pushes trigger changes on when [filepaths]
+# trigger_socket is not set
+default_trigger_socket = "/tmp/agileTriggers.sock"
+
+# where octopusStub.py listens when the [octopus_stub] settings are not set
+default_stub_host = "127.0.0.1"
+default_stub_port = 8099
+
 ############################################################################
 #  buildfilepath - build a path to a file expanding path substitutions
 ############################################################################
@@ -142,19 +161,17 @@ def gen_periodno_date(dateobj):
 
 ##############################################################################
 #  gen_periodno - work out the period number from the start of yroffset 
+#  periods are numbered densely - one number for every real UTC half hour 
+#  counted from midnight on 1st January of yroffset (period 0)
 ##############################################################################
 def gen_periodno(year,month,day,hour,minute):
     period = 0
         
     if minute >= 30:
         period = 1
-        # generate a periodno from the time components based on half hour
-        # # periods - there are:
-        # # 2 in an hour
-        # # 48 in a day
-        # # 1488 in a 31 day month (theer will be gaps for 28/29/30 day months) 
-        # # each year has 17856 periods - start with yroffset being year 0 
-    periodno = period + (hour*2) + (day*48) + (month*1488) + ((year-yroffset)*17856)
+    # whole days since the epoch - 48 half hour periods in each
+    days = date(year,month,day).toordinal() - epoch_ordinal
+    periodno = period + (hour*2) + (days*48)
 
     return periodno
 
@@ -162,15 +179,143 @@ def gen_periodno(year,month,day,hour,minute):
 #  date_from_periodno - get a dateobj from a periodno
 ##############################################################################
 def date_from_periodno(periodno):
-    year  = int(periodno / 17856) + yroffset 
-    month = int((periodno % 17856) / 1488)
-    day   = int((periodno % 1488) / 48)
-    hour  = int((periodno % 48) / 2)
-    minute= int((periodno % 2))
-    theDate = datetime(year,month,day,hour,minute)
+    theDate = period_epoch + timedelta(minutes=30*periodno)
 
     return theDate
+
+##############################################################################
+#  parts_from_periodno - get (year,month,day,hour,minute) from a periodno
+##############################################################################
+def parts_from_periodno(periodno):
+    day = date.fromordinal(epoch_ordinal + periodno // 48)
+    half_hours = periodno % 48
+    result = (day.year, day.month, day.day, half_hours // 2, (half_hours % 2) * 30)
+    return result
               
+##############################################################################
+#  periodnos_from_timestrings - convert ISO-8601 timestrings from the API 
+#  (valid_from / interval_start) to periodnos in one pass. The fields are 
+#  sliced from their fixed positions rather than parsed - the only part 
+#  that varies is the zone which may be Z or an offset such as +01:00 (the
+#  consumption endpoint reports BST times) and is taken off to get UTC
+##############################################################################
+def periodnos_from_timestrings(timestrings):
+    result = []
+    # the day and zone strings repeat 48 times a day - work each out once
+    daynos = {}
+    offsets = { "" : 0, "Z" : 0 }
+
+    for text in timestrings:
+        day = text[:10]
+        dayno = daynos.get(day)
+        if dayno == None:
+            dayno = date(int(day[0:4]), int(day[5:7]), int(day[8:10])).toordinal() - epoch_ordinal
+            daynos[day] = dayno
+
+        # anything after the seconds (and any fraction of a second) is the zone
+        zone = text[19:].lstrip(".0123456789")
+        offset = offsets.get(zone)
+        if offset == None:
+            offset = int(zone[1:3]) * 60 + int(zone[-2:])
+            if zone[0] == "-":
+                offset = -offset
+            offsets[zone] = offset
+
+        minutes = int(text[11:13]) * 60 + int(text[14:16]) - offset
+        # floor division carries an offset back over midnight to the day before
+        result.append(dayno * 48 + minutes // 30)
+    return result
+
+##############################################################################
+#  dayno_from_periodno - the day number (agile_rollup_day key) of a period 
+##############################################################################
+def dayno_from_periodno(periodno):
+    # there are 48 half hour periods in each day - day 0 is the epoch
+    result = periodno // 48
+    return result
+
+##############################################################################
+#  gen_monthno - the month number (agile_rollup_month key) from the year offset
+##############################################################################
+def gen_monthno(year,month):
+    result = 12 * (year - yroffset) + month
+    return result
+
+##############################################################################
+#  split_date_range - split dateobj_from up to dateobj_to into consecutive 
+#  (from, to) windows of at most days days - the last window may be shorter
+##############################################################################
+def split_date_range(dateobj_from, dateobj_to, days):
+    result = []
+    step = timedelta(days=days)
+    window_from = dateobj_from
+    while window_from < dateobj_to:
+        window_to = min(window_from + step, dateobj_to)
+        result.append((window_from, window_to))
+        window_from = window_to
+    return result
+
+##############################################################################
+#  merge_period_ranges - merge sorted (first, last) periodno ranges whose
+#  gap is less than gap periods so close ranges are fetched as one
+##############################################################################
+def merge_period_ranges(ranges, gap):
+    result = []
+    for (first, last) in ranges:
+        if len(result) > 0 and first - result[-1][1] - 1 < gap:
+            result[-1] = (result[-1][0], max(result[-1][1], last))
+        else:
+            result.append((first, last))
+    return result
+
+##############################################################################
+#  stream_pages - iterate pages (any iterable) in a background thread and 
+#  yield its items through a queue holding at most depth items, so the 
+#  producer (network) runs ahead of the consumer (database) by a bounded 
+#  amount. An exception raised by the producer is raised in the consumer
+##############################################################################
+def stream_pages(pages, depth=4):
+    items = queue.Queue(maxsize=max(depth, 1))
+    finished = object()
+    stopping = threading.Event()
+
+    def producer():
+        try:
+            for page in pages:
+                # give up waiting for room if the consumer has stopped
+                while stopping.is_set() == False:
+                    try:
+                        items.put( (page, None), timeout=0.5)
+                        break
+                    except queue.Full:
+                        pass
+                if stopping.is_set() == True:
+                    break
+        except Exception as error:
+            items.put( (finished, error) )
+        else:
+            items.put( (finished, None) )
+
+    thread = threading.Thread(target=producer, name="stream_pages", daemon=True)
+    thread.start()
+    try:
+        while True:
+            (page, error) = items.get()
+            if page is finished:
+                if error != None:
+                    raise error
+                break
+            yield page
+    finally:
+        stopping.set()
+        # drain so a blocked producer can finish
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
 ##############################################################################
 #  timestring_from_date - get a timestring from a date object
 ##############################################################################
@@ -193,4 +338,50 @@ def time_now():
     result =  datetime.utcnow()
     return result
         
-##############################################################################
\ No newline at end of file
+##############################################################################
+
+##############################################################################
+#  trigger_pidfile - the path of the checkTriggers daemon pidfile
+##############################################################################
+def trigger_pidfile(theConfig):
+    result = theConfig.read_value('filepaths','trigger_pidfile')
+    if result == None:
+        result = default_trigger_pidfile
+    result = os.path.expanduser(result)
+    return result
+
+##############################################################################
+#  trigger_socket - the path of the socket trigger changes are pushed on or
+#  None if [filepaths] trigger_socket is set to none
+##############################################################################
+def trigger_socket(theConfig):
+    result = theConfig.read_value('filepaths','trigger_socket')
+    if result == None:
+        result = default_trigger_socket
+    if result.lower() == "none":
+        result = None
+    else:
+        result = os.path.expanduser(result)
+    return result
+
+##############################################################################
+#  stub_url - the OctopusUrl of an octopusStub.py running on host and port
+##############################################################################
+def stub_url(host=default_stub_host, port=default_stub_port):
+    result = f"http://{host}:{port}/v1/"
+    return result
+
+##############################################################################
+#  wake_trigger_daemon - tell a running checkTriggers daemon (SIGUSR1) to 
+#  look at the prices and triggers again. Returns True if one was signalled
+##############################################################################
+def wake_trigger_daemon(pidfile):
+    result = False
+    try:
+        with open(pidfile) as file:
+            pid = int(file.read().strip())
+        os.kill(pid, signal.SIGUSR1)
+        result = True
+    except (OSError, ValueError):
+        result = False
+    return result
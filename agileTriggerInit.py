@@ -68,6 +68,12 @@ ratetime=None
 my_account= OctopusAgileDB(config,log)
 log.info("init Agile database and cost/usage tables")
 my_account.initialise_agile_db()
+log.info("upgrade an existing database to the current schema")
+my_account.upgrade_agile_db()
+log.info("rebuild day and month rollups from existing data")
+my_account.rebuild_db_rollups()
+log.info("rebuild the columnar store (if configured) from existing data")
+my_account.rebuild_store()
 
 log.info("init trigger database tables")
 my_trigger= costTriggers(config,log)
@@ -108,11 +114,13 @@ my_job2 = my_cron.new(command=cron_command)
 my_job2.hour.on(0,6,12,18)
 my_job2.set_comment(cron_comment)
 
-# Initialise the  trigger check every 30 minutes
+# Initialise the  trigger daemon watchdog - checkTriggers runs until it is
+# stopped and exits straight away if it is already running so this only 
+# (re)starts it when it is not running
 cron_comment="added by agileTriggerInit"
-cron_command="/usr/bin/python3 "+binPath+"/checkTriggers.py 2>&1 > "+logPath+"/cron.log"
+cron_command="/usr/bin/python3 "+binPath+"/checkTriggers.py >> "+logPath+"/cron.log 2>&1"
 my_job3 = my_cron.new(command=cron_command)
-my_job3.minute.on(0,30)
+my_job3.minute.every(5)
 my_job3.set_comment(cron_comment)
 
 log.info("updating cron entry settings")
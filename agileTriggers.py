@@ -24,8 +24,11 @@
 from config import configFile
 from agileDB import OctopusAgileDB
 from mylogger import nulLogger, mylogger
-from sqliteDB import sqliteDB
+from sqliteDB import sqliteDB, read_db_settings
 from agileTools import check_permission
+from triggerPublisher import TriggerPublisher
+from bisect import bisect_right
+import sqlite3
 import sys
 import os
 
@@ -35,6 +38,13 @@ class costTriggers:
     triggerFolder = None
     triggerPerms  = None
     dbobject      = None
+# the triggers ordered by cost - names and costs in step
+    trigger_names = None
+    trigger_costs = None
+# how many (of the most expensive) triggers were on after the last process
+    trigger_on    = None
+# publishes the trigger files and the state file
+    publisher     = None
 
 ##############################################################################
 #  __init__ class init for costTriggers class 
@@ -51,7 +61,7 @@ class costTriggers:
         if self.database == None :
             self.log.error("no database file path registered")
         else:
-            self.dbobject = sqliteDB(self.database, theLogger)
+            self.dbobject = sqliteDB(self.database, theLogger, read_db_settings(theConfig, theLogger))
 
         self.triggerFolder = theConfig.read_value('filepaths','trigger_folder')
         perms = theConfig.read_value('filepaths','trigger_permissions')
@@ -78,7 +88,8 @@ class costTriggers:
                 print(f"checkTriggers Error - {error}")
                 raise sys.exit(1)
 
-
+        state_file = theConfig.read_value('filepaths','trigger_state_file')
+        self.publisher = TriggerPublisher(self.triggerFolder, self.triggerPerms, state_file, theLogger)
 
         self.log.debug("FINISHED __init__ ")
 
@@ -119,6 +130,10 @@ class costTriggers:
                 if self.dbobject.db_query(sqlite_query) == True:
                     data = True
                     self.log.debug("Created agile_triggers table")
+
+                # and the table of when each trigger changes state
+                if self.create_trigger_schedule_table(True) == False:
+                    data = False
    
                 if data == True:
                     result = True
@@ -129,23 +144,39 @@ class costTriggers:
         self.log.debug("FINISHED initialise_trigger_db ")
 
 ##############################################################################
-#   __start_trigger -  function to trigger a start
+#  create_trigger_schedule_table - create the trigger_schedule table if it
+#  is not there. Each row is a change of state of one trigger (1 started,
+#  0 stopped) at the start of a period
 ##############################################################################
-    def __start_trigger(self,trigger_name):
-        self.log.debug("STARTED  start_trigger ")
-        file=os.path.join(self.triggerFolder,trigger_name)
-        if os.path.exists(file) == False:
-            os.mknod(file,self.triggerPerms)
-        self.log.debug("FINISHED start_trigger ")
+    def create_trigger_schedule_table(self,inlist=False):
+        result = False
+        connected = True
+        self.log.debug("STARTED create_trigger_schedule_table ")
+        if self.dbobject.db_ready() == True:
+            if inlist == False: connected = self.dbobject.db_connect()
+            if connected == True:
+                sqlite_query = """CREATE TABLE IF NOT EXISTS trigger_schedule 
+                    (periodno INTEGER, trigger_name TEXT, state INTEGER, 
+                     PRIMARY KEY (periodno, trigger_name)) WITHOUT ROWID"""
+                result = self.dbobject.db_query(sqlite_query)
+                if inlist == False: self.dbobject.db_disconnect()
+        self.log.debug("FINISHED create_trigger_schedule_table ")
+        return result
+
 ##############################################################################
-#   __stop_trigger -  function to trigger a stop
+#   __set_trigger - start (True) or stop (False) a trigger - the publisher 
+#   only touches the file when the state it last gave it changes
 ##############################################################################
-    def __stop_trigger(self,trigger_name):
-        self.log.debug("STARTED  stop_trigger ")
-        file=os.path.join(self.triggerFolder,trigger_name)
-        if os.path.exists(file):
-            os.remove(file)
-        self.log.debug("FINISHED stop_trigger ")
+    def __set_trigger(self,trigger_name,state):
+        self.publisher.set_state(trigger_name,state)
+
+##############################################################################
+#   reset_trigger_state - forget how many triggers are on so the next 
+#   process checks every trigger again - the publisher still only touches
+#   the triggers whose state is different
+##############################################################################
+    def reset_trigger_state(self):
+        self.trigger_on = None
 
 ##############################################################################
 #   is triggered -  function to trigger a stop
@@ -162,23 +193,201 @@ class costTriggers:
 
 ##############################################################################
 #   process_triggers -  process all the triggers against a cost trigger
+#   an unknown cost (None) stops every trigger. The triggers are held in 
+#   cost order so the ones on are always the last few - bisect finds how 
+#   many and only the triggers between the last count and this one change
 ##############################################################################
     def process_triggers(self,triggers,trigger_cost):
         self.log.debug(f"STARTED  process_triggers trigger_cost={trigger_cost}")
 
-        for trigger in triggers:
-            name = trigger[0]
-            cost = trigger[1]
-            self.log.debug(f"trigger[{name}] cost={cost:5f}")
+        # every change of this check is published together
+        with self.publisher.batch():
+            self.__order_triggers(triggers)
+            names = self.trigger_names
+            count = len(names)
+            on = self.triggers_on(self.trigger_costs,trigger_cost)
+
+            if self.trigger_on == None:
+                # nothing known - set every trigger
+                for name in names[:count-on]:
+                    self.__set_trigger(name,False)
+                for name in names[count-on:]:
+                    self.__set_trigger(name,True)
+            elif on > self.trigger_on:
+                for name in names[count-on:count-self.trigger_on]:
+                    self.log.debug(f"trigger[{name}] START trigger")
+                    self.__set_trigger(name,True)
+            elif on < self.trigger_on:
+                for name in names[count-self.trigger_on:count-on]:
+                    self.log.debug(f"trigger[{name}] STOP  trigger")
+                    self.__set_trigger(name,False)
+            self.trigger_on = on
+
+        self.log.debug(f"FINISHED process_triggers {on} of {count} on")
 
-            if  trigger_cost >= cost :
-                self.log.debug(f"trigger[{name}] STOP  trigger")
-                self.__stop_trigger(name)
-            else:
-                self.log.debug(f"trigger[{name}] START trigger")
-                self.__start_trigger(name)
+##############################################################################
+#   __order_triggers - hold the triggers in cost order, rebuilt only when the
+#   list of triggers changes. Triggers that have gone are stopped
+##############################################################################
+    def __order_triggers(self,triggers):
+        ordered = sorted( (trigger[1], trigger[0]) for trigger in triggers )
+        names = [ trigger[1] for trigger in ordered ]
+        costs = [ trigger[0] for trigger in ordered ]
+        if names != self.trigger_names or costs != self.trigger_costs:
+            for name in set(self.publisher.states).difference(names):
+                self.publisher.discard(name)
+            self.trigger_names = names
+            self.trigger_costs = costs
+            # the partition moved - set every trigger on the next pass
+            self.trigger_on = None
+
+##############################################################################
+#   triggers_on - how many triggers are started at trigger_cost. A trigger 
+#   is on while the cost is below its own cost so the triggers on at any
+#   price are always the most expensive ones - the count says which
+##############################################################################
+    def triggers_on(self,costs,trigger_cost):
+        result = 0
+        if trigger_cost != None:
+            result = len(costs) - bisect_right(costs,trigger_cost)
+        return result
+
+##############################################################################
+#   compile_trigger_schedule - rebuild trigger_schedule from the known 
+#   prices from periodno onwards. The first period gets the state of every
+#   trigger, after that only the triggers that change are written. A 
+#   period with no price (a gap or the end of the prices) stops everything.
+#   Run after new prices are loaded and after the triggers are changed
+#   returns the number of events written or None on failure
+##############################################################################
+    def compile_trigger_schedule(self,agileDB,periodno):
+        self.log.debug("STARTED compile_trigger_schedule ")
+        result = None
+
+        triggers = self.get_all_triggers()
+        periods = agileDB.get_db_forward_costs(periodno)
+        if triggers != None and periods != None and self.dbobject.db_ready() == True:
+            # ordered by cost the triggers on at any price are always the last ones
+            ordered = sorted( (trigger[1], trigger[0]) for trigger in triggers )
+            costs = [ trigger[0] for trigger in ordered ]
+            names = [ trigger[1] for trigger in ordered ]
+            count = len(names)
+
+            events = []
+            current = None
+            expected = periodno
+            for (next_periodno, cost) in periods:
+                if next_periodno != expected:
+                    # no price between expected and next_periodno - all off
+                    events += self.__schedule_changes(names, expected, current, 0)
+                    current = 0
+                on = self.triggers_on(costs,cost)
+                events += self.__schedule_changes(names, next_periodno, current, on)
+                current = on
+                expected = next_periodno + 1
+            # the prices run out
+            events += self.__schedule_changes(names, expected, current, 0)
+
+            if self.dbobject.db_connect() == True:
+                try:
+                    with self.dbobject.db_transaction(immediate=True):
+                        self.create_trigger_schedule_table(True)
+                        self.dbobject.db_query("DELETE FROM trigger_schedule")
+                        if events:
+                            self.dbobject.db_querymany("""INSERT INTO trigger_schedule 
+                                (periodno, trigger_name, state) VALUES (?,?,?)""", events)
+                    result = len(events)
+                    self.log.info(f"trigger schedule compiled {count} triggers {len(periods)} prices {result} events")
+                except sqlite3.Error as error:
+                    self.log.error(f"Failed to compile the trigger schedule [{error}]")
+                self.dbobject.db_disconnect()
+
+        self.log.debug("FINISHED compile_trigger_schedule ")
+        return result
+
+##############################################################################
+#   __schedule_changes - the (periodno, trigger_name, state) events when the
+#   number of triggers on goes from current to on - only the triggers in 
+#   between change. current None writes every trigger
+##############################################################################
+    def __schedule_changes(self,names,periodno,current,on):
+        result = []
+        count = len(names)
+        if current == None:
+            result = [ (periodno, name, int(index >= count - on)) for (index, name) in enumerate(names) ]
+        elif on > current:
+            result = [ (periodno, name, 1) for name in names[count-on:count-current] ]
+        elif on < current:
+            result = [ (periodno, name, 0) for name in names[count-current:count-on] ]
+        return result
+
+##############################################################################
+#   get_trigger_states - the scheduled state of every trigger at periodno
+#   as a dict of trigger_name : state (the last event at or before it)
+##############################################################################
+    def get_trigger_states(self,periodno):
+        result = None
+        self.log.debug("STARTED get_trigger_states ")
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                sqlite_select_query = """SELECT trigger_name, state, MAX(periodno) FROM trigger_schedule 
+                    WHERE periodno <= ? GROUP BY trigger_name"""
+                if self.dbobject.db_query(sqlite_select_query,(periodno,)) == True:
+                    result = { row[0] : row[1] for row in self.dbobject.db_queryresults() }
+                else:
+                    self.log.error("Failed to get trigger states")
+                self.dbobject.db_disconnect()
+        self.log.debug("FINISHED get_trigger_states ")
+        return result
+
+##############################################################################
+#   get_trigger_events - the (periodno, trigger_name, state) events after 
+#   after_periodno up to and including upto_periodno in time order
+##############################################################################
+    def get_trigger_events(self,after_periodno,upto_periodno):
+        result = None
+        self.log.debug("STARTED get_trigger_events ")
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                sqlite_select_query = """SELECT periodno, trigger_name, state FROM trigger_schedule 
+                    WHERE periodno > ? AND periodno <= ? ORDER BY periodno"""
+                if self.dbobject.db_query(sqlite_select_query,(after_periodno,upto_periodno)) == True:
+                    result = self.dbobject.db_queryresults()
+                else:
+                    self.log.error("Failed to get trigger events")
+                self.dbobject.db_disconnect()
+        self.log.debug("FINISHED get_trigger_events ")
+        return result
+
+##############################################################################
+#   get_next_trigger_event - the periodno of the first event after periodno
+#   or None if nothing more is scheduled
+##############################################################################
+    def get_next_trigger_event(self,periodno):
+        result = None
+        if self.dbobject.db_ready() == True:
+            if self.dbobject.db_connect() == True:
+                sqlite_select_query = "SELECT MIN(periodno) FROM trigger_schedule WHERE periodno > ?"
+                if self.dbobject.db_query(sqlite_select_query,(periodno,)) == True:
+                    for row in self.dbobject.db_queryresults():
+                        result = row[0]
+                self.dbobject.db_disconnect()
+        return result
 
-        self.log.debug("FINISHED process_triggers ")
+##############################################################################
+#   apply_trigger_states - start or stop triggers from a dict of 
+#   trigger_name : state. complete says states holds every trigger - any
+#   other trigger published (one that has been deleted) is removed
+##############################################################################
+    def apply_trigger_states(self,states,complete=False):
+        self.log.debug(f"STARTED  apply_trigger_states {len(states)} triggers")
+        with self.publisher.batch():
+            if complete == True:
+                for name in set(self.publisher.states).difference(states):
+                    self.publisher.discard(name)
+            for (name, state) in states.items():
+                self.__set_trigger(name, state == 1)
+        self.log.debug("FINISHED apply_trigger_states ")
 
 ##############################################################################
 #   get_all_triggers -  get the list of triggers
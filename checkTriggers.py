@@ -6,6 +6,7 @@
 # if there is a trigger (start triggers are when cost is below trigger)
 #                       (stop  triggers are when cost is above trigger)
 # the trigger creates (start) or deletes (stop) the triggerfile
+# and each change is pushed to the subscribers of the trigger socket
 #
 # Copyright 2020 Simon McKenna.
 #
@@ -23,12 +24,16 @@
 ########################################################################
 
 from config import configFile
-from agileTools import buildFilePath,time_now
+from agileTools import buildFilePath,time_now,gen_periodno_date,date_from_periodno,trigger_pidfile,trigger_socket
 from agileDB import OctopusAgileDB
 from agileTriggers import costTriggers
+from triggerNotify import TriggerNotifier
 from mylogger import mylogger
-from datetime import datetime,timedelta
+from datetime import datetime
+import argparse
 import signal
+import select
+import fcntl
 import time
 import sys
 import os
@@ -37,77 +42,169 @@ import os
 # Global variable that controls the trigger loop
 ############################################################################
 trigger_continue_loop = True
+# set to wake the loop early - new prices or changed triggers
+trigger_wake = False
+# the pipe signal.set_wakeup_fd writes each signal to - the loop sleeps in
+# select on the read end so a signal ends the sleep at once
+trigger_wake_pipe = None
+# the locked pidfile - held open for as long as we run
+trigger_pid_file = None
+
+# longest sleep between checks (seconds) when no trigger change is due
+default_max_sleep = 3600
+# seconds after a period starts before it is checked - makes sure the
+# clock has passed the boundary when we wake
+wake_margin = 0.05
 
 ############################################################################
 # Signal Handler for termination signals - set the loop vairable to False
+# the handlers only set flags - no locks may be taken in a signal handler
+# the signal itself wakes the loop through trigger_wake_pipe
 ############################################################################
 def signal_handler(s,f):
     global trigger_continue_loop
     trigger_continue_loop = False
-    log.info(f"recieved signal {s} terminating loop")
-    raise Exception("Signal Exception")
 
+############################################################################
+# Signal Handler for SIGUSR1 - new prices or triggers, check again now
+############################################################################
+def wake_handler(s,f):
+    global trigger_wake
+    trigger_wake = True
 
 ############################################################################
-# main function - sit here forever 
+# setup_wake_pipe - have every signal written to a pipe so the sleeping
+# loop wakes as soon as one arrives
 ############################################################################
-def check_trigger_main(my_account,my_triggers):
-    global trigger_continue_loop
-    global log
-    unit_cost = None
-    trigger_list = None
-    result = None
-    tgt_minutes = 0
-    tgt_seconds = 15
+def setup_wake_pipe():
+    global trigger_wake_pipe
+    (read_fd, write_fd) = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+    signal.set_wakeup_fd(write_fd)
+    trigger_wake_pipe = (read_fd, write_fd)
+
+############################################################################
+# sleep_until - sleep until the monotonic deadline, a stop or a wake
+############################################################################
+def sleep_until(deadline):
+    while trigger_continue_loop == True and trigger_wake == False:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        readable = select.select([trigger_wake_pipe[0]], [], [], remaining)[0]
+        if readable:
+            # log the signals that woke us outside of the handlers
+            try:
+                for signo in os.read(trigger_wake_pipe[0], 512):
+                    log.info(f"recieved signal {signo}")
+            except BlockingIOError:
+                pass
+
+############################################################################
+# acquire_pidfile - lock the pidfile so only one checkTriggers runs. 
+# returns False if another instance holds it
+############################################################################
+def acquire_pidfile(path):
+    global trigger_pid_file
+    result = False
+    file = open(path, "a+")
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        file.seek(0)
+        file.truncate()
+        file.write(f"{os.getpid()}\n")
+        file.flush()
+        trigger_pid_file = file
+        result = True
+    except BlockingIOError:
+        file.close()
+    return result
+
+############################################################################
+# check_triggers - replay the trigger_schedule events due since 
+# last_periodno, or set every trigger to its scheduled state now when 
+# last_periodno is None (at start and when the schedule is rebuilt).
+# Without a schedule the triggers are checked against the price now.
+# returns (periodno now, periodno of the next event or None)
+############################################################################
+def check_triggers(my_account,my_triggers,last_periodno):
+    t_now = time_now()
+    periodno = gen_periodno_date(t_now)
+    log.info(f" Trigger Check started {t_now}")
+
+    states = {}
+    complete = False
+    if last_periodno == None:
+        log.debug("Query Database for the state of every trigger")
+        # check every trigger again rather than trust what we last did
+        my_triggers.reset_trigger_state()
+        states = my_triggers.get_trigger_states(periodno)
+        trigger_list = my_triggers.get_all_triggers()
+        if trigger_list == None: trigger_list = []
+        if states == None:
+            log.error("No trigger schedule - checking the triggers against the price now")
+            my_triggers.process_triggers(trigger_list, my_account.get_db_period_cost(t_now))
+            states = {}
+        else:
+            # a trigger with nothing scheduled has no price - stop it
+            for trigger in trigger_list:
+                states.setdefault(trigger[0], 0)
+            # and a trigger that is no longer listed is removed
+            complete = True
+    elif periodno > last_periodno:
+        log.debug("Query Database for trigger events due")
+        events = my_triggers.get_trigger_events(last_periodno, periodno)
+        if events != None:
+            # the latest event for each trigger wins
+            for (event_periodno, name, state) in events:
+                states[name] = state
+
+    my_triggers.apply_trigger_states(states, complete)
+    result = (periodno, my_triggers.get_next_trigger_event(periodno))
+
+    log.info(f" Trigger Check completed {time_now()} {len(states)} triggers set")
+    return result
+
+############################################################################
+# main function - sit here forever sleeping until the next trigger event
+############################################################################
+def check_trigger_main(my_account,my_triggers,max_sleep):
+    global trigger_wake
+    last_periodno = None
 
     log.debug("Started check_trigger_main")
 
     # Setup the signal handler 
+    setup_wake_pipe()
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGUSR1, wake_handler)
     try:
         while trigger_continue_loop == True:
+            trigger_wake = False
 
-            t_now = datetime.utcnow()
-            log.info(f" Trigger Check started {t_now}")
-
-            # Get the current cost. 
-            log.debug("Query Database for current cost")
-            unit_cost = my_account.get_db_period_cost(time_now())
-
-            # Get the list of triggers
-            log.debug("Query Database for triggers")
+            (last_periodno, next_periodno) = check_triggers(my_account,my_triggers,last_periodno)
 
-            trigger_list=my_triggers.get_all_triggers()
-
-            # iterate the list of triggers  creating or deleting file as necessary
-            log.debug(" calling process triggers")
+            # sleep until the next event - or the longest sleep if none is scheduled
+            seconds = max_sleep
+            if next_periodno != None:
+                t_future = date_from_periodno(next_periodno)
+                seconds = min(max_sleep, (t_future - time_now()).total_seconds() + wake_margin)
+                log.info(f" Next trigger event at {t_future} in {seconds:.1f} seconds")
+            else:
+                log.info(f" No trigger event scheduled - sleeping {seconds} seconds")
 
-            result = my_triggers.process_triggers(trigger_list, unit_cost)
-            
-            # find the time now in preperation for going to sleep
-            t_now = datetime.utcnow()
-            log.info(f" Trigger Check completed {t_now}")
+            # the monotonic clock is not moved by clock changes while we sleep
+            sleep_until(time.monotonic() + max(seconds, 0))
 
-            #figure out the minutes offset for the next period
-            if t_now.minute >= 30:
-                tgt_minutes = 0
-            else:
-                tgt_minutes = 30
-
-            # We are going to sleep for 30 minutes
-            t_future = t_now + timedelta(minutes=30)
-            # Set the desired future time to be on the half hour (plus 15 seconds)  
-            t_future = t_future.replace(minute=tgt_minutes, second=tgt_seconds)
-            # less the time we have been processing (in seconds)
-            seconds = (t_future - t_now).seconds
-
-            # Sleep
-            log.info(f" Sleeping until  {t_future} in {seconds} seconds")
-            time.sleep(seconds)
+            # woken because the schedule was rebuilt - set every trigger again
+            if trigger_wake == True:
+                log.info(" Woken to check the triggers again")
+                last_periodno = None
         # End of Loop
-    except:
-        log.info("check_trigger_main loop terminated due to exception")
+    except Exception as error:
+        log.error(f"check_trigger_main loop terminated due to exception [{error}]")
 
     log.debug("FINISHED check_trigger_main")
 
@@ -151,9 +248,29 @@ log = mylogger("checkTriggers",logFile,isdebug,toscreen)
 ############################################################################
 log.debug("STARTED checkTriggers.py")
 
+############################################################################
+# parse the command line
+############################################################################
+parser = argparse.ArgumentParser(description="Start and stop the agile triggers as the price changes")
+parser.add_argument("-O", "--once", action="store_true",
+                    help=" check the triggers once and exit")
+args = parser.parse_args()
+
+# only one daemon at a time - cron runs us as a watchdog and we just exit
+# if one is already running
+pidfile = trigger_pidfile(config)
+if args.once == False and acquire_pidfile(pidfile) == False:
+    log.debug(f"checkTriggers already running - pidfile {pidfile} is locked")
+    sys.exit(0)
+
+max_sleep=config.read_value('settings','trigger_max_sleep')
+if max_sleep == None: max_sleep = default_max_sleep
+else: max_sleep = float(max_sleep)
+
 # create agile DB object
 log.debug("init Octopus Agile object")
 my_account = OctopusAgileDB(config,log)
+my_account.upgrade_agile_db()
 
 # create cost trigger object
 log.debug("init cost Trigger object")
@@ -161,6 +278,26 @@ my_triggers= costTriggers(config,log)
 ############################################################################
 #  ruh main routine
 ############################################################################
-result = check_trigger_main(my_account,my_triggers)
+# bring the schedule up to date with the prices and triggers we have now
+my_triggers.compile_trigger_schedule(my_account, gen_periodno_date(time_now()))
+
+if args.once == True:
+    result = check_triggers(my_account,my_triggers,None)
+else:
+    # push every trigger change to the subscribers of the socket
+    notifier = None
+    socket_path = trigger_socket(config)
+    if socket_path != None:
+        notifier = TriggerNotifier(socket_path, log)
+        if notifier.start() == True:
+            my_triggers.publisher.set_notifier(notifier)
+        else:
+            notifier = None
+
+    result = check_trigger_main(my_account,my_triggers,max_sleep)
+
+    if notifier != None:
+        my_triggers.publisher.set_notifier(None)
+        notifier.stop()
 
 log.debug("FINISHED checkTriggers.py")
\ No newline at end of file
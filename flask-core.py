@@ -12,6 +12,11 @@ from datetime import datetime, timedelta
 import calendar
 import sys
 import io
+# agileFrame needs numpy - without it the heatmap is not available
+try:
+    from agileFrame import PeriodFrame
+except ImportError:
+    PeriodFrame = None
 
 import matplotlib.pyplot as plt
 import matplotlib
@@ -65,6 +70,7 @@ log = mylogger("webapp",logFile,isdebug,toscreen)
 # Create the Octopus Agile Object
 ############################################################################
 my_database=OctopusAgileDB(config,log)
+my_database.upgrade_agile_db()
 
 log.debug("Completed init of my_database")
 
@@ -177,7 +183,8 @@ def show_day(year,month,day):
     global log
     log.debug("STARTED webapp show_day()")
     
-    octopus_data = my_database.get_db_period_data(year,month,day)
+    day_start = datetime(year,month,day)
+    octopus_data = my_database.get_db_period_range(day_start, day_start + timedelta(days=1))
     prev=get_previous_day(year,month,day)
     next=get_next_day(year,month,day)
     if octopus_data == [] :
@@ -199,7 +206,7 @@ def show_day(year,month,day):
 def get_period_total(octopus_data):
     total = 0.0
     for period in octopus_data:
-        total+= float(period[3])
+        total+= period.period_cost
     return total
 
 ############################################################################
@@ -235,7 +242,7 @@ def create_figure(year,month,day):
     global log
     log.debug(f"STARTED webapp create_figure({year},{month},{day})")
     daysinmonth = calendar.monthrange(year,month)[1]
-    x_days = range(daysinmonth)
+    x_days = range(1, daysinmonth+1)
     y_cost =        [0] * daysinmonth
     y_use  =        [0] * daysinmonth
     y_costperkwh  = [0] * daysinmonth
@@ -248,15 +255,14 @@ def create_figure(year,month,day):
     fig.subplots_adjust(hspace=0.5)
 
     log.debug(f"querying database  webapp create_figure({year},{month},{day})")
-    octopus_data = my_database.get_db_period_data(year,month)
-    for entry in octopus_data:
-        # got a months worth of entries total up the days
-        day = int(entry[0].split('/')[0])
-        log.debug(f"entry data = [{entry}] day=[{day}]")
-        if float(entry[2]) != -999.99:
-            y_cost[day] += float(entry[3])
-            y_use[day] += float(entry[2])
-            y_costperkwh[day]  = y_cost[day]/y_use[day]
+    # one pre-aggregated row per day from the rollup table
+    rollup_data = my_database.get_db_rollup_days(year,month)
+    if rollup_data == None: rollup_data = []
+    for (rollup_day, cost, use, unit) in rollup_data:
+        log.debug(f"rollup data = [{rollup_day} {cost} {use} {unit}]")
+        y_cost[rollup_day-1] = cost
+        y_use[rollup_day-1] = use
+        y_costperkwh[rollup_day-1] = unit
     
     
     ax1.bar(x_days, y_cost, color="red")
@@ -280,6 +286,32 @@ def create_figure(year,month,day):
     log.debug("FINISHED webapp create_figure()")
     return fig
 
+############################################################################
+#  heatmap_png - price heatmap for a year (day of year by half hour)
+############################################################################
+@app.route('/<int:year>/heatmap.png', methods=["GET"])
+def heatmap_png(year):
+    log.debug(f"STARTED webapp heatmap_png({year})")
+
+    if PeriodFrame == None:
+        log.error("heatmap requested but numpy is not installed")
+        return Response("the heatmap needs numpy installed", status=501, mimetype='text/plain')
+
+    frame = PeriodFrame.from_db(my_database, datetime(year,1,1), datetime(year+1,1,1))
+
+    fig, ax1 = plt.subplots(1, 1)
+    fig.set_size_inches(12,8)
+    image = ax1.imshow(frame.heatmap("cost").T, aspect="auto", origin="lower", cmap="RdYlGn_r")
+    ax1.set_xlabel(f'day of {year}')
+    ax1.set_ylabel('half hour of day')
+    fig.colorbar(image, ax=ax1, label='cost(pence) per Kw/h')
+
+    output = io.BytesIO()
+    FigureCanvas(fig).print_png(output)
+
+    log.debug("FINISHED webapp heatmap_png()")
+    return Response(output.getvalue(), mimetype='image/png')
+
 ############################################################################
 #  get_previous_month get the previous day
 ############################################################################
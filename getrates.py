@@ -22,7 +22,9 @@
 
 from agileDB import OctopusAgileDB
 from agileAPI import OctopusAgileAPI
-from agileTools import time_now, builddateobj
+from agileTriggers import costTriggers
+from agileTools import time_now, builddateobj, stream_pages, periodnos_from_timestrings
+from agileTools import trigger_pidfile, wake_trigger_daemon, gen_periodno_date
 from config import configFile,buildFilePath
 from mylogger import mylogger
 from datetime import datetime, date
@@ -38,25 +40,22 @@ def load_rate_data(agileDB,rate_data):
     global log
     log.debug("STARTED load_rate_data ")
     result = -1
-    record = 0
-    if agileDB.connect_agile_db() == True:
-
-        for slot in rate_data:
-            cost = slot['value_inc_vat']
-            raw_from = slot['valid_from']
-            # We need to reformat the date to a python date from a json date
-            date = datetime.strptime(raw_from, "%Y-%m-%dT%H:%M:%SZ")
-            log.debug( f" Record {record:05d} YY:{date.year:4d} MM:{date.month:02d} DD:{date.day:02d} hh:{date.hour:02d} mm:{date.minute:02d} COST:"+str(cost))
-            result = agileDB.create_db_period_cost(date.year, date.month, date.day, date.hour, date.minute, cost, True)
-            if  result == -1:
-                log.debug(f"create period cost failed - record [{record}]")
-                break
-            record += 1
-
-        if result ==  -1:
-            result = record
-
-    agileDB.disconnect_agile_db()
+
+    # convert all the json dates of the page in one pass
+    periodnos = periodnos_from_timestrings( slot['valid_from'] for slot in rate_data )
+    rate_list = [ (periodno, slot['value_inc_vat']) for (periodno, slot) in zip(periodnos, rate_data) ]
+
+    log.debug(f"parsed {len(rate_list)} rate records")
+
+    # write all the records in a single transaction - windows we have already
+    # loaded are upserted so only changed prices are rewritten
+    counts = agileDB.create_db_period_costs(rate_list, upsert=True)
+    if counts == None:
+        log.error("create period costs failed - no records loaded")
+    else:
+        log.info(f"rates loaded inserted={counts['inserted']} updated={counts['updated']} unchanged={counts['unchanged']}")
+        result = counts['inserted'] + counts['updated'] + counts['unchanged']
+
     log.debug("FINISHED load_rate_data ")
     return result
 
@@ -110,6 +109,8 @@ args = parser.parse_args()
 my_account=OctopusAgileAPI( config, log)
 
 my_database=OctopusAgileDB( config, log)
+# make sure the database is on the current schema before loading into it
+my_database.upgrade_agile_db()
 
 datefrom=time_now()
 dateto=None
@@ -135,12 +136,9 @@ if args.historic == True:
             print(f"The date to detail could not be resolved [{args.end}]")
             valid = True
         else: 
-            # work out how many slots we are being asked for 
+            # long ranges are split into windows and fetched concurrently
             daterange = dateto - datefrom
-            count = int(daterange.total_seconds() / (30 * 60))
-            if count > 1500: 
-                print(f"Error too many records asked for {int(count/48)} days - max is 31 days")
-                sys.exit()
+            log.info(f"fetching {daterange.days} days of rates")
 
     
 if valid == True:
@@ -148,8 +146,24 @@ if valid == True:
 
     log.debug("in getRates.py post agile init")
 
-    rates = my_account.get_rates(datefrom,dateto)
+    # pages already downloaded waiting to be loaded
+    depth = config.read_value('settings','ingest_queue_depth')
+    if depth == None: depth = 4
+    else: depth = int(depth)
+
+    # each page is loaded as soon as it arrives while the next downloads
+    result = 0
+    for rates in stream_pages(my_account.iter_rate_pages(datefrom,dateto), depth):
+        loaded = load_rate_data(my_database,rates)
+        if loaded > 0: result += loaded
+
+    log.info(f"getRates: loaded {result} rate records")
 
-    log.debug(f"getRates: post call to get_rates")
+    # new prices change the trigger schedule - rebuild it and wake the daemon
+    if result > 0:
+        my_triggers = costTriggers(config, log)
+        my_triggers.compile_trigger_schedule(my_database, gen_periodno_date(time_now()))
+        if wake_trigger_daemon(trigger_pidfile(config)) == True:
+            log.info("getRates: trigger daemon woken")
 
-    result = load_rate_data(my_database,rates)
+    log.debug(f"getRates: api stats {my_account.get_stats()}")
@@ -26,10 +26,10 @@
 
 from agileDB import OctopusAgileDB
 from agileAPI import OctopusAgileAPI
-from agileTools import gen_periodno_date, date_from_periodno
+from agileTools import gen_periodno_date, date_from_periodno, stream_pages, periodnos_from_timestrings, merge_period_ranges
 from mylogger import mylogger
 from config import configFile, buildFilePath
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
 
 log = None
@@ -39,32 +39,43 @@ log = None
 ##############################################################################
 def load_usage_data(agileDB, usage_data):
     global log
-    record = 0
     result = None
 
     log.debug("STARTED load_usage_data ")
-    if agileDB.connect_agile_db() == True:
-
-        for result in usage_data:
-            usage = result['consumption']
-            raw_from = result['interval_start']
-
-            # We need to reformat the date to a python date from a json date
-            date = datetime.strptime(raw_from, "%Y-%m-%dT%H:%M:%SZ")
-            log.debug( f"Record {record:05d} YY:{date.year:4d} MM:{date.month:02d} DD:{date.day:02d} hh:{date.hour:02d} mm:{date.minute:02d} USAGE:{usage}")
-        
-            agileDB.update_db_period_usage (date.year, date.month, date.day, date.hour, date.minute, usage, True)
-            # increment the number of records
-            record += 1
-
-    log.debug(f" completed all loads record {record}")
-    result =  record
-    agileDB.disconnect_agile_db()
-    
+
+    # convert all the json dates of the page in one pass - usage is reported
+    # in local time (+01:00 in the summer) which is converted to UTC periods
+    periodnos = periodnos_from_timestrings( record['interval_start'] for record in usage_data )
+    usage_list = [ (periodno, record['consumption']) for (periodno, record) in zip(periodnos, usage_data) ]
+
+    # apply the whole page of usage in a single transaction
+    counts = agileDB.update_db_period_usages(usage_list)
+    if counts == None:
+        log.error("update period usages failed - no records loaded")
+    else:
+        log.info(f"usage loaded inserted={counts['inserted']} updated={counts['updated']} unchanged={counts['unchanged']}")
+        result = len(usage_list)
+
+    log.debug(f" completed all loads record {len(usage_list)}")
     log.debug("FINISHED load_usage_data ")
     return result
 
 
+##############################################################################
+#  missing_usage_pages - the usage pages for every missing range in turn.
+#  ranges less than an API window apart are fetched as one range so a 
+#  scatter of short gaps is not a call each
+##############################################################################
+def missing_usage_pages(agileAPI, missing):
+    for (f_periodno, l_periodno) in merge_period_ranges(missing, agileAPI.api_window_days * 48):
+        from_date = date_from_periodno(f_periodno)
+        # the last missing period runs for 30 minutes after its start
+        to_date = date_from_periodno(l_periodno) + timedelta(minutes=30)
+
+        # Query the data from Octopus 
+        yield from agileAPI.iter_usage_pages(from_date, to_date)
+
+
 ############################################################################
 #  setup config
 ############################################################################
@@ -102,20 +113,26 @@ log.debug("STARTED getUsage ")
 
 my_account= OctopusAgileAPI(config,log)
 my_database = OctopusAgileDB (config, log)
+# make sure the database is on the current schema before loading into it
+my_database.upgrade_agile_db()
 
-f_periodno = my_database.get_db_first_missing_usage()
 t_periodno = gen_periodno_date(datetime.utcnow())-24
 
-log.debug(f"f_periodno = {f_periodno} t_periodno={t_periodno}")
+# only ask Octopus for the holes in the usage data
+missing = my_database.get_db_missing_usage_ranges(t_periodno)
+
+log.debug(f"missing usage ranges = {missing} t_periodno={t_periodno}")
 
-if  f_periodno != None and t_periodno > f_periodno:
-    from_date = date_from_periodno(f_periodno)
-    to_date = date_from_periodno(t_periodno)
+# pages already downloaded waiting to be loaded
+depth = config.read_value('settings','ingest_queue_depth')
+if depth == None: depth = 4
+else: depth = int(depth)
 
-    # Query the data from Octopus 
-    usagedata = my_account.get_usage(from_date, to_date)
-    # Load it into the database
-    load_usage_data(my_database, usagedata)
+if missing:
+    # each page is loaded as soon as it arrives while the next downloads
+    for usagedata in stream_pages(missing_usage_pages(my_account, missing), depth):
+        load_usage_data(my_database, usagedata)
+    log.debug(f"getUsage: api stats {my_account.get_stats()}")
 else:
     log.info("No outstanding usage data to upload")
 
@@ -0,0 +1,387 @@
+########################################################################
+# octopusStub.py - a local stand in for the Octopus energy API so that
+# getrates.py, getusage.py and OctopusAgileAPI can be run (and load or
+# resilience tested) with no API key or network. It serves the
+# electricity-meter-points, consumption and standard-unit-rates endpoints
+# with the same paging as the real API over synthetic agile prices and
+# half hourly usage that are the same on every run. Responses can be
+# slowed down and a share of them failed (500) or throttled (429).
+#
+# Run it with:  python octopusStub.py   (settings from [octopus_stub]
+# in ~/.agileTriggers.ini, overridden by the command line) and set
+# enabled = True in [octopus_stub] to point the other tools at it.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from agileTools import gen_periodno_date, date_from_periodno, periodnos_from_timestrings, buildFilePath
+from agileTools import stub_url, default_stub_host, default_stub_port
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, urlencode
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import threading
+import hashlib
+import base64
+import random
+import math
+import json
+import time
+import sys
+import argparse
+
+# default region for the [octopus_stub] settings
+default_stub_region = "_H"
+
+# largest and default page sizes of the real API
+max_page_size = { "rates" : 1500, "consumption" : 25000 }
+default_page_size = 100
+
+# consumption times are reported in UK local time
+uk_zone = ZoneInfo("Europe/London")
+
+
+class OctopusStub:
+# where we listen
+    host        = default_stub_host
+    port        = default_stub_port
+# gsp returned for every meter
+    region      = default_stub_region
+# first half hour of data - the start of yroffset unless data_start is set
+    first_periodno = 0
+# milliseconds added to every response and random extra up to jitter_ms
+    latency_ms  = 0
+    jitter_ms   = 0
+# share of requests (0..1) failed with a 500 or throttled with a 429
+    error_rate    = 0.0
+    throttle_rate = 0.0
+# seconds in the Retry-After of a 429
+    retry_after = 1
+# the API key every request must use (None accepts any)
+    api_key     = None
+# request counts by response status
+    stats       = None
+    lock        = None
+    random      = None
+    server      = None
+
+##############################################################################
+#  __init__ - settings from the [octopus_stub] section of theConfig
+##############################################################################
+    def __init__(self, theConfig=None):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(0)
+
+        values = {}
+        if theConfig != None:
+            for field in ("host", "port", "region", "data_start", "latency_ms", "jitter_ms",
+                          "error_rate", "throttle_rate", "retry_after", "seed", "api_key"):
+                values[field] = theConfig.read_value('octopus_stub', field)
+        self.configure(**values)
+
+##############################################################################
+#  configure - change settings, values of None are left as they are
+##############################################################################
+    def configure(self, host=None, port=None, region=None, data_start=None, latency_ms=None,
+                  jitter_ms=None, error_rate=None, throttle_rate=None, retry_after=None,
+                  seed=None, api_key=None):
+        if host != None: self.host = host
+        if port != None: self.port = int(port)
+        if region != None: self.region = region
+        if latency_ms != None: self.latency_ms = float(latency_ms)
+        if jitter_ms != None: self.jitter_ms = float(jitter_ms)
+        if error_rate != None: self.error_rate = float(error_rate)
+        if throttle_rate != None: self.throttle_rate = float(throttle_rate)
+        if retry_after != None: self.retry_after = int(retry_after)
+        if api_key != None: self.api_key = api_key
+        if data_start != None:
+            self.first_periodno = gen_periodno_date(datetime.strptime(data_start, "%Y-%m-%d"))
+        if seed != None:
+            self.random = random.Random(int(seed))
+
+##############################################################################
+#  rate - the synthetic price (inc vat) of a half hour. A daily shape -
+#  cheap overnight, a 16:00-19:00 peak - a slow seasonal swing and noise
+#  that are the same every time for the same periodno
+##############################################################################
+    def rate(self, periodno):
+        halfhour = periodno % 48
+        day = periodno // 48
+        noise = ((periodno * 2654435761) % 10007) / 10007.0
+        result = 14.0 + 4.0 * math.cos(2 * math.pi * day / 365.25) - 5.0 * math.cos(2 * math.pi * halfhour / 48)
+        if 32 <= halfhour < 38:
+            result += 12.0
+        result += 6.0 * noise - 3.0
+        return round(result, 4)
+
+##############################################################################
+#  usage - the synthetic consumption (Kw/h) of a half hour
+##############################################################################
+    def usage(self, periodno):
+        halfhour = periodno % 48
+        noise = ((periodno * 40503) % 9973) / 9973.0
+        result = 0.08 + 0.25 * noise
+        if 34 <= halfhour < 44:
+            result += 0.4
+        return round(result, 3)
+
+##############################################################################
+#  rates_end - the periodno after the last published price. Prices for
+#  the next day appear at 16:00 and run to 23:00 UTC
+##############################################################################
+    def rates_end(self):
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        day = now.replace(hour=23, minute=0, second=0, microsecond=0)
+        if now.hour >= 16:
+            day += timedelta(days=1)
+        result = gen_periodno_date(day)
+        return result
+
+##############################################################################
+#  usage_end - the periodno after the last reading - readings arrive the
+#  day after they are taken
+##############################################################################
+    def usage_end(self):
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        result = gen_periodno_date(now.replace(hour=0, minute=0, second=0, microsecond=0))
+        return result
+
+##############################################################################
+#  count - add one to the count for a response status
+##############################################################################
+    def count(self, status):
+        with self.lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+##############################################################################
+#  inject - the error status to return for the next request or None. The
+#  latency is applied here too
+##############################################################################
+    def inject(self):
+        result = None
+        with self.lock:
+            delay = self.latency_ms + self.random.uniform(0, self.jitter_ms)
+            chance = self.random.random()
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if chance < self.error_rate:
+            result = 500
+        elif chance < self.error_rate + self.throttle_rate:
+            result = 429
+        return result
+
+##############################################################################
+#  start - serve in a background thread, returns the OctopusUrl to use
+##############################################################################
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), OctopusStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        # port 0 picks a free port
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever, name="octopusStub", daemon=True)
+        thread.start()
+        result = stub_url(self.host, self.port)
+        return result
+
+##############################################################################
+#  stop - stop a stub started with start
+##############################################################################
+    def stop(self):
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class OctopusStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+##############################################################################
+#  log_message - keep quiet, the stub counts requests instead
+##############################################################################
+    def log_message(self, format, *args):
+        pass
+
+##############################################################################
+#  __send - send a json body (with an ETag) or a bare status
+##############################################################################
+    def __send(self, status, body=None, headers=None):
+        stub = self.server.stub
+        data = b""
+        if body != None:
+            data = json.dumps(body).encode()
+            etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                status = 304
+                data = b""
+            headers = dict(headers or {})
+            headers["ETag"] = etag
+        stub.count(status)
+
+        self.send_response(status)
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+##############################################################################
+#  do_GET - route a request to one of the endpoints
+##############################################################################
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        query = { name : values[-1] for (name, values) in parse_qs(url.query).items() }
+        parts = [ part for part in url.path.split("/") if part != "" ]
+
+        error = stub.inject()
+        if error == 429:
+            self.__send(429, {"detail" : "Request was throttled."}, {"Retry-After" : str(stub.retry_after)})
+        elif error != None:
+            self.__send(error, {"detail" : "Injected server error."})
+        elif stub.api_key != None and self.__api_key() != stub.api_key:
+            self.__send(401, {"detail" : "Authentication credentials were not provided."})
+        elif len(parts) == 3 and parts[:2] == ["v1", "electricity-meter-points"]:
+            self.__send(200, { "gsp" : stub.region, "mpan" : parts[2], "profile_class" : 1,
+                               "consumption_standard" : 2900 })
+        elif len(parts) == 6 and parts[1] == "electricity-meter-points" and parts[5] == "consumption":
+            self.__send(200, self.__page(url.path, query, "consumption", stub.usage_end()))
+        elif len(parts) == 6 and parts[1] == "products" and parts[5] == "standard-unit-rates":
+            self.__send(200, self.__page(url.path, query, "rates", stub.rates_end()))
+        else:
+            self.__send(404, {"detail" : "Not found."})
+
+##############################################################################
+#  __api_key - the API key (basic auth user) of the request
+##############################################################################
+    def __api_key(self):
+        result = None
+        auth = self.headers.get("Authorization")
+        if auth != None and auth.startswith("Basic "):
+            try:
+                result = base64.b64decode(auth[6:]).decode().split(":")[0]
+            except ValueError:
+                result = None
+        return result
+
+##############################################################################
+#  __page - one page of the rates or consumption between period_from and
+#  period_to (newest first unless order_by=period) in the API's layout
+##############################################################################
+    def __page(self, path, query, kind, end):
+        stub = self.server.stub
+        first = stub.first_periodno
+        last = end
+        if query.get("period_from") != None:
+            first = max(first, periodnos_from_timestrings([query["period_from"]])[0])
+        if query.get("period_to") != None:
+            last = min(last, periodnos_from_timestrings([query["period_to"]])[0])
+        total = max(last - first, 0)
+
+        page_size = min(int(query.get("page_size", default_page_size)), max_page_size[kind])
+        page = max(int(query.get("page", 1)), 1)
+        start = (page - 1) * page_size
+        stop = min(start + page_size, total)
+
+        if query.get("order_by") == "period":
+            periodnos = range(first + start, first + stop)
+        else:
+            periodnos = range(last - 1 - start, last - 1 - stop, -1)
+
+        if kind == "rates":
+            results = [ self.__rate_record(periodno) for periodno in periodnos ]
+        else:
+            results = [ self.__usage_record(periodno) for periodno in periodnos ]
+
+        result = { "count" : total, "next" : None, "previous" : None, "results" : results }
+        base = f"http://{self.headers.get('Host')}{path}?"
+        if stop < total:
+            result["next"] = base + urlencode(dict(query, page=page + 1))
+        if page > 1:
+            result["previous"] = base + urlencode(dict(query, page=page - 1))
+        return result
+
+##############################################################################
+#  __rate_record - a standard-unit-rates result (UTC times)
+##############################################################################
+    def __rate_record(self, periodno):
+        stub = self.server.stub
+        value = stub.rate(periodno)
+        result = { "value_exc_vat" : round(value / 1.05, 4), "value_inc_vat" : value,
+                   "valid_from" : date_from_periodno(periodno).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                   "valid_to" : date_from_periodno(periodno + 1).strftime("%Y-%m-%dT%H:%M:%SZ") }
+        return result
+
+##############################################################################
+#  __usage_record - a consumption result (UK local times - Z in the winter
+#  and +01:00 in the summer)
+##############################################################################
+    def __usage_record(self, periodno):
+        stub = self.server.stub
+        result = { "consumption" : stub.usage(periodno),
+                   "interval_start" : local_timestring(date_from_periodno(periodno)),
+                   "interval_end" : local_timestring(date_from_periodno(periodno + 1)) }
+        return result
+
+
+##############################################################################
+#  local_timestring - a UTC dateobj as a UK local time string
+##############################################################################
+def local_timestring(dateobj):
+    local = dateobj.replace(tzinfo=timezone.utc).astimezone(uk_zone)
+    offset = local.utcoffset()
+    if offset == timedelta(0):
+        result = local.strftime("%Y-%m-%dT%H:%M:%SZ")
+    else:
+        result = local.strftime("%Y-%m-%dT%H:%M:%S%z")
+        result = result[:-2] + ":" + result[-2:]
+    return result
+
+
+if __name__ == "__main__":
+    from config import configFile
+
+    parser = argparse.ArgumentParser(description="Serve a local stand in for the Octopus energy API")
+    parser.add_argument("--host", type=str, help="address to listen on")
+    parser.add_argument("--port", type=int, help="port to listen on")
+    parser.add_argument("--latency-ms", type=float, help="milliseconds added to every response")
+    parser.add_argument("--jitter-ms", type=float, help="random extra milliseconds up to this")
+    parser.add_argument("--error-rate", type=float, help="share of requests failed with a 500")
+    parser.add_argument("--throttle-rate", type=float, help="share of requests throttled with a 429")
+    parser.add_argument("--data-start", type=str, help="first day of data yyyy-mm-dd")
+    parser.add_argument("--seed", type=int, help="seed for the latency and error injection")
+    args = parser.parse_args()
+
+    config = None
+    configPath = buildFilePath('~', ".agileTriggers.ini")
+    if configPath != False:
+        config = configFile(configPath)
+
+    stub = OctopusStub(config)
+    stub.configure(host=args.host, port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                   error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                   data_start=args.data_start, seed=args.seed)
+    url = stub.start()
+    print(f"Octopus stub serving {url} - ctrl-c to stop")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"responses {stub.stats}")
+    except KeyboardInterrupt:
+        stub.stop()
+        sys.exit(0)
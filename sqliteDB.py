@@ -18,18 +18,69 @@
 
 
 from mylogger import mylogger,nulLogger
+from contextlib import contextmanager
 import agileTools
+import threading
 import sqlite3
 import sys
 import os
 
+# connection tuning - overridden by the [database] section of the config file
+db_defaults = {
+    "journal_mode" : "WAL",
+    "busy_timeout" : 5000,
+    "synchronous"  : "NORMAL",
+    # negative cache_size is in KiB rather than pages
+    "cache_size"   : -8192,
+    "mmap_size"    : 67108864
+}
+
+journal_modes = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+synchronous_modes = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# the long lived connections - one per database file for each thread
+db_connections = threading.local()
+
+# rows fetched per round trip when streaming query results
+db_arraysize = 256
+
+##############################################################################
+#   read_db_settings - build the connection settings from the [database]
+#   section of the config file, anything missing or invalid uses db_defaults
+##############################################################################
+def read_db_settings(theConfig, theLogger=None):
+    if theLogger == None:
+        theLogger = nulLogger()
+    settings = dict(db_defaults)
+
+    for field in db_defaults:
+        value = theConfig.read_value('database', field)
+        if value == None:
+            continue
+        if field == "journal_mode" or field == "synchronous":
+            value = value.upper()
+            modes = journal_modes if field == "journal_mode" else synchronous_modes
+            if value not in modes:
+                theLogger.error(f"database setting {field} [{value}] invalid - using {settings[field]}")
+                continue
+        else:
+            try:
+                value = int(value)
+            except ValueError:
+                theLogger.error(f"database setting {field} [{value}] invalid - using {settings[field]}")
+                continue
+        settings[field] = value
+
+    return settings
+
 
 class sqliteDB:
 #filepaths
     database      = None
-# sql connection
-    sqlconnection = None
-    sqlcursor     = None
+# connection tuning
+    settings      = None
+# per thread cursor for this object
+    local         = None
 # logging
     log           = None
 
@@ -37,7 +88,7 @@ class sqliteDB:
 ##############################################################################
 #   __init__ initialise class 
 ##############################################################################
-    def __init__ (self, database, theLogger=None):
+    def __init__ (self, database, theLogger=None, settings=None):
         # initialise the logfile
         
         if theLogger == None:
@@ -52,10 +103,46 @@ class sqliteDB:
         # Get the database we are using from the configuration file
         self.database   = database
 
+        if settings == None:
+            settings = db_defaults
+        self.settings = dict(settings)
+
+        self.local = threading.local()
+
         self.log.debug("FINISHED sqlliteDB __init__ ")
 
         return
 
+##############################################################################
+#   __db_entry - the pool entry of this thread's connection (or None)
+##############################################################################
+    def __db_entry(self):
+        result = None
+        pool = getattr(db_connections, "pool", None)
+        if pool != None:
+            entry = pool.get(self.database)
+            # a connection inherited across fork() belongs to the parent
+            if entry != None and entry["pid"] == os.getpid():
+                result = entry
+        return result
+
+##############################################################################
+#   sqlconnection - the long lived connection for this thread (or None)
+##############################################################################
+    @property
+    def sqlconnection(self):
+        result = None
+        entry = self.__db_entry()
+        if entry != None:
+            result = entry["connection"]
+        return result
+
+##############################################################################
+#   sqlcursor - this object's cursor on this thread's connection
+##############################################################################
+    @property
+    def sqlcursor(self):
+        return getattr(self.local, "cursor", None)
 
 ##############################################################################
 #   db_ready - do we have the database config set up
@@ -65,30 +152,54 @@ class sqliteDB:
         self.log.debug("db_ready: database [{self.database}] result =["+str(result)+"].")
         return result
 
+##############################################################################
+#   __db_open - open and tune a new connection for this thread 
+##############################################################################
+    def __db_open(self):
+        settings = self.settings
+        connection = sqlite3.connect(self.database,
+                                     timeout=settings["busy_timeout"]/1000,
+                                     isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute(f"PRAGMA journal_mode={settings['journal_mode']}")
+        connection.execute(f"PRAGMA busy_timeout={int(settings['busy_timeout'])}")
+        connection.execute(f"PRAGMA synchronous={settings['synchronous']}")
+        connection.execute(f"PRAGMA cache_size={int(settings['cache_size'])}")
+        connection.execute(f"PRAGMA mmap_size={int(settings['mmap_size'])}")
+
+        if getattr(db_connections, "pool", None) == None:
+            db_connections.pool = {}
+        db_connections.pool[self.database] = { "connection" : connection, "pid" : os.getpid(), "depth" : 0 }
+        self.log.debug(f" Opened sql connection {settings}")
+        return connection
+
 ##############################################################################
 #  db_connect - connect to SQLite database stored in self.database
+#  the connection is opened once per thread and then kept, later calls 
+#  just pick it up again.
 #  return True if successful
 #  return False if not
 ##############################################################################
     def db_connect(self):
         result = True
         if self.db_ready() == True:
-            if self.sqlconnection:
-                self.log.debug(f" Reopened sql connection ")   
-                result = True
-            else:
-                try:
-                    self.sqlconnection = sqlite3.connect(self.database)
-                    self.sqlconnection.row_factory = sqlite3.Row
-                    self.sqlcursor = self.sqlconnection.cursor()                
-                    self.log.debug(f" Opened sql connection ")   
-                except sqlite3.Error as error:
-                    self.log.error(f"Failed to connect to Agile Database: {self.database}")
-                    result = False
+            try:
+                connection = self.sqlconnection
+                if connection == None:
+                    connection = self.__db_open()
+                    self.local.cursor = None
+                else:
+                    self.log.debug(f" Reopened sql connection ")   
+                if self.sqlcursor == None or self.sqlcursor.connection is not connection:
+                    self.local.cursor = connection.cursor()
+            except sqlite3.Error as error:
+                self.log.error(f"Failed to connect to Agile Database: {self.database} [{error}]")
+                result = False
         return result
 
 #############################################################################
-#   db_disconnect - disconnect from to SQLite
+#   db_disconnect - release the connection, it is kept open for reuse
+#   use db_close to really close it
 ##############################################################################
     def db_disconnect(self):
 
@@ -96,22 +207,76 @@ class sqliteDB:
         
         if self.db_ready() == True:
             if self.sqlconnection:
+                self.log.debug(f" Released sql connection ")          
+        return result
+
+#############################################################################
+#   db_close - close this thread's connection to the database
+##############################################################################
+    def db_close(self):
+
+        result = True
+        
+        if self.db_ready() == True:
+            connection = self.sqlconnection
+            if connection:
                 try:
-                    # Close the curor and then the database
-                    self.sqlcursor.close()
-                    self.sqlconnection.close() 
-                    self.sqlcursor = None 
-                    self.sqlconnection = None
+                    connection.close() 
+                    del db_connections.pool[self.database]
+                    self.local.cursor = None
                     self.log.debug(f" Closed sql connection ")          
                 except sqlite3.Error as error:
                     self.log.error(f"Failed to close sql connection [{error}]")
                     result = False
         return result
 
+#############################################################################
+#   db_transaction - context manager wrapping a block in one transaction
+#   the block commits when it completes and rolls back if it raises. 
+#   nested blocks join the outermost transaction. inside a transaction a 
+#   failed query raises so the whole block is abandoned. db_connect must
+#   have been called on this thread (in this process) first - if not an
+#   sqlite3.OperationalError is raised
+#
+#       with self.dbobject.db_transaction():
+#           self.dbobject.db_querymany(...)
+##############################################################################
+    @contextmanager
+    def db_transaction(self, immediate=False):
+        entry = self.__db_entry()
+        if entry == None:
+            self.log.error(f"db_transaction with no connection to {self.database} - call db_connect first")
+            raise sqlite3.OperationalError(f"no connection to {self.database} on this thread")
+        connection = entry["connection"]
+        if entry["depth"] == 0:
+            # IMMEDIATE takes the write lock up front rather than on first write
+            connection.execute("BEGIN IMMEDIATE" if immediate == True else "BEGIN")
+        entry["depth"] += 1
+        try:
+            yield self
+        except BaseException:
+            entry["depth"] -= 1
+            if entry["depth"] == 0 and connection.in_transaction:
+                connection.rollback()
+                self.log.debug("transaction rolled back")
+            raise
+        else:
+            entry["depth"] -= 1
+            if entry["depth"] == 0:
+                connection.commit()
+
+#############################################################################
+#   db_in_transaction - is a db_transaction open on this thread
+##############################################################################
+    def db_in_transaction(self):
+        connection = self.sqlconnection
+        result = connection != None and connection.in_transaction
+        return result
+
 #############################################################################
 #   query_db - query to SQLite database
 #   returns True if Query worked
-#   returns False if query didnt  *** TBD handle internal SQL errors ***
+#   returns False if query didnt  (raises inside a db_transaction)
 ##############################################################################
     def db_query(self, query, data_tuple=None):
         result = True
@@ -120,10 +285,27 @@ class sqliteDB:
                 self.sqlcursor.execute(query)
             else:
                 self.sqlcursor.execute(query, data_tuple)
-            self.sqlconnection.commit()        
         except sqlite3.Error as error:
             self.log.error(f"Failed to execute query {error}")
             result = False
+            if self.db_in_transaction() == True:
+                raise
+        return result
+
+#############################################################################
+#   db_querymany - run one query over a list of data tuples (executemany)
+#   returns True if Query worked
+#   returns False if query didnt  (raises inside a db_transaction)
+##############################################################################
+    def db_querymany(self, query, data_list):
+        result = True
+        try:
+            self.sqlcursor.executemany(query, data_list)
+        except sqlite3.Error as error:
+            self.log.error(f"Failed to execute query {error}")
+            result = False
+            if self.db_in_transaction() == True:
+                raise
         return result
 
 #############################################################################
@@ -133,3 +315,36 @@ class sqliteDB:
         result = self.sqlcursor.fetchall()
         return result
 
+#############################################################################
+#   iter_query - run a query and yield its rows as they are fetched 
+#   rows are pulled arraysize at a time on a cursor of their own, so memory
+#   stays flat however many rows match and other queries can run between 
+#   rows. a failed query is logged and the sqlite3.Error raised to the caller
+##############################################################################
+    def iter_query(self, query, data_tuple=None, arraysize=None):
+        if arraysize == None:
+            arraysize = db_arraysize
+        cursor = self.sqlconnection.cursor()
+        cursor.arraysize = arraysize
+        try:
+            if data_tuple == None:
+                cursor.execute(query)
+            else:
+                cursor.execute(query, data_tuple)
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                yield from rows
+        except sqlite3.Error as error:
+            self.log.error(f"Failed to execute query {error}")
+            raise
+        finally:
+            cursor.close()
+
+#############################################################################
+#   db_rowcount - number of rows changed by the last query
+##############################################################################
+    def db_rowcount(self):
+        result = self.sqlcursor.rowcount
+        return result
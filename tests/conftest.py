@@ -0,0 +1,91 @@
+########################################################################
+# conftest.py - shared pytest fixtures. Each test gets its own database,
+# trigger folder and .agileTriggers.ini under a temporary directory.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import sys
+import pytest
+
+# the modules live in the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import configFile
+
+
+##############################################################################
+#  make_config - a factory for configFiles each with their own database and
+#  trigger folder in a folder under tmp_path. sections adds further
+#  settings as { section : { field : value } }
+##############################################################################
+@pytest.fixture
+def make_config(tmp_path):
+    def make(folder, sections=None):
+        folder = tmp_path / folder
+        folder.mkdir(exist_ok=True)
+        path = folder / ".agileTriggers.ini"
+        settings = { "filepaths" : { "database_file" : folder / "agile.db",
+                                     "trigger_folder" : folder / "triggers",
+                                     "trigger_permissions" : 755,
+                                     "log_folder" : folder } }
+        for (section, fields) in (sections or {}).items():
+            settings.setdefault(section, {}).update(fields)
+        text = ""
+        for (section, fields) in settings.items():
+            text += f"[{section}]\n"
+            text += "".join(f"{field} = {value}\n" for (field, value) in fields.items())
+        path.write_text(text)
+        return configFile(str(path))
+    return make
+
+
+##############################################################################
+#  config - the config most tests need
+##############################################################################
+@pytest.fixture
+def config(make_config):
+    return make_config("agile")
+
+
+##############################################################################
+#  stub - an octopusStub serving on a free port for the length of a test
+##############################################################################
+@pytest.fixture
+def stub():
+    from octopusStub import OctopusStub
+    result = OctopusStub()
+    result.configure(port=0)
+    result.start()
+    yield result
+    result.stop()
+
+
+##############################################################################
+#  make_api - a factory for OctopusAgileAPIs calling the stub with a
+#  response cache of their own. settings adds [settings] values
+##############################################################################
+@pytest.fixture
+def make_api(make_config, stub, tmp_path):
+    from agileAPI import OctopusAgileAPI
+    def make(folder="api", settings=None):
+        sections = { "octopus_account" : { "meterMPAN" : "1200000000001", "meterSERIAL" : "21L0000001",
+                                           "OctopusAPIKey" : "sk_test", "OctopusUrl" : "https://api.octopus.energy/v1/" },
+                     "octopus_stub" : { "enabled" : "True", "host" : stub.host, "port" : stub.port },
+                     "filepaths" : { "cache_folder" : tmp_path / folder / "cache" },
+                     "settings" : dict(settings or {}) }
+        return OctopusAgileAPI(make_config(folder, sections))
+    return make
@@ -0,0 +1,135 @@
+########################################################################
+# test_cache.py - the response cache of OctopusAgileAPI against the
+# octopusStub: settled windows served with no call, conditional 304s for
+# the rest, short windows never kept as settled and the trim to size.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from datetime import timedelta
+import os
+import pytest
+
+from agileCache import OctopusAgileCache, CachedResponse, evict_low_water
+from agileTools import time_now
+
+# the stub has readings up to the start of today
+today = time_now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+@pytest.fixture
+def api(make_api):
+    return make_api(settings={ "api_window_days" : 1 })
+
+
+##############################################################################
+#  fetch - the results of every window of usage from dateobj_from up to
+#  dateobj_to
+##############################################################################
+def fetch(api, dateobj_from, dateobj_to):
+    return [ results for (first, last, results) in api.iter_usage(dateobj_from, dateobj_to) ]
+
+
+def test_settled_windows_need_no_call(api, stub):
+    first = fetch(api, today - timedelta(days=10), today - timedelta(days=5))
+    assert [ len(results) for results in first ] == [48] * 5
+    assert stub.stats == { 200 : 5 }
+
+    assert fetch(api, today - timedelta(days=10), today - timedelta(days=5)) == first
+    assert stub.stats == { 200 : 5 }
+    stats = api.get_cache_stats()
+    assert (stats["misses"], stats["hits"]) == (5, 5)
+
+
+def test_recent_windows_are_revalidated(api, stub):
+    # yesterday has not settled - ask again and get a 304
+    first = fetch(api, today - timedelta(days=1), today)
+    assert fetch(api, today - timedelta(days=1), today) == first
+    assert stub.stats == { 200 : 1, 304 : 1 }
+    assert api.get_cache_stats()["revalidated"] == 1
+
+
+def test_short_windows_are_not_settled(api, stub):
+    # the readings start part way through a settled range
+    stub.configure(data_start=(today - timedelta(days=7)).strftime("%Y-%m-%d"))
+    first = fetch(api, today - timedelta(days=9), today - timedelta(days=6))
+    assert [ len(results) for results in first ] == [0, 0, 48]
+
+    assert fetch(api, today - timedelta(days=9), today - timedelta(days=6)) == first
+    # the full window is served from the cache, the short ones are asked for again
+    assert stub.stats == { 200 : 3, 304 : 2 }
+
+
+def test_late_readings_are_picked_up(api, stub):
+    stub.configure(data_start=(today - timedelta(days=7)).strftime("%Y-%m-%d"))
+    fetch(api, today - timedelta(days=8), today - timedelta(days=7))
+    # the missing day arrives
+    stub.first_periodno = 0
+    assert [ len(results) for results in fetch(api, today - timedelta(days=8), today - timedelta(days=7)) ] == [48]
+
+
+##############################################################################
+#  response - a response of size bytes or so to cache
+##############################################################################
+def response(name, size=1000):
+    return CachedResponse(f"http://stub/{name}", "x" * size, { "ETag" : f'"{name}"' }, False)
+
+
+def test_etag_is_sent_back(tmp_path):
+    cache = OctopusAgileCache(str(tmp_path))
+    assert cache.conditional_headers(None) == {}
+    cache.store("http://stub/a", { "page" : 1 }, response("a"))
+    cached = cache.lookup("http://stub/a", { "page" : 1 })
+    assert cached.text == response("a").text
+    assert cache.conditional_headers(cached) == { "If-None-Match" : '"a"' }
+    # the params are part of the key
+    assert cache.lookup("http://stub/a", { "page" : 2 }) == None
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = OctopusAgileCache(str(tmp_path), max_bytes=10000)
+    for index in range(8):
+        cache.store(f"http://stub/{index}", None, response(index))
+    # oldest first - but looking one up makes it recent
+    folder = os.path.join(str(tmp_path), "responses")
+    for index in range(8):
+        path = cache._OctopusAgileCache__path(f"http://stub/{index}", None)
+        os.utime(path, (1000 + index, 1000 + index))
+    cache.lookup("http://stub/0")
+
+    for index in range(8, 12):
+        cache.store(f"http://stub/{index}", None, response(index))
+
+    stats = cache.get_stats()
+    assert stats["evicted"] > 0
+    assert stats["bytes"] <= 10000
+    assert stats["bytes"] == sum(entry.stat().st_size for entry in os.scandir(folder))
+    assert cache.lookup("http://stub/0") != None
+    assert cache.lookup("http://stub/1") == None
+    assert cache.lookup("http://stub/11") != None
+
+
+def test_eviction_trims_below_the_limit(tmp_path):
+    cache = OctopusAgileCache(str(tmp_path), max_bytes=10000)
+    index = 0
+    while cache.get_stats()["evicted"] == 0:
+        cache.store(f"http://stub/{index}", None, response(index, 100))
+        index += 1
+    # trimmed to the low water mark so the next store does not evict again
+    stats = cache.get_stats()
+    assert stats["bytes"] <= 10000 * evict_low_water
+    cache.store(f"http://stub/{index}", None, response(index, 100))
+    assert cache.get_stats()["evicted"] == stats["evicted"]
+    assert cache.get_stats()["entries"] == stats["entries"] + 1
@@ -0,0 +1,160 @@
+########################################################################
+# test_frame.py - PeriodFrame banding, groupby reductions and heatmap
+# against plain python over the same periods.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from datetime import datetime, timedelta
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from agileFrame import PeriodFrame, band_order
+from agileDB import OctopusAgileDB, ChargeBandClassifier, empty_rate
+from agileTools import gen_periodno_date, date_from_periodno
+
+# from the middle of a Sunday over a month end - a part day at each end
+first_date = datetime(2021, 1, 31, 11, 0)
+p0 = gen_periodno_date(first_date)
+period_count = 48 * 3 + 10
+
+classifier = ChargeBandClassifier(OctopusAgileDB.chargebands)
+
+
+##############################################################################
+#  prices - cost and usage of every period - some of each missing
+##############################################################################
+def prices():
+    cost = [ (index * 7) % 31 - 3.0 for index in range(period_count) ]
+    usage = [ 0.1 + (index % 5) / 10 for index in range(period_count) ]
+    for index in range(0, period_count, 11):
+        cost[index] = numpy.nan
+    for index in range(3, period_count, 13):
+        usage[index] = numpy.nan
+    return (cost, usage)
+
+
+@pytest.fixture
+def frame():
+    (cost, usage) = prices()
+    return PeriodFrame(p0, cost, usage, classifier)
+
+
+##############################################################################
+#  grouped - the known values of a column by key(periodno) in key order
+##############################################################################
+def grouped(values, key):
+    result = {}
+    for (index, value) in enumerate(values):
+        group = result.setdefault(key(p0 + index), [])
+        if numpy.isnan(value) == False:
+            group.append(value)
+    return [ result[name] for name in sorted(result) ]
+
+
+def test_bands_match_classify(frame):
+    (cost, usage) = prices()
+    expected = [ band_order.index(classifier.classify(empty_rate if numpy.isnan(value) else value)) for value in cost ]
+    assert frame.band.tolist() == expected
+
+
+def test_day_groups(frame):
+    (cost, usage) = prices()
+    groups = frame.groupby("day")
+    days = grouped(cost, lambda periodno: periodno // 48)
+    assert groups.labels.tolist() == [ (first_date + timedelta(days=index)).date() for index in range(4) ]
+    assert groups.count().tolist() == [ len(day) for day in days ]
+    assert groups.sum().tolist() == pytest.approx([ sum(day) for day in days ])
+    assert groups.mean().tolist() == pytest.approx([ sum(day) / len(day) for day in days ])
+    assert groups.min().tolist() == [ min(day) for day in days ]
+    assert groups.max().tolist() == [ max(day) for day in days ]
+    assert groups.percentile(q=75).tolist() == pytest.approx([ numpy.percentile(day, 75) for day in days ])
+
+
+def test_week_and_month_labels(frame):
+    # Sunday the 31st is the end of one week and one month
+    weeks = frame.groupby("week")
+    assert weeks.labels.astype(object).tolist() == [ datetime(2021, 1, 25).date(), datetime(2021, 2, 1).date() ]
+    assert weeks.count("usage").sum() == numpy.count_nonzero(~numpy.isnan(frame.usage))
+
+    months = frame.groupby("month")
+    assert [ str(label) for label in months.labels ] == ["2021-01", "2021-02"]
+    assert months.count("period_cost").tolist() == [
+        numpy.count_nonzero(~numpy.isnan(frame.period_cost[:26])),
+        numpy.count_nonzero(~numpy.isnan(frame.period_cost[26:])) ]
+
+
+def test_hour_of_day(frame):
+    (cost, usage) = prices()
+    groups = frame.groupby("hour_of_day")
+    assert groups.labels.tolist() == list(range(24))
+    hours = grouped(usage, lambda periodno: date_from_periodno(periodno).hour)
+    assert groups.sum("usage").tolist() == pytest.approx([ sum(hour) for hour in hours ])
+
+
+def test_unit_price(frame):
+    (cost, usage) = prices()
+    spend = {}
+    used = {}
+    for index in range(period_count):
+        if numpy.isnan(cost[index]) == False and numpy.isnan(usage[index]) == False:
+            day = (p0 + index) // 48
+            spend[day] = spend.get(day, 0.0) + cost[index] * usage[index]
+            used[day] = used.get(day, 0.0) + usage[index]
+    assert frame.groupby("day").unit_price().tolist() == pytest.approx([ spend[day] / used[day] for day in sorted(spend) ])
+
+
+def test_empty_groups_are_nan():
+    frame = PeriodFrame(p0, [numpy.nan] * 48, [1.0] * 48, classifier)
+    groups = frame.groupby("hour_of_day")
+    assert groups.count().tolist() == [0] * 24
+    assert numpy.isnan(groups.mean()).all()
+    assert numpy.isnan(groups.min()).all() and numpy.isnan(groups.max()).all()
+    assert numpy.isnan(groups.percentile()).all()
+
+
+def test_unknown_group_and_column(frame):
+    with pytest.raises(KeyError):
+        frame.groupby("year")
+    with pytest.raises(KeyError):
+        frame.column("price")
+
+
+def test_heatmap_pads_to_whole_days(frame):
+    heatmap = frame.heatmap("cost")
+    assert heatmap.shape == (4, 48)
+    lead = p0 % 48
+    assert numpy.isnan(heatmap[0, :lead]).all()
+    assert numpy.array_equal(heatmap.reshape(-1)[lead:lead + period_count], frame.cost, equal_nan=True)
+    assert numpy.isnan(heatmap.reshape(-1)[lead + period_count:]).all()
+    assert frame.heatmap_days().astype(object).tolist() == [ (first_date + timedelta(days=index)).date() for index in range(4) ]
+
+
+@pytest.mark.parametrize("store", [False, True])
+def test_from_db(make_config, tmp_path, store):
+    sections = { "filepaths" : { "store_folder" : tmp_path / "store" } } if store == True else None
+    agile_db = OctopusAgileDB(make_config("frame", sections))
+    agile_db.initialise_agile_db()
+    (cost, usage) = prices()
+    agile_db.create_db_period_costs([ (p0 + index, value) for (index, value) in enumerate(cost) if numpy.isnan(value) == False ])
+    agile_db.update_db_period_usages([ (p0 + index, value) for (index, value) in enumerate(usage) if numpy.isnan(value) == False ])
+
+    frame = PeriodFrame.from_db(agile_db, first_date - timedelta(hours=1), first_date + timedelta(days=4))
+    assert frame.first_periodno == p0 - 2
+    # usage with no price is kept against an empty_rate placeholder
+    expected_cost = numpy.r_[[numpy.nan] * 2, cost, [numpy.nan] * (len(frame) - period_count - 2)]
+    assert numpy.array_equal(frame.cost, expected_cost, equal_nan=True)
+    assert numpy.nansum(frame.usage) == pytest.approx(numpy.nansum(usage))
@@ -0,0 +1,46 @@
+########################################################################
+# test_merge_ranges.py - merge_period_ranges joining the missing usage
+# ranges that getusage fetches.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import pytest
+
+from agileTools import merge_period_ranges
+
+
+@pytest.mark.parametrize("ranges, gap, merged", [
+    ([], 48, []),
+    ([ (10, 20) ], 48, [ (10, 20) ]),
+    # a gap shorter than a day is fetched with its neighbours
+    ([ (0, 5), (30, 31), (70, 80) ], 48, [ (0, 80) ]),
+    # a gap of a day or more is not
+    ([ (0, 5), (54, 60) ], 48, [ (0, 5), (54, 60) ]),
+    ([ (0, 5), (53, 60) ], 48, [ (0, 60) ]),
+    # touching and nested ranges
+    ([ (0, 5), (6, 9) ], 1, [ (0, 9) ]),
+    ([ (0, 50), (10, 20) ], 1, [ (0, 50) ]),
+    # no gap merges nothing apart
+    ([ (0, 5), (7, 9) ], 1, [ (0, 5), (7, 9) ]),
+    ])
+def test_merge(ranges, gap, merged):
+    assert merge_period_ranges(ranges, gap) == merged
+
+
+def test_a_scatter_of_gaps_is_one_range():
+    # a missing reading every few hours over a month
+    ranges = [ (index, index) for index in range(0, 48 * 31, 7) ]
+    assert merge_period_ranges(ranges, 48 * 31) == [ (0, ranges[-1][1]) ]
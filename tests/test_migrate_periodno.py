@@ -0,0 +1,134 @@
+########################################################################
+# test_migrate_periodno.py - upgrade_agile_db renumbering a database in
+# the original sparse periodno format (31 day months) to the dense half
+# hour index, and doing nothing when run again.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from datetime import datetime, timedelta
+import sqlite3
+import pytest
+
+from agileDB import OctopusAgileDB, db_schema_version, empty_rate
+from agileTools import gen_periodno_date
+
+# the original tables - before db_schema_version
+baseline_tables = (
+    'CREATE TABLE agile_data (periodno INTEGER PRIMARY KEY, year INTEGER, month INTEGER, day INTEGER, hour INTEGER, minute INTEGER, cost REAL, usage REAL, CHECK (year >= 2020 AND month <= 12 AND day <= 31 AND hour < 24 AND minute < 60))',
+    'CREATE TABLE agile_rollup_day (dayno INTEGER PRIMARY KEY, year INTEGER, month INTEGER, day INTEGER, cost REAL, usage REAL, unit REAL, CHECK (year >= 2020 AND month <= 12 AND day <= 31))',
+    'CREATE TABLE agile_rollup_month (monthno INTEGER PRIMARY KEY, year INTEGER, month INTEGER,  cost REAL, usage REAL, unit REAL, CHECK (year >= 2020 AND month <= 12 ))' )
+
+# sixty days across a year end and a short month
+first_period = datetime(2020, 12, 25)
+period_count = 48 * 60
+
+
+##############################################################################
+#  sparse_periodno - the original period number - 31 days to every month
+##############################################################################
+def sparse_periodno(dateobj):
+    return (int(dateobj.minute >= 30) + dateobj.hour * 2 + dateobj.day * 48
+            + dateobj.month * 1488 + (dateobj.year - 2020) * 17856)
+
+
+##############################################################################
+#  periods - (date, cost, usage) of every period - some usage is missing
+##############################################################################
+def periods():
+    for index in range(period_count):
+        dateobj = first_period + timedelta(minutes=30 * index)
+        usage = empty_rate if index % 100 == 0 else 0.25 + (index % 7) / 10
+        yield (dateobj, 10.0 + index % 13, usage)
+
+
+##############################################################################
+#  baseline_db - a database as the original code wrote it
+##############################################################################
+@pytest.fixture
+def baseline_db(config):
+    connection = sqlite3.connect(config.read_value('filepaths', 'database_file'))
+    for table in baseline_tables:
+        connection.execute(table)
+    connection.executemany("INSERT INTO agile_data VALUES (?,?,?,?,?,?,?,?)",
+        [ (sparse_periodno(d), d.year, d.month, d.day, d.hour, d.minute, cost, usage) for (d, cost, usage) in periods() ])
+    # rollups keyed the old way - they must be rebuilt
+    connection.execute("INSERT INTO agile_rollup_day VALUES (1, 2021, 1, 1, 1.0, 1.0, 1.0)")
+    connection.commit()
+    connection.close()
+    return OctopusAgileDB(config)
+
+
+##############################################################################
+#  table - every row of a table in key order
+##############################################################################
+def table(agile_db, name):
+    agile_db.dbobject.db_connect()
+    agile_db.dbobject.db_query(f"SELECT * FROM {name} ORDER BY 1")
+    return [ tuple(row) for row in agile_db.dbobject.db_queryresults() ]
+
+
+def test_rows_are_renumbered(baseline_db):
+    assert baseline_db.upgrade_agile_db() == True
+
+    rows = table(baseline_db, "agile_data")
+    assert len(rows) == period_count
+    expected = [ (gen_periodno_date(d), d.year, d.month, d.day, d.hour, d.minute, cost, usage)
+                 for (d, cost, usage) in periods() ]
+    assert rows == expected
+    # dense - no gaps at the ends of short months
+    assert rows[-1][0] - rows[0][0] == period_count - 1
+
+
+def test_schema_version_is_set(baseline_db):
+    baseline_db.upgrade_agile_db()
+    baseline_db.dbobject.db_connect()
+    baseline_db.dbobject.db_query("PRAGMA user_version")
+    assert baseline_db.dbobject.db_queryresults()[0][0] == db_schema_version
+
+
+def test_rollups_match_a_fresh_load(baseline_db, make_config):
+    baseline_db.upgrade_agile_db()
+
+    fresh = OctopusAgileDB(make_config("fresh"))
+    fresh.initialise_agile_db()
+    fresh.create_db_period_costs([ (gen_periodno_date(d), cost) for (d, cost, usage) in periods() ])
+    fresh.update_db_period_usages([ (gen_periodno_date(d), usage) for (d, cost, usage) in periods() if usage != empty_rate ])
+
+    days = table(baseline_db, "agile_rollup_day")
+    # one rollup per day and the one keyed the old way is gone
+    assert len(days) == 60
+    assert days == table(fresh, "agile_rollup_day")
+    assert table(baseline_db, "agile_rollup_month") == table(fresh, "agile_rollup_month")
+    assert baseline_db.get_db_rollup_months(2021) == fresh.get_db_rollup_months(2021)
+
+
+def test_upgrade_is_idempotent(baseline_db):
+    assert baseline_db.upgrade_agile_db() == True
+    data = table(baseline_db, "agile_data")
+    days = table(baseline_db, "agile_rollup_day")
+
+    assert baseline_db.upgrade_agile_db() == True
+    assert table(baseline_db, "agile_data") == data
+    assert table(baseline_db, "agile_rollup_day") == days
+
+
+def test_new_database_needs_no_upgrade(config):
+    agile_db = OctopusAgileDB(config)
+    agile_db.initialise_agile_db()
+    agile_db.create_db_period_costs([ (1000, 5.0) ])
+
+    assert agile_db.upgrade_agile_db() == True
+    assert table(agile_db, "agile_data")[0][0] == 1000
@@ -0,0 +1,176 @@
+########################################################################
+# test_notifier.py - the TriggerNotifier socket: the snapshot and change
+# events subscribers are sent, a slow subscriber being dropped and the
+# socket going away when the notifier stops.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import json
+import os
+import socket
+import time
+import pytest
+
+from triggerNotify import TriggerNotifier, watch_triggers
+from triggerPublisher import TriggerPublisher
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "triggers.sock")
+
+
+@pytest.fixture
+def notifier(path):
+    result = TriggerNotifier(path, queue_size=4)
+    assert result.start() == True
+    yield result
+    result.stop()
+
+
+##############################################################################
+#  wait_for - wait up to a few seconds for condition() to be true
+##############################################################################
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while condition() == False:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+##############################################################################
+#  subscriber - a connection to the notifier that reads one event at a time
+##############################################################################
+class subscriber:
+    def __init__(self, path, notifier):
+        count = notifier.get_stats()["connected"]
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.settimeout(5)
+        self.connection.connect(path)
+        self.lines = self.connection.makefile("r")
+        wait_for(lambda: notifier.get_stats()["connected"] > count)
+
+    def event(self):
+        line = self.lines.readline()
+        return json.loads(line) if line else None
+
+    def close(self):
+        self.lines.close()
+        self.connection.close()
+
+
+def test_snapshot_then_changes(notifier, path):
+    notifier.publish(1, { "cheap" : True, "dear" : False })
+    wait_for(lambda: notifier.version == 1)
+
+    listener = subscriber(path, notifier)
+    snapshot = listener.event()
+    assert (snapshot["event"], snapshot["version"], snapshot["triggers"]) == ("snapshot", 1, { "cheap" : True, "dear" : False })
+
+    notifier.publish(2, { "cheap" : False })
+    notifier.publish(3, { "dear" : None })
+    change = listener.event()
+    assert (change["event"], change["version"], change["triggers"]) == ("change", 2, { "cheap" : False })
+    assert listener.event()["triggers"] == { "dear" : None }
+    listener.close()
+
+
+def test_only_real_changes_are_sent(notifier, path):
+    notifier.publish(1, { "cheap" : True, "dear" : False })
+    listener = subscriber(path, notifier)
+    listener.event()
+    # a resync publishes every trigger again
+    notifier.publish(2, { "cheap" : True, "dear" : False })
+    notifier.publish(3, { "cheap" : True, "dear" : True })
+    change = listener.event()
+    assert (change["version"], change["triggers"]) == (3, { "dear" : True })
+    assert notifier.get_stats()["events"] == 2
+    listener.close()
+
+
+def test_publisher_batches_are_events(notifier, path, tmp_path):
+    folder = tmp_path / "triggers"
+    folder.mkdir()
+    publisher = TriggerPublisher(str(folder), 0o644)
+    publisher.set_state("cheap", True)
+    publisher.set_notifier(notifier)
+
+    listener = subscriber(path, notifier)
+    assert listener.event()["triggers"] == { "cheap" : True }
+    with publisher.batch():
+        publisher.set_state("cheap", False)
+        publisher.set_state("mid", True)
+    change = listener.event()
+    assert (change["version"], change["triggers"]) == (publisher.version, { "cheap" : False, "mid" : True })
+    listener.close()
+    publisher.close()
+
+
+def test_slow_subscriber_is_dropped(notifier, path):
+    slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+    slow.connect(path)
+    wait_for(lambda: notifier.get_stats()["subscribers"] == 1)
+
+    # large events fill the socket then the queue of one that never reads
+    names = [ f"trigger{index:04d}" + "x" * 200 for index in range(500) ]
+    for version in range(1, 50):
+        notifier.publish(version, { name : version % 2 == 0 for name in names })
+    wait_for(lambda: notifier.get_stats()["dropped"] == 1)
+    assert notifier.get_stats()["subscribers"] == 0
+
+    # the rest still subscribe
+    listener = subscriber(path, notifier)
+    assert listener.event()["version"] == 49
+    listener.close()
+    slow.close()
+
+
+def test_closed_subscriber_is_forgotten(notifier, path):
+    listener = subscriber(path, notifier)
+    listener.close()
+    wait_for(lambda: notifier.get_stats()["subscribers"] == 0)
+    assert notifier.get_stats()["dropped"] == 0
+
+
+def test_stop_ends_watchers_and_removes_the_socket(path):
+    notifier = TriggerNotifier(path)
+    assert notifier.start() == True
+    notifier.publish(1, { "cheap" : True })
+    wait_for(lambda: notifier.version == 1)
+
+    events = watch_triggers(path)
+    assert next(events)["triggers"] == { "cheap" : True }
+    notifier.stop()
+    assert list(events) == []
+    assert os.path.exists(path) == False
+
+
+def test_a_stale_socket_is_replaced(path):
+    # left by a daemon that died
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    notifier = TriggerNotifier(path)
+    assert notifier.start() == True
+    next(watch_triggers(path))
+    notifier.stop()
+
+
+def test_start_fails_without_the_folder(tmp_path):
+    notifier = TriggerNotifier(str(tmp_path / "missing" / "triggers.sock"))
+    assert notifier.start() == False
+    notifier.stop()
@@ -0,0 +1,107 @@
+########################################################################
+# test_period_costs.py - create_db_period_costs bulk loads and the
+# inserted / updated / unchanged counts of an upsert load.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import pytest
+
+from agileDB import OctopusAgileDB, empty_rate
+
+# a day and a half of prices
+p0 = 40000
+rates = [ (p0 + index, 10.0 + index % 5) for index in range(72) ]
+
+
+@pytest.fixture
+def agile_db(config):
+    result = OctopusAgileDB(config)
+    result.initialise_agile_db()
+    return result
+
+
+##############################################################################
+#  stored - periodno : (cost, usage) of every row of agile_data
+##############################################################################
+def stored(agile_db):
+    agile_db.dbobject.db_connect()
+    agile_db.dbobject.db_query("SELECT periodno, cost, usage FROM agile_data")
+    return { row[0] : (row[1], row[2]) for row in agile_db.dbobject.db_queryresults() }
+
+
+def test_insert_counts(agile_db):
+    counts = agile_db.create_db_period_costs(rates, batch_size=10)
+    assert counts == { "inserted" : 72, "updated" : 0, "unchanged" : 0 }
+    rows = stored(agile_db)
+    assert len(rows) == 72
+    assert rows[p0 + 3] == (13.0, empty_rate)
+
+
+def test_reload_is_unchanged(agile_db):
+    agile_db.create_db_period_costs(rates, upsert=True)
+    counts = agile_db.create_db_period_costs(rates, batch_size=10, upsert=True)
+    assert counts == { "inserted" : 0, "updated" : 0, "unchanged" : 72 }
+
+
+def test_mixed_upsert_counts(agile_db):
+    agile_db.create_db_period_costs(rates[:48], upsert=True)
+    # the second day overlaps the first by 12 periods, 2 of them repriced
+    reload = rates[36:]
+    reload[0] = (reload[0][0], 99.0)
+    reload[5] = (reload[5][0], 98.0)
+    counts = agile_db.create_db_period_costs(reload, batch_size=7, upsert=True)
+    assert counts == { "inserted" : 24, "updated" : 2, "unchanged" : 10 }
+
+    rows = stored(agile_db)
+    assert len(rows) == 72
+    assert rows[p0 + 36][0] == 99.0
+    assert rows[p0 + 41][0] == 98.0
+    assert rows[p0 + 37][0] == rates[37][1]
+
+
+def test_upsert_keeps_usage(agile_db):
+    agile_db.create_db_period_costs(rates, upsert=True)
+    agile_db.update_db_period_usages([ (p0, 0.5), (p0 + 1, 0.75) ])
+    counts = agile_db.create_db_period_costs([ (p0, 20.0), (p0 + 1, rates[1][1]) ], upsert=True)
+    assert counts == { "inserted" : 0, "updated" : 1, "unchanged" : 1 }
+
+    rows = stored(agile_db)
+    assert rows[p0] == (20.0, 0.5)
+    assert rows[p0 + 1] == (rates[1][1], 0.75)
+
+
+def test_duplicate_without_upsert_rolls_back(agile_db):
+    agile_db.create_db_period_costs(rates[:10])
+    # the new periods are not kept either - the whole load is one transaction
+    assert agile_db.create_db_period_costs(rates[5:20], batch_size=3) == None
+    assert len(stored(agile_db)) == 10
+
+
+def test_empty_load(agile_db):
+    assert agile_db.create_db_period_costs([], upsert=True) == { "inserted" : 0, "updated" : 0, "unchanged" : 0 }
+    assert stored(agile_db) == {}
+
+
+def test_single_period_writers_keep_rollups(agile_db):
+    # the one period writers go through the bulk loaders
+    assert agile_db.create_db_period_cost(2022, 3, 4, 10, 30, 12.0) == True
+    assert agile_db.update_db_period_usage(2022, 3, 4, 10, 30, 2.0) == True
+    assert agile_db.create_db_period_cost(2022, 3, 4, 10, 30, 12.0) == False
+
+    days = agile_db.get_db_rollup_days(2022, 3)
+    assert [ day[0] for day in days ] == [4]
+    assert days[0][1] == pytest.approx(24.0)
+    assert days[0][2] == pytest.approx(2.0)
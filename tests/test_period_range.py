@@ -0,0 +1,86 @@
+########################################################################
+# test_period_range.py - get_db_period_range and iter_db_period_range:
+# the rows of a date range and the charge band of each one.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from datetime import datetime, timedelta
+import pytest
+
+from agileDB import OctopusAgileDB, ChargeBand, empty_rate
+from agileTools import gen_periodno_date
+from sqliteDB import db_arraysize
+
+# ten days - more rows than one fetch so the banding spans batches
+first_day = datetime(2021, 3, 1)
+p0 = gen_periodno_date(first_day)
+period_count = 480
+
+
+##############################################################################
+#  price - a cost for every band and the band edges in turn
+##############################################################################
+def price(periodno):
+    return [ -2.0, 0.0, 0.5, 12.0, 12.01, 18.0, 24.9, 25.0, 30.0, empty_rate ][periodno % 10]
+
+
+@pytest.fixture
+def agile_db(config):
+    result = OctopusAgileDB(config)
+    result.initialise_agile_db()
+    result.create_db_period_costs([ (p0 + index, price(p0 + index)) for index in range(period_count) ])
+    return result
+
+
+def test_bands_match_classify(agile_db):
+    assert period_count > db_arraysize
+    records = agile_db.get_db_period_range(first_day, first_day + timedelta(days=10))
+    assert [ record.periodno for record in records ] == list(range(p0, p0 + period_count))
+    assert [ record.band for record in records ] == [ agile_db.classifier.classify(record.cost) for record in records ]
+
+
+def test_band_edges(agile_db):
+    records = agile_db.get_db_period_range(first_day, first_day + timedelta(hours=5))
+    assert { record.cost : record.band for record in records } == {
+        # a band starts above its rate
+        -2.0 : ChargeBand.default, 0.0 : ChargeBand.default, 0.5 : ChargeBand.good,
+        12.0 : ChargeBand.good, 12.01 : ChargeBand.average, 18.0 : ChargeBand.average,
+        24.9 : ChargeBand.high, 25.0 : ChargeBand.high, 30.0 : ChargeBand.extreme,
+        empty_rate : ChargeBand.default }
+
+
+def test_configured_bands(make_config):
+    agile_db = OctopusAgileDB(make_config("bands", { "chargebands" : { "extreme_rate" : 20.0 } }))
+    agile_db.initialise_agile_db()
+    agile_db.create_db_period_costs([ (p0, 19.0), (p0 + 1, 21.0) ])
+    records = agile_db.get_db_period_range(first_day, first_day + timedelta(hours=1))
+    assert [ record.band for record in records ] == [ ChargeBand.high, ChargeBand.extreme ]
+
+
+@pytest.mark.parametrize("days_from, days_to, first, last", [
+    # a bound of None leaves that end open
+    (None, 2, p0, p0 + 96),
+    (8, None, p0 + 384, p0 + period_count),
+    (None, None, p0, p0 + period_count),
+    # the end is not included
+    (1, 2, p0 + 48, p0 + 96),
+    (2, 2, p0 + 96, p0 + 96),
+    ])
+def test_open_bounds(agile_db, days_from, days_to, first, last):
+    dateobj_from = None if days_from == None else first_day + timedelta(days=days_from)
+    dateobj_to = None if days_to == None else first_day + timedelta(days=days_to)
+    periodnos = [ record.periodno for record in agile_db.iter_db_period_range(dateobj_from, dateobj_to) ]
+    assert periodnos == list(range(first, last))
@@ -0,0 +1,189 @@
+########################################################################
+# test_publisher.py - TriggerPublisher trigger files and the versioned
+# state file: batches, restarts against the folder and a failed write
+# leaving the last state file whole.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import json
+import os
+import stat
+import pytest
+
+import triggerPublisher
+from triggerPublisher import TriggerPublisher, default_state_file, state_format
+
+
+@pytest.fixture
+def folder(tmp_path):
+    result = tmp_path / "triggers"
+    result.mkdir()
+    return result
+
+
+@pytest.fixture
+def publisher(folder):
+    result = TriggerPublisher(str(folder), 0o644)
+    yield result
+    result.close()
+
+
+##############################################################################
+#  state - the state file as written
+##############################################################################
+def state(folder):
+    with open(folder / default_state_file) as file:
+        return json.load(file)
+
+
+##############################################################################
+#  triggers - the trigger files in the folder
+##############################################################################
+def triggers(folder):
+    return sorted(name for name in os.listdir(folder) if name.startswith(".") == False)
+
+
+##############################################################################
+#  notifications - a TriggerNotifier stand in keeping what it is told
+##############################################################################
+class notifications(list):
+    def publish(self, version, changes):
+        self.append( (version, dict(changes)) )
+
+
+def test_batch_is_one_version(publisher, folder):
+    with publisher.batch():
+        publisher.set_state("cheap", True)
+        publisher.set_state("mid", False)
+        publisher.set_state("dear", True)
+        # nothing is published until the batch ends
+        assert triggers(folder) == []
+    assert triggers(folder) == ["cheap", "dear"]
+    written = state(folder)
+    assert written["format"] == state_format
+    assert written["version"] == 1
+    assert written["triggers"] == { "cheap" : True, "mid" : False, "dear" : True }
+    assert stat.S_IMODE(os.stat(folder / "cheap").st_mode) == 0o644
+
+
+def test_nested_batches_publish_once(publisher, folder):
+    with publisher.batch():
+        publisher.set_state("cheap", True)
+        with publisher.batch():
+            publisher.set_state("dear", True)
+        assert triggers(folder) == []
+    assert state(folder)["version"] == 1
+
+
+def test_no_change_is_not_written(publisher, folder):
+    publisher.set_state("cheap", True)
+    assert publisher.commit() == 0
+    publisher.set_state("cheap", True)
+    with publisher.batch():
+        # a change undone in the same batch is no change
+        publisher.set_state("cheap", False)
+        publisher.set_state("cheap", True)
+    assert state(folder)["version"] == 1
+
+
+def test_outside_a_batch_each_change_is_published(publisher, folder):
+    publisher.set_state("cheap", True)
+    publisher.set_state("cheap", False)
+    assert triggers(folder) == []
+    assert state(folder) == dict(state(folder), version=2, triggers={ "cheap" : False })
+
+
+def test_discard_forgets_the_trigger(publisher, folder):
+    with publisher.batch():
+        publisher.set_state("cheap", True)
+        publisher.set_state("mid", False)
+    publisher.discard("cheap")
+    publisher.discard("mid")
+    assert triggers(folder) == []
+    assert state(folder)["triggers"] == {}
+
+
+def test_no_temporary_files_are_left(publisher, folder):
+    for index in range(5):
+        publisher.set_state(f"t{index}", True)
+    assert sorted(os.listdir(folder)) == [default_state_file] + [ f"t{index}" for index in range(5) ]
+
+
+def test_failed_write_keeps_the_last_state(publisher, folder, monkeypatch):
+    publisher.set_state("cheap", True)
+    before = (folder / default_state_file).read_bytes()
+
+    def replace(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(triggerPublisher.os, "replace", replace)
+    publisher.set_state("dear", True)
+    assert (folder / default_state_file).read_bytes() == before
+    assert triggers(folder) == ["cheap", "dear"]
+    assert sorted(os.listdir(folder)) == [default_state_file, "cheap", "dear"]
+
+    # the state file catches up on the next commit
+    monkeypatch.undo()
+    assert publisher.commit() == 0
+    assert state(folder)["triggers"] == { "cheap" : True, "dear" : True }
+
+
+def test_restart_carries_on(publisher, folder):
+    with publisher.batch():
+        publisher.set_state("cheap", True)
+        publisher.set_state("mid", False)
+    restarted = TriggerPublisher(str(folder), 0o644)
+    assert restarted.states == { "cheap" : True, "mid" : False }
+    assert restarted.stale == False
+    restarted.set_state("mid", True)
+    assert state(folder)["version"] == 2
+    restarted.close()
+
+
+def test_restart_follows_the_folder(publisher, folder):
+    with publisher.batch():
+        publisher.set_state("cheap", True)
+        publisher.set_state("dear", True)
+    # the files changed while nothing was running
+    os.unlink(folder / "cheap")
+    (folder / "free").touch()
+    restarted = TriggerPublisher(str(folder), 0o644)
+    assert restarted.states == { "cheap" : False, "dear" : True, "free" : True }
+    assert restarted.stale == True
+    assert restarted.commit() == 0
+    assert state(folder) == dict(state(folder), version=2, triggers={ "cheap" : False, "dear" : True, "free" : True })
+    restarted.close()
+
+
+def test_unreadable_state_file(folder):
+    (folder / default_state_file).write_text("{ not json")
+    (folder / "cheap").touch()
+    publisher = TriggerPublisher(str(folder), 0o644)
+    assert publisher.states == { "cheap" : True }
+    publisher.commit()
+    assert state(folder)["triggers"] == { "cheap" : True }
+    publisher.close()
+
+
+def test_notifier_is_told_each_batch(publisher):
+    publisher.set_state("cheap", True)
+    told = notifications()
+    # starts with what is already published
+    publisher.set_notifier(told)
+    with publisher.batch():
+        publisher.set_state("cheap", False)
+        publisher.set_state("dear", True)
+    publisher.discard("dear")
+    assert told == [ (1, { "cheap" : True }), (2, { "cheap" : False, "dear" : True }), (3, { "dear" : None }) ]
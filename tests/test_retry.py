@@ -0,0 +1,122 @@
+########################################################################
+# test_retry.py - OctopusAgileAPI retrying throttled and failed calls
+# against the octopusStub: Retry-After, backoff, giving up and the
+# calls that are not retried.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import pytest
+
+import agileAPI
+from agileTools import time_now
+
+# a settled day of readings - one window, one page
+day = time_now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=5)
+
+
+##############################################################################
+#  sleeps - the delays the API waits between attempts - nothing is slept
+##############################################################################
+@pytest.fixture
+def sleeps(monkeypatch):
+    result = []
+    monkeypatch.setattr(agileAPI.time, "sleep", result.append)
+    return result
+
+
+##############################################################################
+#  script - make the stub answer with statuses in turn (None is a normal
+#  answer) and normally once they run out
+##############################################################################
+def script(monkeypatch, stub, statuses):
+    statuses = iter(statuses)
+    monkeypatch.setattr(stub, "inject", lambda: next(statuses, None))
+
+
+##############################################################################
+#  fetch - the results of the day's readings (None if the call failed)
+##############################################################################
+def fetch(api):
+    return [ results for (first, last, results) in api.iter_usage(day, day + timedelta(days=1)) ][0]
+
+
+def test_throttle_honours_retry_after(make_api, stub, sleeps, monkeypatch):
+    stub.configure(retry_after=7)
+    script(monkeypatch, stub, [429, 429])
+    api = make_api()
+    assert len(fetch(api)) == 48
+    assert sleeps == [7.0, 7.0]
+    assert stub.stats == { 429 : 2, 200 : 1 }
+    stats = api.get_stats()
+    assert (stats["requests"], stats["attempts"], stats["retries"], stats["failures"]) == (1, 3, 2, 0)
+
+
+def test_retry_after_is_capped(make_api, stub, sleeps, monkeypatch):
+    stub.configure(retry_after=3600)
+    script(monkeypatch, stub, [429])
+    assert len(fetch(make_api())) == 48
+    assert sleeps == [agileAPI.default_api_backoff_cap]
+
+
+def test_errors_back_off(make_api, stub, sleeps, monkeypatch):
+    script(monkeypatch, stub, [500, 503, 500, 500])
+    api = make_api(settings={ "api_backoff" : 0.5 })
+    assert len(fetch(api)) == 48
+    # full jitter - up to the doubling delay for each attempt
+    assert len(sleeps) == 4
+    for (attempt, delay) in enumerate(sleeps):
+        assert 0 <= delay <= 0.5 * 2 ** attempt
+
+
+def test_gives_up_after_the_retries(make_api, stub, sleeps, monkeypatch):
+    script(monkeypatch, stub, [500] * 10)
+    api = make_api(settings={ "api_retries" : 3 })
+    assert fetch(api) == None
+    assert stub.stats == { 500 : 3 }
+    assert len(sleeps) == 2
+    stats = api.get_stats()
+    assert (stats["attempts"], stats["retries"], stats["failures"]) == (3, 2, 1)
+
+
+def test_client_errors_are_not_retried(make_api, stub, sleeps):
+    stub.configure(api_key="another_key")
+    api = make_api()
+    assert fetch(api) == None
+    assert stub.stats == { 401 : 1 }
+    assert sleeps == []
+    assert api.get_stats()["failures"] == 1
+
+
+##############################################################################
+#  throttled - a 429 response with a Retry-After header
+##############################################################################
+class throttled:
+    status_code = 429
+
+    def __init__(self, retry_after):
+        self.headers = { "Retry-After" : retry_after }
+
+
+def test_retry_after_as_a_date(make_api):
+    api = make_api()
+    retry_delay = api._OctopusAgileAPI__retry_delay
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 <= retry_delay(1, throttled(format_datetime(when, usegmt=True))) <= 30
+    # a date in the past is no wait at all and one that can not be read backs off
+    assert retry_delay(1, throttled(format_datetime(when - timedelta(hours=1), usegmt=True))) == 0
+    assert 0 <= retry_delay(1, throttled("soon")) <= agileAPI.default_api_backoff
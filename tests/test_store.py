@@ -0,0 +1,109 @@
+########################################################################
+# test_store.py - the memory mapped cost and usage columns of
+# OctopusAgileStore and the loaders keeping them in step with agile_data.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from agileStore import OctopusAgileStore, store_chunk
+from agileDB import OctopusAgileDB, empty_rate
+
+
+##############################################################################
+#  settings - a config stand in with just the store settings
+##############################################################################
+class settings:
+    def __init__(self, values):
+        self.values = values
+
+    def read_value(self, section, field):
+        return self.values.get( (section, field) )
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OctopusAgileStore(settings({ ("filepaths", "store_folder") : str(tmp_path / "store") }))
+
+
+@pytest.fixture
+def agile_db(config, tmp_path):
+    config.config["filepaths"]["store_folder"] = str(tmp_path / "dbstore")
+    result = OctopusAgileDB(config)
+    result.initialise_agile_db()
+    return result
+
+
+def test_values_read_back(store):
+    assert store.write_values("cost", [ (10, 1.5), (12, 2.5), (11, empty_rate) ]) == 3
+    (cost, usage) = store.get_period_range(9, 14)
+    assert numpy.array_equal(cost, [numpy.nan, 1.5, numpy.nan, 2.5, numpy.nan], equal_nan=True)
+    assert numpy.isnan(usage).all()
+
+
+def test_files_grow_a_chunk_at_a_time(store, tmp_path):
+    store.write_values("cost", [ (5, 1.0) ])
+    path = tmp_path / "store" / "cost.float64"
+    assert path.stat().st_size == store_chunk * 8
+    store.write_values("cost", [ (store_chunk + 1, 2.0) ])
+    assert path.stat().st_size == 2 * store_chunk * 8
+    (cost, usage) = store.get_period_range(0, store_chunk + 2)
+    assert cost[5] == 1.0 and cost[store_chunk + 1] == 2.0
+
+
+def test_range_past_the_data_is_padded(store):
+    store.write_values("cost", [ (0, 3.0) ])
+    (cost, usage) = store.get_period_range(-2, store_chunk + 2)
+    assert len(cost) == store_chunk + 4
+    assert cost[2] == 3.0
+    assert numpy.isnan(cost[:2]).all() and numpy.isnan(cost[-2:]).all()
+
+
+def test_views_are_read_only(store):
+    store.write_values("cost", [ (1, 4.0) ])
+    (cost, usage) = store.get_period_range(0, 10)
+    assert cost.flags.writeable == False
+    with pytest.raises(ValueError):
+        cost[1] = 0.0
+    # and writes still reach readers that mapped the file earlier
+    store.write_values("cost", [ (1, 5.0) ])
+    assert cost[1] == 5.0
+
+
+def test_another_store_sees_the_writes(store, tmp_path):
+    reader = OctopusAgileStore(settings({ ("filepaths", "store_folder") : str(tmp_path / "store") }))
+    store.write_values("usage", [ (3, 0.5) ])
+    assert reader.get_period_range(3, 4)[1][0] == 0.5
+    # grown by the writer after the reader mapped it
+    store.write_values("usage", [ (store_chunk * 3, 0.25) ])
+    assert reader.get_period_range(store_chunk * 3, store_chunk * 3 + 1)[1][0] == 0.25
+
+
+def test_loaders_keep_the_store_in_step(agile_db):
+    agile_db.create_db_period_costs([ (1000 + index, 10.0 + index) for index in range(96) ], batch_size=10)
+    agile_db.update_db_period_usages([ (1000 + index, 0.5) for index in range(50) ])
+    agile_db.create_db_period_costs([ (1001, 99.0) ], upsert=True)
+
+    (cost, usage) = agile_db.store.get_period_range(1000, 1096)
+    assert cost[0] == 10.0 and cost[1] == 99.0 and cost[95] == 105.0
+    assert (usage[:50] == 0.5).all() and numpy.isnan(usage[50:]).all()
+
+    agile_db.rebuild_store()
+    (rebuilt_cost, rebuilt_usage) = agile_db.store.get_period_range(1000, 1096)
+    assert numpy.array_equal(cost, rebuilt_cost, equal_nan=True)
+    assert numpy.array_equal(usage, rebuilt_usage, equal_nan=True)
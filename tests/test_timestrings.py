@@ -0,0 +1,88 @@
+########################################################################
+# test_timestrings.py - periodnos_from_timestrings against a full ISO-8601
+# parse for the zone and fraction forms the Octopus API returns.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from datetime import datetime, timedelta, timezone
+import pytest
+
+from agileTools import periodnos_from_timestrings, gen_periodno_date, period_epoch
+
+
+##############################################################################
+#  reference_periodno - the periodno of a timestring by a full parse
+##############################################################################
+def reference_periodno(text):
+    dateobj = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if dateobj.tzinfo != None:
+        dateobj = dateobj.astimezone(timezone.utc).replace(tzinfo=None)
+    return gen_periodno_date(dateobj)
+
+
+@pytest.mark.parametrize("text", [
+    # rates are reported in UTC
+    "2021-01-31T23:30:00Z",
+    "2021-06-15T12:00:00Z",
+    # the first period of the epoch
+    "2020-01-01T00:00:00Z",
+    # consumption is reported in UK local time - BST is +01:00
+    "2021-06-15T12:30:00+01:00",
+    "2021-10-31T01:30:00+01:00",
+    "2021-10-31T01:30:00Z",
+    # fractions of a second
+    "2021-03-28T02:00:00.000Z",
+    "2021-03-28T02:00:00.123456+01:00",
+    # no zone at all is UTC
+    "2021-03-01T00:30:00",
+    ])
+def test_matches_a_full_parse(text):
+    assert periodnos_from_timestrings([text]) == [reference_periodno(text)]
+
+
+@pytest.mark.parametrize("text, utc", [
+    # an offset ahead of UTC takes the first hour back over midnight ...
+    ("2021-07-01T00:00:00+01:00", datetime(2021, 6, 30, 23, 0)),
+    ("2021-07-01T00:30:00+01:00", datetime(2021, 6, 30, 23, 30)),
+    # ... over a month and a year end
+    ("2022-01-01T00:30:00+01:00", datetime(2021, 12, 31, 23, 30)),
+    # an offset behind UTC takes the last hours forward to the next day
+    ("2021-12-31T23:30:00-05:00", datetime(2022, 1, 1, 4, 30)),
+    # offsets that are not whole hours
+    ("2021-06-15T00:00:00+05:30", datetime(2021, 6, 14, 18, 30)),
+    ("2021-06-15T23:30:00-09:30", datetime(2021, 6, 16, 9, 0)),
+    ])
+def test_offsets_cross_midnight(text, utc):
+    assert periodnos_from_timestrings([text]) == [gen_periodno_date(utc)]
+
+
+def test_a_day_of_bst_consumption_in_order():
+    # 48 local half hours of a summer day are the 48 UTC ones an hour earlier
+    local = datetime(2021, 7, 1)
+    texts = [ (local + timedelta(minutes=30 * index)).strftime("%Y-%m-%dT%H:%M:%S+01:00") for index in range(48) ]
+    first = gen_periodno_date(local - timedelta(hours=1))
+    assert periodnos_from_timestrings(texts) == list(range(first, first + 48))
+
+
+def test_mixed_zones_in_one_call():
+    # the memoised day and zone lookups must not leak between entries
+    texts = [ "2021-06-15T12:00:00Z", "2021-06-15T12:00:00+01:00",
+              "2021-06-16T12:00:00.5Z", "2021-06-15T12:00:00-01:00" ]
+    assert periodnos_from_timestrings(texts) == [ reference_periodno(text) for text in texts ]
+
+
+def test_epoch_is_period_zero():
+    assert periodnos_from_timestrings([period_epoch.strftime("%Y-%m-%dT%H:%M:%SZ")]) == [0]
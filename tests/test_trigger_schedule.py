@@ -0,0 +1,136 @@
+########################################################################
+# test_trigger_schedule.py - compile_trigger_schedule and the queries
+# the checkTriggers daemon replays it with, including triggers added and
+# deleted after the schedule is built.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import pytest
+
+from agileDB import OctopusAgileDB
+from agileTriggers import costTriggers
+
+# any period will do - the schedule only looks forward from it
+p0 = 40000
+
+
+##############################################################################
+#  prices - a database with cheap (10p), mid (15p) and dear (20p) triggers
+#  and four prices from p0. A trigger is on while the price is below it
+##############################################################################
+@pytest.fixture
+def prices(config):
+    agile_db = OctopusAgileDB(config)
+    agile_db.initialise_agile_db()
+    triggers = costTriggers(config)
+    triggers.initialise_trigger_db()
+    for (name, cost) in (("cheap", 10.0), ("mid", 15.0), ("dear", 20.0)):
+        assert triggers.add_new_trigger(name, cost) == True
+    agile_db.create_db_period_costs([(p0, 12.0), (p0+1, 12.0), (p0+2, 16.0), (p0+3, 5.0)])
+    return (agile_db, triggers)
+
+
+def test_compile_writes_only_changes(prices):
+    (agile_db, triggers) = prices
+    assert triggers.compile_trigger_schedule(agile_db, p0) == 9
+
+    events = triggers.get_trigger_events(p0 - 1, p0 + 10)
+    assert [ tuple(event) for event in events ] == [
+        # every trigger gets its state in the first period
+        (p0, "cheap", 0), (p0, "dear", 1), (p0, "mid", 1),
+        # 12p to 16p - only mid changes
+        (p0+2, "mid", 0),
+        # 16p to 5p
+        (p0+3, "cheap", 1), (p0+3, "mid", 1),
+        # the prices run out - everything stops
+        (p0+4, "cheap", 0), (p0+4, "dear", 0), (p0+4, "mid", 0) ]
+
+
+def test_states_and_next_event(prices):
+    (agile_db, triggers) = prices
+    triggers.compile_trigger_schedule(agile_db, p0)
+
+    assert triggers.get_trigger_states(p0) == { "cheap" : 0, "mid" : 1, "dear" : 1 }
+    assert triggers.get_trigger_states(p0 + 2) == { "cheap" : 0, "mid" : 0, "dear" : 1 }
+    assert triggers.get_trigger_states(p0 + 3) == { "cheap" : 1, "mid" : 1, "dear" : 1 }
+    assert triggers.get_next_trigger_event(p0) == p0 + 2
+    assert triggers.get_next_trigger_event(p0 + 2) == p0 + 3
+    assert triggers.get_next_trigger_event(p0 + 4) == None
+
+
+def test_gap_in_prices_stops_everything(prices):
+    (agile_db, triggers) = prices
+    agile_db.create_db_period_costs([(p0 + 6, 5.0)])
+    triggers.compile_trigger_schedule(agile_db, p0)
+
+    assert triggers.get_trigger_states(p0 + 5) == { "cheap" : 0, "mid" : 0, "dear" : 0 }
+    assert triggers.get_trigger_states(p0 + 6) == { "cheap" : 1, "mid" : 1, "dear" : 1 }
+    assert triggers.get_trigger_states(p0 + 7) == { "cheap" : 0, "mid" : 0, "dear" : 0 }
+
+
+def test_events_after_exclusive_upto_inclusive(prices):
+    (agile_db, triggers) = prices
+    triggers.compile_trigger_schedule(agile_db, p0)
+
+    events = triggers.get_trigger_events(p0, p0 + 2)
+    assert [ tuple(event) for event in events ] == [ (p0+2, "mid", 0) ]
+    assert triggers.get_trigger_events(p0 + 4, p0 + 100) == []
+
+
+def test_added_trigger_is_scheduled(prices):
+    (agile_db, triggers) = prices
+    triggers.compile_trigger_schedule(agile_db, p0)
+    assert triggers.add_new_trigger("free", 0.0) == True
+    triggers.compile_trigger_schedule(agile_db, p0)
+
+    assert triggers.get_trigger_states(p0)["free"] == 0
+    events = triggers.get_trigger_events(p0, p0 + 10)
+    assert [ tuple(event) for event in events if event[1] == "free" ] == []
+
+
+def test_deleted_trigger_is_unscheduled(prices):
+    (agile_db, triggers) = prices
+    triggers.compile_trigger_schedule(agile_db, p0)
+    assert triggers.del_trigger("mid") == True
+    triggers.compile_trigger_schedule(agile_db, p0)
+
+    assert triggers.get_trigger_states(p0) == { "cheap" : 0, "dear" : 1 }
+    events = triggers.get_trigger_events(p0 - 1, p0 + 10)
+    assert "mid" not in [ event[1] for event in events ]
+    # mid was the only change at p0+2
+    assert triggers.get_next_trigger_event(p0) == p0 + 3
+
+
+def test_resync_removes_deleted_trigger_file(prices, config):
+    (agile_db, triggers) = prices
+    triggers.compile_trigger_schedule(agile_db, p0)
+    triggers.apply_trigger_states(triggers.get_trigger_states(p0), True)
+    folder = triggers.triggerFolder
+    assert sorted(name for name in os.listdir(folder) if name.startswith(".") == False) == ["dear", "mid"]
+
+    triggers.del_trigger("mid")
+    triggers.compile_trigger_schedule(agile_db, p0)
+    # the daemon resyncs from a fresh read of the schedule
+    triggers.reset_trigger_state()
+    triggers.apply_trigger_states(triggers.get_trigger_states(p0), True)
+
+    assert sorted(name for name in os.listdir(folder) if name.startswith(".") == False) == ["dear"]
+    assert "mid" not in triggers.publisher.states
+
+    # a new daemon picks the trigger files up from the folder
+    restarted = costTriggers(config)
+    assert restarted.publisher.states == { "cheap" : False, "dear" : True }
@@ -20,6 +20,9 @@
 
 from config import configFile,buildFilePath
 from agileTriggers import costTriggers
+from agileDB import OctopusAgileDB
+from agileTools import trigger_pidfile, trigger_socket, wake_trigger_daemon, gen_periodno_date, time_now
+from triggerNotify import watch_triggers
 from mylogger import mylogger
 from datetime import datetime
 import sys
@@ -120,6 +123,37 @@ def  list_trigger(my_triggers, trigger_name):
 
     return result
 
+############################################################################
+# watch_trigger print each trigger change pushed by checkTriggers until
+# interrupted
+############################################################################
+def  watch_trigger(socket_path, trigger_name):
+    log.debug("STARTED  watch_trigger")
+    result = False
+
+    if socket_path == None:
+        print("watchtrigger - trigger_socket is disabled in the config")
+        raise sys.exit(1)
+
+    try:
+        for event in watch_triggers(socket_path):
+            updated = datetime.fromtimestamp(event["updated"]).strftime("%Y-%m-%d %H:%M:%S")
+            for (name, state) in sorted(event["triggers"].items()):
+                if trigger_name == None or trigger_name == name:
+                    if state == None: state = "removed"
+                    elif state == True: state = "started"
+                    else: state = "stopped"
+                    print(f"{updated}	{event['event']:8s}	{name:20s}	{state}", flush=True)
+        result = True
+    except OSError as error:
+        print(f"Failed to watch triggers - is checkTriggers running? [{error}]")
+    except KeyboardInterrupt:
+        result = True
+
+    log.debug("FINISHED watch_trigger")
+
+    return result
+
 ############################################################################
 #  setup config
 ############################################################################
@@ -176,6 +210,8 @@ group.add_argument("-L", "--list", action="store_true",
                     help="List Triggers")
 group.add_argument("-U", "--update", action="store_true",
                     help="List Triggers")
+group.add_argument("-W", "--watch", action="store_true",
+                    help="Watch the triggers start and stop")
 parser.add_argument("-t", "--trigger", type=str,
                     help="trigger name")
 parser.add_argument("-c", "--cost", type=float,
@@ -201,8 +237,15 @@ if args.list == True:
 if args.update == True:
     update_trigger(my_triggers,args.trigger,args.cost)
     command=True
+if args.watch == True:
+    watch_trigger(trigger_socket(config),args.trigger)
+    command=True
 
 if command == False:
    print ("use trigger --help for more information")
+elif args.list == False and args.watch == False:
+   # the triggers have changed - rebuild the schedule and have checkTriggers act on it now
+   my_triggers.compile_trigger_schedule(OctopusAgileDB(config,log), gen_periodno_date(time_now()))
+   wake_trigger_daemon(trigger_pidfile(config))
 
 
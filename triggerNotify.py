@@ -0,0 +1,256 @@
+########################################################################
+# triggerNotify.py - Core library file for a publish / subscribe channel
+# for trigger state changes. The trigger daemon listens on a unix domain
+# socket and every subscriber is sent newline delimited JSON - first a
+# snapshot of every trigger then one event per published change - so a
+# device controller can block on the socket instead of polling the
+# trigger folder. The socket is served by an asyncio loop on its own
+# thread; each subscriber has a bounded queue and one that falls behind
+# is dropped rather than holding up the triggers.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from mylogger import nulLogger
+import threading
+import asyncio
+import socket
+import json
+import time
+import os
+
+# events queued for a subscriber before it is dropped as too slow
+default_queue_size = 256
+
+
+class TriggerNotifier:
+# the socket path and its permissions
+    path       = None
+    perms      = 0o660
+# the loop serving the socket and the thread running it
+    loop       = None
+    thread     = None
+    server     = None
+# the task serving each connected subscriber keyed by its queue
+    subscribers = None
+    queue_size = default_queue_size
+# seconds subscribers are given to finish when we stop
+    shutdown_wait = 1.0
+# the state of every trigger as last published (sent as the snapshot)
+    states     = None
+    version    = 0
+# connected, dropped and sent counts
+    stats      = None
+# logging
+    log        = None
+
+##############################################################################
+#  __init__ - serve subscribers on the unix socket at path
+##############################################################################
+    def __init__(self, path, theLogger=None, queue_size=None):
+        # initialise the logfile
+        if theLogger == None:
+            theLogger = nulLogger()
+
+        self.log = theLogger
+
+        self.log.debug("STARTED TriggerNotifier __init__")
+        self.path = path
+        if queue_size != None:
+            self.queue_size = queue_size
+        self.subscribers = {}
+        self.states = {}
+        self.stats = { "connected" : 0, "dropped" : 0, "events" : 0 }
+        self.log.debug("FINISHED TriggerNotifier __init__")
+
+##############################################################################
+#  start - start serving on a background thread. returns True once the
+#  socket is listening
+##############################################################################
+    def start(self):
+        result = False
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.__run, args=(ready,), name="triggerNotify", daemon=True)
+        self.thread.start()
+        ready.wait()
+        result = self.server != None
+        return result
+
+##############################################################################
+#  __run - the notifier thread - run the loop until stop
+##############################################################################
+    def __run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            # a socket left by a daemon that died is in the way
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.server = self.loop.run_until_complete(asyncio.start_unix_server(self.__subscriber, path=self.path))
+            os.chmod(self.path, self.perms)
+            self.log.info(f"trigger notifications on {self.path}")
+        except OSError as error:
+            self.log.error(f"Failed to listen on {self.path} [{error}]")
+            self.server = None
+        ready.set()
+
+        if self.server != None:
+            self.loop.run_forever()
+        self.loop.close()
+
+##############################################################################
+#  stop - close every subscriber and the socket
+##############################################################################
+    def stop(self):
+        if self.thread != None and self.thread.is_alive():
+            # without a server the thread is already on its way out
+            if self.server != None:
+                asyncio.run_coroutine_threadsafe(self.__shutdown(), self.loop).result()
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+##############################################################################
+#  __shutdown - let each subscriber send what it has queued then end it -
+#  one that can not in shutdown_wait seconds is cut off (runs on the loop)
+##############################################################################
+    async def __shutdown(self):
+        self.server.close()
+        tasks = list(self.subscribers.values())
+        for queue in list(self.subscribers):
+            self.__drop(queue)
+        if tasks:
+            (done, pending) = await asyncio.wait(tasks, timeout=self.shutdown_wait)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+##############################################################################
+#  publish - queue a change for every subscriber - called from any thread.
+#  changes is a dict of trigger_name : state (None for a removed trigger)
+##############################################################################
+    def publish(self, version, changes):
+        if self.loop != None and self.server != None:
+            event = { "event" : "change", "version" : version, "updated" : time.time(),
+                      "triggers" : dict(changes) }
+            self.loop.call_soon_threadsafe(self.__broadcast, event)
+
+##############################################################################
+#  __broadcast - add an event to every subscriber queue (runs on the loop).
+#  only triggers that really changed are sent - a resync of the daemon
+#  publishes every trigger again. a subscriber whose queue is full is dropped
+##############################################################################
+    def __broadcast(self, event):
+        self.version = event["version"]
+        changes = {}
+        for (name, state) in event["triggers"].items():
+            if self.states.get(name) != state:
+                changes[name] = state
+            if state == None:
+                self.states.pop(name, None)
+            else:
+                self.states[name] = state
+        if not changes:
+            return
+        event["triggers"] = changes
+        self.stats["events"] += 1
+
+        line = (json.dumps(event, sort_keys=True) + "\n").encode()
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(line)
+            except asyncio.QueueFull:
+                self.log.error("dropping a trigger subscriber that is not keeping up")
+                self.stats["dropped"] += 1
+                self.__drop(queue, abort=True)
+
+##############################################################################
+#  __drop - stop sending to a subscriber - None in its queue ends it. abort
+#  also cuts the connection so a subscriber stuck on a full socket ends
+##############################################################################
+    def __drop(self, queue, abort=False):
+        task = self.subscribers.pop(queue, None)
+        if task != None:
+            if abort == True:
+                task.cancel()
+            else:
+                # make room for the end marker
+                while queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+##############################################################################
+#  __subscriber - serve one subscriber - the snapshot then each event
+##############################################################################
+    async def __subscriber(self, reader, writer):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[queue] = asyncio.current_task()
+        self.stats["connected"] += 1
+        snapshot = { "event" : "snapshot", "version" : self.version, "updated" : time.time(),
+                     "triggers" : dict(self.states) }
+        queue.put_nowait((json.dumps(snapshot, sort_keys=True) + "\n").encode())
+
+        # notice the subscriber going away while we wait for events
+        closed = asyncio.ensure_future(reader.read())
+        getter = None
+        aborted = False
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done() == False:
+                    break
+                line = getter.result()
+                if line == None:
+                    break
+                writer.write(line)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            aborted = True
+        except asyncio.CancelledError:
+            # dropped - do not wait to send what is still buffered
+            aborted = True
+        finally:
+            self.subscribers.pop(queue, None)
+            closed.cancel()
+            if getter != None:
+                getter.cancel()
+            if aborted == True:
+                writer.transport.abort()
+            else:
+                writer.close()
+
+##############################################################################
+#  get_stats - subscribers connected now and connected, dropped, events counts
+##############################################################################
+    def get_stats(self):
+        result = dict(self.stats)
+        result["subscribers"] = len(self.subscribers)
+        return result
+
+
+##############################################################################
+#  watch_triggers - subscribe to the notifier at path and yield each event
+#  (a dict) as it arrives - the first is the snapshot
+##############################################################################
+def watch_triggers(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        with connection.makefile("r") as lines:
+            for line in lines:
+                yield json.loads(line)
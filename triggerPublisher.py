@@ -0,0 +1,227 @@
+########################################################################
+# triggerPublisher.py - Core library file that publishes the state of the
+# agile triggers. Each trigger is a file in the trigger folder that
+# exists while the trigger is started - these are created and removed
+# through one open descriptor of the folder rather than by path. The
+# changes of a check are batched and then the whole state is written to
+# a single versioned JSON file that is swapped in atomically, so a
+# reader sees all of one check or all of the next and never a mixture.
+# Each batch can also be pushed to subscribers by a TriggerNotifier.
+#
+# Copyright 2020 Simon McKenna.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#    You may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+from mylogger import nulLogger
+from contextlib import contextmanager
+import json
+import time
+import os
+
+# the state file in the trigger folder when [filepaths] trigger_state_file
+# is not set - a dot file so it is not mistaken for a trigger
+default_state_file = ".trigger_state.json"
+# layout of the state file - bumped if the layout changes
+state_format = 1
+
+
+class TriggerPublisher:
+# the trigger folder, its permissions and the open descriptor of it
+    folder     = None
+    perms      = None
+    dir_fd     = None
+# name of the state file in the folder
+    state_file = default_state_file
+# the state published for each trigger (True started)
+    states     = None
+# changes waiting for the end of the batch
+    pending    = None
+    depth      = 0
+# bumped every time the state file is written
+    version    = 0
+# the state file does not match the folder - write it on the next commit
+    stale      = False
+# told of each published batch (a TriggerNotifier) or None
+    notifier   = None
+# logging
+    log        = None
+
+##############################################################################
+#  __init__ - publish into folder, files are created with perms
+##############################################################################
+    def __init__(self, folder, perms, state_file=None, theLogger=None):
+        # initialise the logfile
+        if theLogger == None:
+            theLogger = nulLogger()
+
+        self.log = theLogger
+
+        self.log.debug("STARTED TriggerPublisher __init__")
+        self.folder = folder
+        self.perms = perms
+        if state_file != None:
+            self.state_file = state_file
+        self.pending = {}
+        self.__load_states()
+        self.log.debug("FINISHED TriggerPublisher __init__")
+
+##############################################################################
+#  __open - the descriptor of the trigger folder, opened on first use
+##############################################################################
+    def __open(self):
+        if self.dir_fd == None:
+            self.dir_fd = os.open(self.folder, os.O_RDONLY | os.O_DIRECTORY)
+        return self.dir_fd
+
+##############################################################################
+#  close - close the folder descriptor
+##############################################################################
+    def close(self):
+        if self.dir_fd != None:
+            os.close(self.dir_fd)
+            self.dir_fd = None
+
+##############################################################################
+#  __load_states - start from what is in the trigger folder. A trigger is
+#  started if its file exists and stopped if the state file lists it but
+#  there is no file. The version carries on from the state file, which is
+#  written again on the next commit if it does not match the folder
+##############################################################################
+    def __load_states(self):
+        published = {}
+        self.version = 0
+        try:
+            with open(os.path.join(self.folder, self.state_file)) as file:
+                state = json.load(file)
+            self.version = int(state.get("version", 0))
+            published = dict(state.get("triggers", {}))
+        except (OSError, ValueError, AttributeError, TypeError):
+            published = {}
+
+        self.states = {}
+        for name in os.listdir(self.__open()):
+            if name.startswith(".") == False and name != self.state_file and name.startswith(self.state_file + ".") == False:
+                self.states[name] = True
+        for name in published:
+            self.states.setdefault(name, False)
+        self.stale = self.states != published
+        if self.stale == True:
+            self.log.info("trigger state file does not match the trigger folder - it will be rewritten")
+
+##############################################################################
+#  set_notifier - tell notifier (a TriggerNotifier) of every published batch
+#  starting with the state already published
+##############################################################################
+    def set_notifier(self, notifier):
+        self.notifier = notifier
+        if notifier != None and self.states:
+            notifier.publish(self.version, self.states)
+
+##############################################################################
+#  batch - collect the changes made inside the with block and publish them
+#  together when it ends. batches nest - the outermost one publishes
+##############################################################################
+    @contextmanager
+    def batch(self):
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.commit()
+
+##############################################################################
+#  set_state - start (True) or stop (False) a trigger. Nothing is done if
+#  it already has that state. Outside a batch it is published at once
+##############################################################################
+    def set_state(self, trigger_name, state):
+        if self.states.get(trigger_name) != state:
+            self.pending[trigger_name] = state
+        else:
+            self.pending.pop(trigger_name, None)
+        if self.depth == 0:
+            self.commit()
+
+##############################################################################
+#  discard - stop a trigger and leave it out of the state file
+##############################################################################
+    def discard(self, trigger_name):
+        self.set_state(trigger_name, None)
+
+##############################################################################
+#  commit - apply the waiting changes to the trigger files then write the
+#  state file (also if it is stale). returns the number of triggers changed
+##############################################################################
+    def commit(self):
+        result = 0
+        if self.pending or self.stale == True:
+            dir_fd = self.__open()
+            for (name, state) in self.pending.items():
+                if state == True:
+                    try:
+                        os.mknod(name, self.perms, dir_fd=dir_fd)
+                    except FileExistsError:
+                        pass
+                    self.states[name] = True
+                else:
+                    try:
+                        os.unlink(name, dir_fd=dir_fd)
+                    except FileNotFoundError:
+                        pass
+                    if state == None:
+                        self.states.pop(name, None)
+                    else:
+                        self.states[name] = False
+            changes = self.pending
+            result = len(changes)
+            self.pending = {}
+            self.__write_state()
+            if self.notifier != None:
+                self.notifier.publish(self.version, changes)
+            self.log.debug(f"published {result} trigger changes version {self.version}")
+        return result
+
+##############################################################################
+#  __write_state - write the state of every trigger to a temporary file,
+#  flush it to disk and rename it over the state file. A failed write 
+#  leaves the last state file in place and marks it stale
+##############################################################################
+    def __write_state(self):
+        dir_fd = self.__open()
+        self.version += 1
+        state = { "format" : state_format, "version" : self.version, "updated" : time.time(),
+                  "triggers" : self.states }
+        data = json.dumps(state, sort_keys=True).encode()
+
+        temporary = f"{self.state_file}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, self.perms & 0o666, dir_fd=dir_fd)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(temporary, self.state_file, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+            # make the rename itself durable
+            os.fsync(dir_fd)
+            self.stale = False
+        except OSError as error:
+            self.log.error(f"Failed to write trigger state file [{error}]")
+            # try again on the next commit
+            self.stale = True
+            try:
+                os.unlink(temporary, dir_fd=dir_fd)
+            except OSError:
+                pass